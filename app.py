@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 
+from config import Config
 from models.user import User
 from controllers.user import create_user
-from routes import auth, excursion, object, statistics, user,track
+from database.connection import close_client
+from database.indexes import ensure_indexes
+from routes import auth, excursion, metrics, object, statistics, user,track
 from utils.auth import get_hash_password
 
 app = FastAPI(title="Excursion-Service",
@@ -19,3 +22,15 @@ app.include_router(excursion.router, prefix='/excursion')
 app.include_router(track.router, prefix='/track')
 app.include_router(statistics.router, prefix='/statistics')
 app.include_router(object.router, prefix='/object')
+app.include_router(metrics.router)
+
+
+@app.on_event('startup')
+def startup():
+    if Config.ENSURE_INDEXES:
+        ensure_indexes()
+
+
+@app.on_event('shutdown')
+def shutdown():
+    close_client()
@@ -0,0 +1,95 @@
+"""
+Hydration of documents into entities: the dict-backed classes created with cls(**document)
+compared to the __slots__ entities created by the converters of database.registry
+
+    python -m benchmarks.hydrate [--count 100000]
+
+No database is needed, the documents are generated in memory. The memory is measured as after a list read: the
+documents are allocated in the measured window and released after the hydration, what stays is held by the entities.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from database.registry import get_model
+
+
+class DictExcursion:
+    """The Excursion entity as it was before the registry: attributes in __dict__, created via the constructor"""
+
+    def __init__(self, name: str, description: str, price: float, _id: int = None, url_map_route: str = None):
+        self._id: int = _id
+        self.name: str = name
+        self.description: str = description
+        self.price: float = price
+        self.url_map_route: str = url_map_route
+
+
+class DictUser:
+    def __init__(self, email: str, hash_password: str, name: str, _id: int = None, role: str = 'user',
+                 is_active: bool = False, date_registration: datetime = None):
+        self._id: int = _id
+        self.email: str = email
+        self.hash_password: str = hash_password
+        self.name: str = name
+        self.role: str = role
+        self.is_active: bool = is_active
+        self.date_registration = date_registration
+
+
+def excursion_documents(count: int) -> list:
+    return [{'_id': id, 'name': f'Excursion {id}', 'description': 'Description', 'price': 100.0 + id,
+             'url_map_route': f'https://yandex.ru/maps/?ll=30.31,59.93&pt={id}'} for id in range(1, count + 1)]
+
+
+def user_documents(count: int) -> list:
+    now = datetime.now()
+    return [{'_id': id, 'email': f'user{id}@email.ru', 'hash_password': '$2b$12$hash', 'name': f'User {id}',
+             'role': 'user', 'is_active': True, 'date_registration': now} for id in range(1, count + 1)]
+
+
+def measure(hydrate, make_documents, count: int) -> tuple:
+    """
+    :return: best time of 5 runs in seconds and memory held by the entities in bytes
+    """
+    documents = make_documents(count)
+    times = []
+    for _ in range(5):
+        gc.collect()
+        start = time.perf_counter()
+        hydrate(documents)
+        times.append(time.perf_counter() - start)
+    del documents
+    gc.collect()
+    tracemalloc.start()
+    documents = make_documents(count)  # As read from a cursor
+    entities = hydrate(documents)
+    del documents
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del entities
+    return min(times), size
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Benchmark of the hydration of documents into entities')
+    parser.add_argument('--count', type=int, default=100000, help='Number of documents')
+    options = parser.parse_args(args)
+    cases = [
+        ('excursions', DictExcursion, excursion_documents),
+        ('users', DictUser, user_documents),
+    ]
+    print(f'{options.count} documents')
+    for collection_name, dict_entity, make_documents in cases:
+        model = get_model(collection_name)
+        before = measure(lambda data: [dict_entity(**document) for document in data], make_documents, options.count)
+        after = measure(lambda data: list(map(model.from_document, data)), make_documents, options.count)
+        for name, (seconds, size) in (('before', before), ('after', after)):
+            print(f'{collection_name:<12} {name:<8} {seconds * 1000:8.1f} ms {size / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Concurrent logins served by one worker: bcrypt run on the event loop (as the login endpoint did before) compared to
+bcrypt run in the password pool of utils.auth (Config.PASSWORD_HASH_WORKERS threads)
+
+    python -m benchmarks.password_hash [--logins 32] [--rounds 12] [--workers 4]
+
+No database is needed, only the password verification of the login is measured. The stall is the longest time
+a coroutine waiting 1 ms on the same event loop was late, i.e. how long the other requests of the worker froze.
+"""
+import argparse
+import asyncio
+import time
+
+from config import Config
+from utils import auth
+
+
+async def ticker(stop: asyncio.Event) -> float:
+    """
+    :return: longest delay of a 1 ms sleep in seconds until stop is set
+    """
+    stall = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stall = max(stall, time.perf_counter() - start - 0.001)
+    return stall
+
+
+async def inline_login(password: str, hashed: str):
+    auth.verify_and_update_password(password, hashed)
+
+
+async def pool_login(password: str, hashed: str):
+    await auth.verify_and_update_password_async(password, hashed)
+
+
+async def run(login, logins: int, password: str, hashed: str) -> tuple:
+    """
+    :return: (seconds of all the logins, longest stall of the event loop in seconds)
+    """
+    stop = asyncio.Event()
+    stall = asyncio.ensure_future(ticker(stop))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(login(password, hashed) for _ in range(logins)))
+    seconds = time.perf_counter() - start
+    stop.set()
+    return seconds, await stall
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Benchmark of the concurrent logins of a worker')
+    parser.add_argument('--logins', type=int, default=32, help='Number of concurrent logins')
+    parser.add_argument('--rounds', type=int, default=Config.BCRYPT_ROUNDS, help='Cost of bcrypt')
+    parser.add_argument('--workers', type=int, default=Config.PASSWORD_HASH_WORKERS, help='Threads of the pool')
+    options = parser.parse_args(args)
+    Config.PASSWORD_HASH_WORKERS = options.workers
+    auth.pwd_context.update(bcrypt__rounds=options.rounds, bcrypt__min_rounds=options.rounds,
+                            bcrypt__max_rounds=options.rounds)
+    password = 'Password_1'
+    hashed = auth.get_hash_password(password)
+    print(f'{options.logins} concurrent logins, bcrypt cost {options.rounds}, {options.workers} threads')
+    loop = asyncio.new_event_loop()
+    for name, login in (('event loop', inline_login), ('pool', pool_login)):
+        seconds, stall = loop.run_until_complete(run(login, options.logins, password, hashed))
+        print(f'{name:<11} {seconds * 1000:8.1f} ms {options.logins / seconds:8.1f} logins/s '
+              f'stall {stall * 1000:8.1f} ms')
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
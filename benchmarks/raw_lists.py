@@ -0,0 +1,98 @@
+"""
+Encoding of a list page into the JSON response: the entities and the response models validated by FastAPI
+compared to the documents encoded by utils.raw (Config.RAW_LISTS)
+
+    python -m benchmarks.raw_lists [--count 1000]
+
+No database is needed, the BSON documents of the cursor batch are generated in memory.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+from typing import List
+
+import bson
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from starlette.responses import JSONResponse
+
+from database.registry import get_model
+from models.excursion import ExcursionOut
+from models.object import ObjectOut
+from utils.raw import raw_response
+
+
+def excursion_documents(count: int) -> List[bytes]:
+    return [bson.encode({'_id': id, 'name': f'Excursion {id}', 'description': 'Description', 'price': 100.0 + id,
+                         'url_map_route': f'https://yandex.ru/maps/?ll=30.31,59.93&pt={id}', 'version': 1})
+            for id in range(1, count + 1)]
+
+
+def object_documents(count: int) -> List[bytes]:
+    return [bson.encode({'_id': id, 'name': f'Object {id}', 'description': 'Description',
+                         'location': {'lat': 59.93904113769531, 'lon': 30.3157901763916}, 'version': 1})
+            for id in range(1, count + 1)]
+
+
+def entity_page(collection_name: str, out, response_model):
+    """
+    :return: function encoding a page the way the list endpoints do without Config.RAW_LISTS
+    """
+    model = get_model(collection_name)
+    field = create_response_field(name='response', type_=List[response_model])
+    loop = asyncio.new_event_loop()
+
+    def encode(documents: List[bytes]) -> bytes:
+        entities = [model.from_document(bson.decode(document)) for document in documents]  # Decoded by the cursor
+        content = [out(entity) for entity in entities]
+        content = loop.run_until_complete(serialize_response(field=field, response_content=content))
+        return JSONResponse(content).body
+    return encode
+
+
+def raw_page(fields: List[str]):
+    """
+    :return: function encoding a page from the documents
+    """
+    def encode(documents: List[bytes]) -> bytes:
+        return raw_response((bson.decode(document) for document in documents), fields,  # Decoded by the cursor
+                            len(documents)).body
+    return encode
+
+
+def measure(encode, documents: List[bytes]) -> float:
+    """
+    :return: best time of 5 runs in seconds
+    """
+    times = []
+    for _ in range(5):
+        gc.collect()
+        start = time.perf_counter()
+        encode(documents)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Benchmark of the encoding of the list pages')
+    parser.add_argument('--count', type=int, default=1000, help='Number of documents on a page')
+    options = parser.parse_args(args)
+    cases = [
+        ('excursions', excursion_documents(options.count), get_model('excursions').entity.excursion_out, ExcursionOut),
+        ('objects', object_documents(options.count), get_model('objects').entity.object_out, ObjectOut),
+    ]
+    print(f'{options.count} documents')
+    for collection_name, documents, out, response_model in cases:
+        entities = entity_page(collection_name, out, response_model)
+        raw = raw_page(list(response_model.__fields__))
+        assert json.loads(entities(documents)) == json.loads(raw(documents))
+        for name, encode in (('entities', entities), ('raw', raw)):
+            seconds = measure(encode, documents)
+            print(f'{collection_name:<12} {name:<9} {seconds * 1000:8.1f} ms {seconds * 1e6 / options.count:8.2f} '
+                  f'us/row')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,11 @@ from email.mime.text import MIMEText
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
 
 from config import ConfigCelery, Config
 from controllers import user as user_service
+from database.connection import close_client, reset_client
 celery = Celery('celery_app')
 celery.config_from_object(ConfigCelery)
 
@@ -18,6 +20,16 @@ celery.conf.beat_schedule = {
 }
 
 
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    reset_client()  # The prefork pool child must not reuse the client of the parent process
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    close_client()
+
+
 @celery.task
 def send_email(email, title, description) -> bool:
     """Send an email
@@ -9,14 +9,93 @@ class Config(object):
     # DataBase
     URL_MONGODB = os.environ.get('URL_MONGODB', 'mongodb://localhost:27017/')
     DATABASE = os.environ.get('DATABASE', 'excursion-service')
+    # Storage of the collections: 'mongodb' or 'memory' (in the process, for the tests and the benchmarks)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongodb')
+    # Connection pool of the MongoClient shared by the process (timeouts in ms, None - without limit)
+    MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', 100))
+    MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0))
+    MONGODB_MAX_IDLE_TIME_MS = os.environ.get('MONGODB_MAX_IDLE_TIME_MS', None)
+    MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 20000))
+    MONGODB_SOCKET_TIMEOUT_MS = os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', None)
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 30000))
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS = os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', None)
+    # Collect the latency of the MongoDB commands, the metrics are served by GET /metrics
+    MONGODB_MONITORING = os.environ.get('MONGODB_MONITORING', 'true').lower() == 'true'
+    # Print the queries slower than the threshold in ms (0 - disabled) and explain their plans in the background,
+    # at most SLOW_QUERY_EXPLAINS_PER_MINUTE explains a minute and one per filter shape in the interval (seconds)
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    SLOW_QUERY_EXPLAINS_PER_MINUTE = int(os.environ.get('SLOW_QUERY_EXPLAINS_PER_MINUTE', 10))
+    SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 600))
+    # Read preference and read concern of the reads (the read concern None - the default of the server)
+    MONGODB_READ_PREFERENCE = os.environ.get('MONGODB_READ_PREFERENCE', 'primary')
+    MONGODB_READ_CONCERN = os.environ.get('MONGODB_READ_CONCERN', None)
+    # The catalog reads tolerate a slight staleness and can go to the secondaries: the list reads of the catalog
+    # collections requested with read='catalog' by the GET handlers, never the reads that fill a cache or precede
+    # a write (max staleness -1 - not limited, otherwise at least 90 seconds)
+    MONGODB_CATALOG_READ_PREFERENCE = os.environ.get('MONGODB_CATALOG_READ_PREFERENCE', 'secondaryPreferred')
+    MONGODB_CATALOG_READ_CONCERN = os.environ.get('MONGODB_CATALOG_READ_CONCERN', 'local')
+    MONGODB_CATALOG_MAX_STALENESS_SECONDS = int(os.environ.get('MONGODB_CATALOG_MAX_STALENESS_SECONDS', -1))
+    MONGODB_CATALOG_COLLECTIONS = os.environ.get('MONGODB_CATALOG_COLLECTIONS',
+                                                 'excursions,excursion_points,objects,tracks').split(',')
+    # Write concern tiers: w, j and wtimeout (ms) separated by commas, empty - the default write concern of the server.
+    # A database function declares the tier of its writes, the other writes use the tier of their collection in
+    # MONGODB_WRITE_TIERS or 'default'. An unacknowledged tier (w=0) only suits the writes whose result is not read
+    MONGODB_WRITE_CONCERNS = {
+        'default': os.environ.get('MONGODB_WRITE_CONCERN_DEFAULT', ''),
+        'durable': os.environ.get('MONGODB_WRITE_CONCERN_DURABLE', 'w=majority,j=true,wtimeout=5000'),
+        'telemetry': os.environ.get('MONGODB_WRITE_CONCERN_TELEMETRY', 'w=1,j=false'),
+    }
+    MONGODB_WRITE_TIERS = dict(item.split(':') for item in os.environ.get(
+        'MONGODB_WRITE_TIERS', 'users:durable,user_excursions:durable,refresh_tokens:durable').split(',') if item)
+    # Create the missing indexes of the collections when the application starts
+    ENSURE_INDEXES = os.environ.get('ENSURE_INDEXES', 'true').lower() == 'true'
+    # Number of ids reserved by a process at once for a collection (1 - an id is reserved per insert)
+    ID_BLOCK_SIZE = int(os.environ.get('ID_BLOCK_SIZE', 1))
+    # Pagination of the list endpoints
+    PAGE_LIMIT = int(os.environ.get('PAGE_LIMIT', 100))
+    PAGE_LIMIT_MAX = int(os.environ.get('PAGE_LIMIT_MAX', 1000))
+    # The lists of excursions, objects and tracks are encoded from the documents as they are read, without
+    # the entities, the response models and the catalog cache
+    RAW_LISTS = os.environ.get('RAW_LISTS', 'false').lower() == 'true'
+    # In-process cache of the entities read by id (0 - disabled), the ttl bounds the staleness between processes
+    ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 0))
+    ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 60))
+    ENTITY_CACHE_COLLECTIONS = os.environ.get('ENTITY_CACHE_COLLECTIONS',
+                                              'excursions,objects,tracks,excursion_points').split(',')
+    # In-process cache of the users authenticated by the claims of their tokens (0 - disabled), the ttl bounds the time
+    # a change of the user made by another process is not seen
+    PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+    PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+    # Cache of the catalog shared by the workers: 'redis', 'memory' (per process) or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'none')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', os.environ.get('BROKER_URL', 'redis://localhost:6379'))
+    CACHE_REDIS_TIMEOUT = float(os.environ.get('CACHE_REDIS_TIMEOUT', 0.5))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+    CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'excursion-service')
+    CACHE_COLLECTIONS = os.environ.get('CACHE_COLLECTIONS', 'excursions,objects,tracks').split(',')
     # Email settings
     SMTP_SERVER = os.environ.get('SMPT_SERVER', 'smtp.yandex.ru')
     SMTP_PORT = os.environ.get('SMTP_PORT', 587)
     EMAIL = os.environ.get('EMAIL', 'bykov@appvelox.ru')
     EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', '9Fhc7RnZ1kMV')
     # Token settings
+    # Cost of bcrypt (log2 of the rounds), the passwords hashed with another cost are rehashed on login
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    # Threads of a process hashing and verifying the passwords of the requests, bcrypt releases the GIL
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
     ALGORITHM = os.environ.get('ALGORITHM', "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 30)
+    # In-process LRU cache of the verified tokens (0 - disabled), an entry expires with its token, the tokens without
+    # the expiration are kept for JWT_CACHE_TTL seconds
+    JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 10000))
+    JWT_CACHE_TTL = float(os.environ.get('JWT_CACHE_TTL', 300))
+    # Seconds a revocation of the tokens of a user (a token version) made by another process can stay unseen
+    TOKEN_VERSIONS_INTERVAL = float(os.environ.get('TOKEN_VERSIONS_INTERVAL', 2))
+    # Seconds the revocations are read again, covers the clock skew of the processes and the duration of the writes
+    TOKEN_VERSIONS_OVERLAP = float(os.environ.get('TOKEN_VERSIONS_OVERLAP', 60))
+    # A refresh token gets a new access token without the password, it is replaced by a new one on every use
+    REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
     # Celery Parameters
     REGISTRATION_EXPIRE_HOURS = os.environ.get('REGISTRATION_EXPIRE_HOURS', 24)
     # Administration settings
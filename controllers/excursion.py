@@ -1,13 +1,14 @@
-from typing import List
+from typing import Iterator, List, Union
 
 from fastapi import HTTPException
+from pymongo.errors import PyMongoError
 from starlette import status
 
-from database import db
+from database import async_db, db
+from database.shared_cache import catalog_cache, query_key
 from models.excursion import Excursion, ExcursionIn, ExcursionUpdate
 from models.user_excurion import UserExcursion
 
-from controllers import excursion_point as point_service
 TABLE = 'excursions'
 
 
@@ -17,71 +18,104 @@ def create_excursion(excursion_data: Excursion) -> Excursion:
     :param excursion_data: excursion data
     :return: excursion added to the collection
     """
-    if excursion_data._id is None:
-        excursion_data._id = db.get_last_id(TABLE).last_id
     return db.add(excursion_data)
 
 
-def delete_excursion(excursion_id: int) -> Excursion:
-    deleted_excursion = db.get_data_by_id(excursion_id, TABLE)
-    result = db.delete(excursion_id, TABLE)
-    if result:
-        points = point_service.get_excursion_points_by_excursion(excursion_id)
-        list_point_id = [point._id for point in points]
-        if db.delete_items_by_list_id(list_point_id, 'excursion_points'):
-            return deleted_excursion
-        else:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='The excursion was deleted, '
-                                                                                          'but was not already deleted '
-                                                                                          'excursion points')
+def delete_excursion(excursion_id: int, user_excursions: bool = False) -> Excursion:
+    """
+    Delete an excursion with its excursion points
+    :param excursion_id: id of the excursion to delete
+    :param user_excursions: also delete the purchases of the excursion
+    :return: deleted excursion or None if there is no excursion with this id
+    """
+    try:
+        return db.delete_excursion(excursion_id, user_excursions)
+    except PyMongoError as e:
+        print(f'Error: {e}')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to delete the excursion')
+
+
+def get_excursion_by_id(excursion_id: int, fields: List[str] = None) -> Excursion:
+    return catalog_cache.get_or_load(TABLE, query_key('id', excursion_id, fields),
+                                     lambda: db.get_data_by_id(excursion_id, TABLE, fields))
+
+
+async def get_excursion_by_id_async(excursion_id: int, fields: List[str] = None) -> Excursion:
+    return await catalog_cache.get_or_load_async(TABLE, query_key('id', excursion_id, fields),
+                                                 lambda: async_db.get_data_by_id(excursion_id, TABLE, fields))
+
+
+def get_excursions(role: str, fields: List[str] = None, limit: int = None, after=None,
+                   sort: str = None) -> List[Excursion]:
+    if role == 'user':
+        return catalog_cache.get_or_load(TABLE, query_key('published', fields, limit, after, sort),
+                                         lambda: db.get_excursions(fields, limit, after, sort))
     else:
-        return None
+        return catalog_cache.get_or_load(TABLE, query_key('all', fields, limit, after, sort),
+                                         lambda: db.get_all_items(TABLE, fields, limit, after, sort))
 
 
-def get_excursion_by_id(excursion_id: int) -> Excursion:
-    return db.get_data_by_id(excursion_id, TABLE)
+async def get_excursions_async(role: str, fields: List[str] = None, limit: int = None, after=None,
+                               sort: str = None) -> List[Excursion]:
+    """
+    get_excursions reading the database with database.async_db
+    """
+    if role == 'user':
+        return await catalog_cache.get_or_load_async(TABLE, query_key('published', fields, limit, after, sort),
+                                                     lambda: async_db.get_excursions(fields, limit, after, sort))
+    else:
+        return await catalog_cache.get_or_load_async(TABLE, query_key('all', fields, limit, after, sort),
+                                                     lambda: async_db.get_all_items(TABLE, fields, limit, after,
+                                                                                    sort))
 
 
-def get_excursions(role: str) -> List[Excursion]:
+def iter_excursions(role: str, fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                    read: Union[bool, str] = True) -> Iterator[Excursion]:
+    """
+    Iterate over the excursions without loading the whole list into memory
+    """
     if role == 'user':
-        return db.get_excursions()
+        return db.iter_excursions(fields, limit, after, sort, read)
     else:
-        return db.get_all_items(TABLE)
+        return db.iter_all_items(TABLE, fields, limit, after, sort, read)
+
+
+def iter_raw_excursions(role: str, fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                        read: Union[bool, str] = True) -> Iterator[dict]:
+    """
+    Iterate over the documents of the excursions without the entities, the users get only the published excursions
+    """
+    return db.iter_raw_items(TABLE, db.PUBLISHED_EXCURSIONS if role == 'user' else None, fields, limit, after, sort,
+                             read)
 
 
-def update_excursion(excursion_id: int, excursion_update: ExcursionUpdate) -> Excursion:
+def update_excursion(excursion_id: int, excursion_update: ExcursionUpdate, version: int = None) -> Excursion:
     """
        Updates an excursion in the collection
        :param excursion_id: Excursion id to update
        :param excursion_update: update the data excursion
+       :param version: version of the excursion the update was made from, None - not checked
        :return: updated excursion
        """
-    excursion = get_excursion_by_id(excursion_id)
-    if not excursion:
-        return None
-    flag_update = False
-    if excursion_update.name is not None:
-        excursion.name = excursion_update.name
-        flag_update = True
-    if excursion_update.description is not None:
-        excursion.description = excursion_update.description
-        flag_update = True
-    if excursion_update.price is not None:
-        excursion.price = excursion_update.price
-        flag_update = True
-    if not flag_update:
-        return excursion
-    if db.update_item(excursion):
-        return excursion
-    else:
+    update = {field: getattr(excursion_update, field) for field in excursion_update.__fields__
+              if getattr(excursion_update, field) is not None}
+    if not update:
+        return get_excursion_by_id(excursion_id)
+    try:
+        excursion = db.find_and_update(excursion_id, TABLE, update, version=version)
+    except PyMongoError as e:
+        print(f'Error: {e}')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to update the excursion')
+    if excursion is None and version is not None and db.get_data_by_id(excursion_id, TABLE, ['_id']):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail='The excursion was changed by '
+                                                                                     'another request')
+    return excursion
 
 
 def buy_excursion(excursion_id: int, user_id: int) -> UserExcursion:
     excursion = get_excursion_by_id(excursion_id)
     if excursion and excursion.url_map_route is not None:
         user_excursion = UserExcursion(user_id, excursion_id, True)
-        user_excursion._id = db.get_last_id(TABLE).last_id
         return db.add(user_excursion)
     else:
         return None
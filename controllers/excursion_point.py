@@ -1,14 +1,34 @@
-from typing import List
+from typing import List, Union
 
 from fastapi import HTTPException
+from pymongo.errors import PyMongoError
 from starlette import status
 
-from database import db
+from database import async_db, db
 from models.excursion_point import ExcursionPoint, ExcursionPointUpdate
+from models.other import BulkResult
 
 TABLE = 'excursion_points'
 
 
+def check_sequence_number(point_data: ExcursionPoint, list_sequence: List[int]) -> str:
+    """
+    Check that the excursion point can take its place in the route
+    :param point_data: excursion point data
+    :param list_sequence: sequence numbers of the points already in the route
+    :return: the reason why the point cannot be added or None
+    """
+    if point_data.sequence_number in set(list_sequence):
+        return 'An excursion point with this ordinal number already exists'
+    if list_sequence == [] and point_data.sequence_number > 1:
+        return f'This excursion point cannot be {point_data.sequence_number} in the sequence, because there are no ' \
+               'points in the route yet'
+    if list_sequence != [] and point_data.sequence_number - list_sequence[-1] > 1:
+        return f'This excursion point cannot be {point_data.sequence_number} in the sequence, because the number ' \
+               f'of the last point is {list_sequence[-1]}'
+    return None
+
+
 def create_excursion_point(point_data: ExcursionPoint) -> ExcursionPoint:
     """
     Add a new excursion point to the collection
@@ -16,32 +36,39 @@ def create_excursion_point(point_data: ExcursionPoint) -> ExcursionPoint:
     :return: excursion point added to the collection
     """
     points = get_excursion_points_by_excursion(point_data.id_excursion)
-    list_sequence = [point.sequence_number for point in points]
-    if point_data.sequence_number in set(list_sequence):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='An excursion point with this ordinal '
-                                                                            'number already exists')
-    if list_sequence == [] and point_data.sequence_number > 1:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='This excursion point cannot be '
-                                                                            f'{point_data.sequence_number} in the '
-                                                                            'sequence, because there are no points '
-                                                                            'in the route yet')
-    if list_sequence != [] and point_data.sequence_number - list_sequence[-1] > 1:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='This excursion point cannot be '
-                                                                            f'{point_data.sequence_number} in the '
-                                                                            'sequence, because the number of the last '
-                                                                            f'point is {list_sequence[-1]}')
-    if point_data._id is None:
-        point_data._id = db.get_last_id(TABLE).last_id
+    error = check_sequence_number(point_data, [point.sequence_number for point in points])
+    if error is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
     return db.add(point_data)
 
 
+def create_excursion_points(points_data: List[ExcursionPoint]) -> BulkResult:
+    """
+    Add new excursion points to the collection at once, the points are checked in the order of the list
+    :param points_data: excursion points data
+    :return: added excursion points and errors by the index of the point in the list
+    """
+    sequences = {}
+    errors = {}
+    valid = []
+    for index, point_data in enumerate(points_data):
+        if point_data.id_excursion not in sequences:
+            sequences[point_data.id_excursion] = [point.sequence_number for point in
+                                                  get_excursion_points_by_excursion(point_data.id_excursion)]
+        list_sequence = sequences[point_data.id_excursion]
+        error = check_sequence_number(point_data, list_sequence)
+        if error is not None:
+            errors[index] = error
+            continue
+        list_sequence.append(point_data.sequence_number)
+        valid.append(index)
+    result = db.add_many([points_data[index] for index in valid])
+    errors.update({valid[index]: error for index, error in result.errors.items()})
+    return BulkResult(result.inserted, errors)
+
+
 def delete_excursion_point(point_id: int) -> ExcursionPoint:
-    deleted_point = db.get_data_by_id(point_id, TABLE)
-    result = db.delete(point_id, TABLE)
-    if result:
-        return deleted_point
-    else:
-        return None
+    return db.find_and_delete(point_id, TABLE)
 
 
 def get_excursion_point_by_id(point_id: int) -> ExcursionPoint:
@@ -52,32 +79,37 @@ def get_excursion_points() -> List[ExcursionPoint]:
     return db.get_all_items(TABLE)
 
 
-def get_excursion_points_by_excursion(excursion_id: int) -> List[ExcursionPoint]:
-    return db.get_points(excursion_id)
+def get_excursion_points_by_excursion(excursion_id: int, limit: int = None, after: int = None,
+                                      read: Union[bool, str] = True) -> List[ExcursionPoint]:
+    return db.get_points(excursion_id, limit, after, read)
+
+
+async def get_excursion_points_by_excursion_async(excursion_id: int, limit: int = None, after: int = None,
+                                                  read: Union[bool, str] = True) -> List[ExcursionPoint]:
+    return await async_db.get_points(excursion_id, limit, after, read)
 
 
-def update_excursion_point(point_id: int, id_object: int = None, id_track: int = None) -> ExcursionPoint:
+def update_excursion_point(point_id: int, id_object: int = None, id_track: int = None,
+                           version: int = None) -> ExcursionPoint:
     """
        Updates an excursion point in the collection
        :param point_id: Excursion point id to update
        :param id_track: new id_track the excursion point
        :param id_object: new id_object the excursion point
+       :param version: version of the excursion point the update was made from, None - not checked
        :return: updated excursion point
        """
-    point = get_excursion_point_by_id(point_id)
-    if not point:
-        return None
-    flag_update = False
-    if id_object is not None:
-        point.id_object = id_object
-        flag_update = True
-    if id_track is not None:
-        point.id_track = id_track
-        flag_update = True
-    if not flag_update:
-        return point
-    if db.update_item(point):
-        return point
-    else:
+    update = {field: value for field, value in (('id_object', id_object), ('id_track', id_track))
+              if value is not None}
+    if not update:
+        return get_excursion_point_by_id(point_id)
+    try:
+        point = db.find_and_update(point_id, TABLE, update, version=version)
+    except PyMongoError as e:
+        print(f'Error: {e}')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to update the excursion '
                                                                                       'point')
+    if point is None and version is not None and db.get_data_by_id(point_id, TABLE, ['_id']):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail='The excursion point was changed '
+                                                                                     'by another request')
+    return point
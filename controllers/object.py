@@ -1,10 +1,13 @@
-from typing import List
+from typing import Iterator, List, Union
 
 from fastapi import HTTPException
+from pymongo.errors import PyMongoError
 from starlette import status
 
-from database import db
+from database import async_db, db
+from database.shared_cache import catalog_cache, query_key
 from models.object import Object, ObjectUpdate
+from models.other import BulkResult
 
 
 def create_object(object_data: Object) -> Object:
@@ -13,62 +16,113 @@ def create_object(object_data: Object) -> Object:
     :param object_data: object data
     :return: object added to the collection
     """
-    if object_data._id is None:
-        object_data._id = db.get_last_id('objects').last_id
     return db.add(object_data)
 
 
+def create_objects(objects_data: List[Object]) -> BulkResult:
+    """
+    Add new objects to the collection at once
+    :param objects_data: objects data
+    :return: added objects and errors by the index of the object in the list
+    """
+    return db.add_many(objects_data)
+
+
 def delete_object(id: int) -> Object:
     """
     Delete an object from the collection
     :param id: id of the object to delete
     :return: object deleted from the collection
     """
-    obj = db.get_data_by_id(id, 'objects')
-    if obj:
-        if db.delete(id, 'objects'):
-            return obj
-    return None
+    return db.find_and_delete(id, 'objects')
 
 
-def get_objects() -> List[Object]:
+def get_objects(fields: List[str] = None, limit: int = None, after=None, sort: str = None) -> List[Object]:
     """
     Get all objects from the collection
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of objects, None - without limit
+    :param after: key of the last object of the previous page
+    :param sort: name of the field to sort by, None - by id
     :return: list of objects
     """
-    return db.get_all_items('objects')
+    return catalog_cache.get_or_load('objects', query_key('all', fields, limit, after, sort),
+                                     lambda: db.get_all_items('objects', fields, limit, after, sort))
+
+
+async def get_objects_async(fields: List[str] = None, limit: int = None, after=None,
+                            sort: str = None) -> List[Object]:
+    """
+    get_objects reading the database with database.async_db
+    """
+    return await catalog_cache.get_or_load_async('objects', query_key('all', fields, limit, after, sort),
+                                                 lambda: async_db.get_all_items('objects', fields, limit, after,
+                                                                                sort))
+
+
+def iter_objects(fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                 read: Union[bool, str] = True) -> Iterator[Object]:
+    """
+    Iterate over the objects without loading the whole list into memory
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of objects, None - without limit
+    :param after: key of the last object of the previous page
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the objects may come from a secondary, only for the responses of the GET handlers
+    :return: iterator of objects
+    """
+    return db.iter_all_items('objects', fields, limit, after, sort, read)
+
+
+def iter_raw_objects(fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                     read: Union[bool, str] = True) -> Iterator[dict]:
+    """
+    Iterate over the documents of the objects without the entities
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of objects, None - without limit
+    :param after: key of the last object of the previous page
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the documents may come from a secondary, only for the responses of the GET handlers
+    :return: iterator of documents
+    """
+    return db.iter_raw_items('objects', None, fields, limit, after, sort, read)
 
 
-def get_object_by_id(id: int) -> Object:
+def get_object_by_id(id: int, fields: List[str] = None) -> Object:
     """
     Get an object from the collection by id
     :param id: id of the object you are looking for
+    :param fields: document fields to read, None - the whole document
     :return: desired object
     """
-    return db.get_data_by_id(id, 'objects')
+    return catalog_cache.get_or_load('objects', query_key('id', id, fields),
+                                     lambda: db.get_data_by_id(id, 'objects', fields))
 
 
-def update_object(object_id: int, obj_update: ObjectUpdate) -> Object:
+def update_object(object_id: int, obj_update: ObjectUpdate, version: int = None) -> Object:
     """
        Updates an object in the collection
        :param object_id: Object id to update
        :param obj_update: update the data object
+       :param version: version of the object the update was made from, None - not checked
        :return: updated object
        """
-    obj = get_object_by_id(object_id)
-    if not obj:
-        return None
-    if obj_update.name is not None:
-        obj.name = obj_update.name
-    if obj_update.description is not None:
-        obj.description = obj_update.description
-    if obj_update.location is not None:
-        obj.location = obj_update.location
-    if db.update_item(obj):
-        return obj
-    else:
+    # Not dict(): the fields may be assigned after validation, e.g. a Coordinates tuple
+    update = {field: getattr(obj_update, field) for field in obj_update.__fields__
+              if getattr(obj_update, field) is not None}
+    if not update:
+        return get_object_by_id(object_id)
+    try:
+        object_ = db.find_and_update(object_id, 'objects', update, version=version)
+    except PyMongoError as e:
+        print(f'Error: {e}')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to update the object')
+    if object_ is None and version is not None and db.get_data_by_id(object_id, 'objects', ['_id']):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail='The object was changed by '
+                                                                                     'another request')
+    return object_
 
 
 def get_objects_by_list_id(list_id: List[int]) -> List[Object]: # TODO Testing
-    return db.get_items_by_list_id('objects', list_id)
+    return catalog_cache.get_or_load('objects', query_key('list_id', list_id),
+                                     lambda: db.get_items_by_list_id('objects', list_id))
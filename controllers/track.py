@@ -1,11 +1,13 @@
-from typing import List
+from typing import Iterator, List, Union
 
 from fastapi import HTTPException
+from pymongo.errors import PyMongoError
 from starlette import status
 
 import boto3
 
-from database import db
+from database import async_db, db
+from database.shared_cache import catalog_cache, query_key
 from models.track import Track
 
 from config import Config
@@ -24,9 +26,7 @@ def add_track(track_data: bytes, name: str) -> Track:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail='A track with this name already exists')
     if add_track_in_cloud(track_data, name):
-        track_id = db.get_last_id('tracks').last_id
-        track = db.add(Track(name, f'{URL}/{name}.mp3', track_id))
-        track.track = track_data
+        track = db.add(Track(name, f'{URL}/{name}.mp3'))
         return track
     return None
 
@@ -37,31 +37,58 @@ def delete_track(id: int) -> Track:
     :param id: id of the object to delete
     :return: object deleted from the collection
     """
-    track = db.get_data_by_id(id, 'tracks')
+    track = db.find_and_delete(id, 'tracks')
     if track:
-        if db.delete(id, 'tracks'):
-            client_s3 = create_client_s3()
-            response = client_s3.delete_object(Bucket=Config.BUCKET, Key=f'{track.name}.mp3')
-            return track
-    return None
+        client_s3 = create_client_s3()
+        response = client_s3.delete_object(Bucket=Config.BUCKET, Key=f'{track.name}.mp3')
+    return track
 
 
-def get_tracks() -> List[Track]:
+def get_tracks(fields: List[str] = None, limit: int = None, after=None, sort: str = None) -> List[Track]:
     """
     Get all tracks from the collection
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of tracks, None - without limit
+    :param after: key of the last track of the previous page
+    :param sort: name of the field to sort by, None - by id
     :return: list of tracks
     """
-    tracks = db.get_all_items('tracks')
-    return tracks
+    return catalog_cache.get_or_load('tracks', query_key('all', fields, limit, after, sort),
+                                     lambda: db.get_all_items('tracks', fields, limit, after, sort))
+
+
+async def get_tracks_async(fields: List[str] = None, limit: int = None, after=None, sort: str = None) -> List[Track]:
+    """
+    get_tracks reading the database with database.async_db
+    """
+    return await catalog_cache.get_or_load_async('tracks', query_key('all', fields, limit, after, sort),
+                                                 lambda: async_db.get_all_items('tracks', fields, limit, after,
+                                                                                sort))
 
 
-def get_track_by_id(id: int) -> Track:
+def iter_raw_tracks(fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                    read: Union[bool, str] = True) -> Iterator[dict]:
+    """
+    Iterate over the documents of the tracks without the entities
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of tracks, None - without limit
+    :param after: key of the last track of the previous page
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the documents may come from a secondary, only for the responses of the GET handlers
+    :return: iterator of documents
+    """
+    return db.iter_raw_items('tracks', None, fields, limit, after, sort, read)
+
+
+def get_track_by_id(id: int, fields: List[str] = None) -> Track:
     """
     Get an track from the collection by id
     :param id: id of the track you are looking for
+    :param fields: document fields to read, None - the whole document
     :return: desired track
     """
-    return db.get_data_by_id(id, 'tracks')
+    return catalog_cache.get_or_load('tracks', query_key('id', id, fields),
+                                     lambda: db.get_data_by_id(id, 'tracks', fields))
 
 
 def update_track(track_id: int, track_binary: bytes = None, name: str = None) -> Track:
@@ -77,6 +104,7 @@ def update_track(track_id: int, track_binary: bytes = None, name: str = None) ->
     track = get_track_by_id(track_id)
     if not track:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='A track with this id was not found')
+    old_name = track.name  # The file in the cloud is renamed, so the track is read before the update
     if name is not None and track_binary is not None:
         if delete_track_form_cloud(track.name):
             if not add_track_in_cloud(track_binary, name):
@@ -102,8 +130,15 @@ def update_track(track_id: int, track_binary: bytes = None, name: str = None) ->
             else:
                 return None
             return track
-    if db.update_item(track):
-        return track
+    try:
+        # Not applied if the track was renamed or deleted concurrently
+        updated_track = db.find_and_update(track_id, 'tracks', {'name': track.name, 'url': track.url},
+                                           {'name': old_name})
+    except PyMongoError as e:
+        print(f'Error: {e}')
+        updated_track = None
+    if updated_track:
+        return updated_track
     else:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to update the track')
 
@@ -1,9 +1,11 @@
-from datetime import timedelta
-from typing import List
+import secrets
+from datetime import datetime, timedelta
+from typing import List, Tuple
 
 from config import Config
-from database import db
-from models.other import Token
+from database import async_db, db
+from database.token_versions import token_versions
+from models.other import BulkResult, Token
 from models.user import UserAuth, User
 from utils import auth
 
@@ -14,11 +16,18 @@ def create_user(user_data: User) -> User:
        :param user_data: user data
        :return: user added to the collection
        """
-    if user_data._id is None:
-        user_data._id = db.get_last_id('users').last_id
     return db.add(user_data)
 
 
+def create_users(users_data: List[User]) -> BulkResult:
+    """
+       Add new users to the collection at once
+       :param users_data: users data
+       :return: added users and errors by the index of the user in the list
+       """
+    return db.add_many(users_data)
+
+
 def activate_user(email: str) -> bool:
     """
     Activates the user in the service
@@ -44,17 +53,162 @@ def login(user_data: UserAuth) -> Token:
     :return: Json Web Token
     """
     db_user = db.get_user_by_email(user_data.email)
-    if db_user:
-        if db_user.is_active is True:
-            if auth.verify_password(user_data.password, db_user.hash_password):
-                access_token_expires = timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES)
-                access_token = auth.create_access_token(
-                    data={"sub": user_data.email}, expires_delta=access_token_expires
-                )
-                return Token(access_token=access_token, token_type="bearer")
+    if db_user and db_user.is_active is True:
+        return issue_token(db_user, *auth.verify_and_update_password(user_data.password, db_user.hash_password))
     return None
 
 
+async def login_async(user_data: UserAuth) -> Token:
+    """
+    Logging in to the service and getting a token without blocking the event loop: the database is read with
+    database.async_db and the password is verified in the password pool
+    :param user_data: authorization data
+    :return: Json Web Token
+    """
+    db_user = await async_db.get_user_by_email(user_data.email)
+    if not db_user or db_user.is_active is not True:
+        return None
+    valid, new_hash = await auth.verify_and_update_password_async(user_data.password, db_user.hash_password)
+    if not valid:
+        return None
+    if new_hash is not None:
+        await async_db.find_and_update(db_user._id, 'users', {'hash_password': new_hash})
+    return await create_tokens_async(db_user)
+
+
+def issue_token(db_user: User, valid: bool, new_hash: str = None) -> Token:
+    """
+    Get the tokens of a user after the password was verified
+    :param db_user: user
+    :param valid: the password is valid
+    :param new_hash: hash of the password with the current cost of bcrypt to store, None - the hash is up to date
+    :return: Json Web Token or None if the password is not valid
+    """
+    if not valid:
+        return None
+    if new_hash is not None:
+        db.find_and_update(db_user._id, 'users', {'hash_password': new_hash})
+    return create_tokens(db_user)
+
+
+def new_tokens(db_user: User) -> Tuple[bytes, str, datetime]:
+    """
+    Create an access token and a refresh token of a user, the refresh token is not stored
+    :param db_user: user
+    :return: (access token, refresh token, expiration time of the refresh token)
+    """
+    access_token_expires = timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = auth.create_access_token(
+        data={"sub": db_user.email, "uid": db_user._id, "role": db_user.role, "ver": db_user.token_version or 0},
+        expires_delta=access_token_expires
+    )
+    return access_token, secrets.token_urlsafe(32), datetime.utcnow() + timedelta(days=Config.REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+def create_tokens(db_user: User, family: str = None) -> Token:
+    """
+    Create an access token and a refresh token of a user
+    :param db_user: user
+    :param family: family of the used refresh token, None - a new family (login)
+    :return: Json Web Token, without the refresh token if it was not stored
+    """
+    access_token, refresh_token, expires_at = new_tokens(db_user)
+    if not db.add_refresh_token(auth.hash_token(refresh_token), db_user._id, family or secrets.token_hex(8),
+                                expires_at):
+        refresh_token = None
+    return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+async def create_tokens_async(db_user: User, family: str = None) -> Token:
+    """
+    create_tokens storing the refresh token with database.async_db
+    """
+    access_token, refresh_token, expires_at = new_tokens(db_user)
+    if not await async_db.add_refresh_token(auth.hash_token(refresh_token), db_user._id,
+                                            family or secrets.token_hex(8), expires_at):
+        refresh_token = None
+    return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+def refresh(refresh_token: str) -> Token:
+    """
+    Get new tokens by a refresh token without the password, the refresh token can not be used again
+    :param refresh_token: refresh token
+    :return: Json Web Token or None if the refresh token is not valid or the user is not active
+    """
+    document = db.use_refresh_token(auth.hash_token(refresh_token))
+    if document is None:
+        return None
+    db_user = auth.get_cached_user(document['id_user'])
+    if db_user is None or db_user.is_active is not True:
+        db.revoke_refresh_tokens(list_id_user=[document['id_user']])
+        return None
+    return create_tokens(db_user, document['family'])
+
+
+async def refresh_async(refresh_token: str) -> Token:
+    """
+    refresh without blocking the event loop, with database.async_db
+    """
+    document = await async_db.use_refresh_token(auth.hash_token(refresh_token))
+    if document is None:
+        return None
+    db_user = await auth.get_cached_user_async(document['id_user'])
+    if db_user is None or db_user.is_active is not True:
+        await async_db.revoke_refresh_tokens(list_id_user=[document['id_user']])
+        return None
+    return await create_tokens_async(db_user, document['family'])
+
+
+def logout(refresh_token: str) -> bool:
+    """
+    Revoke a refresh token and the tokens it replaced or that replaced it
+    :param refresh_token: refresh token
+    :return: True if the tokens were revoked
+    """
+    return db.revoke_refresh_tokens(auth.hash_token(refresh_token)) > 0
+
+
+async def logout_async(refresh_token: str) -> bool:
+    """
+    logout without blocking the event loop, with database.async_db
+    """
+    return await async_db.revoke_refresh_tokens(auth.hash_token(refresh_token)) > 0
+
+
+def revoke_tokens(id: int, update: dict = None) -> User:
+    """
+    Revoke all tokens of a user: the access tokens by the token version and the refresh tokens
+    :param id: user id
+    :param update: {field: new value} of the user to set at the same time
+    :return: updated user or None if there is no user with this id
+    """
+    user = db.revoke_tokens(id, update)
+    if user is not None:
+        token_versions.set(id, user.token_version)
+    db.revoke_refresh_tokens(list_id_user=[id])
+    return user
+
+
+def deactivate_user(id: int) -> User:
+    """
+    Deactivate a user and revoke the tokens of the user
+    :param id: user id
+    :return: updated user or None if there is no user with this id
+    """
+    return revoke_tokens(id, {'is_active': False})
+
+
+def change_role(id: int, role: str) -> User:
+    """
+    Change the role of a user, the tokens of the user get the new role at once
+    :param id: user id
+    :param role: new role, e.g. 'admin'
+    :return: updated user or None if there is no user with this id
+    """
+    return db.find_and_update(id, 'users', {'role': role})
+
+
 def get_users_inactive_24_hours() -> List[User]:
     """
     Get a list of users who are inactive within 24 hours after registration
@@ -69,11 +223,8 @@ def delete_user(id: int) -> User:
         :param id: id of the user to delete
         :return: user deleted from the collection
         """
-    user = db.get_data_by_id(id, 'users')
-    if user:
-        if db.delete(id, 'users'):
-            return user
-    return None
+    db.revoke_refresh_tokens(list_id_user=[id])
+    return db.find_and_delete(id, 'users')
 
 
 def delete_users(list_id: List[int]) -> bool:
@@ -82,4 +233,5 @@ def delete_users(list_id: List[int]) -> bool:
            :param list_id: list of user IDs to delete
            :return: the result of the removal
            """
+    db.revoke_refresh_tokens(list_id_user=list_id)
     return db.delete_items_by_list_id(list_id, 'users')
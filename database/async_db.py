@@ -0,0 +1,453 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Union
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config import Config
+from database import db as sync_db
+from database.connection import AsyncDatabase
+from database.monitoring import operation
+from database.registry import get_entity_model, get_model
+from models.excursion import Excursion
+from models.excursion_point import ExcursionPoint
+from models.object import Object
+from models.other import TableKey
+from models.track import Track
+from models.user import User
+from models.user_excurion import UserExcursion
+
+# The asyncio twin of database.db used by the hot paths of the routes: the same functions with the same results,
+# the entity cache, the principal cache, the shared cache and the blocks of ids are shared with database.db
+
+# BASE
+
+@operation
+async def add(data: Union[User, Object, Excursion, UserExcursion, Track, ExcursionPoint]) -> Union[User, Object,
+                                                                                                   Excursion,
+                                                                                                   UserExcursion,
+                                                                                                   Track,
+                                                                                                   ExcursionPoint]:
+    """
+    Adds an object to the collection
+    :param data: object to add to the collection
+    :return: added object
+    """
+    db = AsyncDatabase()
+    model = get_entity_model(data)
+    if model is None:
+        return False
+    collection = db.get_collection(model.collection)
+    try:
+        data._id = await next_id(model.collection)
+        if model.versioned and data.version is None:
+            data.version = 1
+        await collection.insert_one(model.to_document(data))
+        sync_db.invalidate(model.collection, [data._id])
+        return data
+    except BaseException as e:  # If an exception is raised when adding to the database
+        print(f'Error: {e}')
+        return None
+
+
+@operation
+async def delete(id: int, collection_name: str) -> bool:
+    """
+    Deletes an object from the collection by id
+    :param id: object id
+    :param collection_name: name of the collection to delete from
+    :return: result of operation
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name)
+    count = (await collection.delete_one({'_id': id})).deleted_count
+    sync_db.invalidate(collection_name, [id])
+    return bool(count)
+
+
+@operation
+async def delete_items_by_list_id(list_id: List[int], collection_name: str) -> bool:
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name)
+    count = (await collection.delete_many({'_id': {'$in': list_id}})).deleted_count
+    sync_db.invalidate(collection_name, list_id)
+    return count == len(list_id)
+
+
+@operation
+async def find_and_update(id: int, collection_name: str, update: dict, condition: dict = None,
+                          version: int = None) -> Union[User, Object, Excursion, Track, ExcursionPoint]:
+    """
+    Atomically set the fields of an item and get the updated item, see database.db.find_and_update
+    :param id: item id
+    :param collection_name: name of the collection
+    :param update: {field: new value}
+    :param condition: additional filter of the item, e.g. the expected values of the fields
+    :param version: expected version of the item, None - not checked
+    :return: updated item or None if there is no item with this id (matching the condition and the version)
+    """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    query = {**(condition or {}), '_id': id}
+    change = {'$set': update}
+    if model.versioned:
+        if version is not None:
+            query['version'] = version
+        change['$inc'] = {'version': 1}
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name)
+    try:
+        data = await collection.find_one_and_update(query, change, return_document=ReturnDocument.AFTER)
+    finally:
+        sync_db.invalidate(collection_name, [id])
+    if data is None:
+        return None
+    return model.from_document(data)
+
+
+@operation
+async def get_data_by_id(id: int, collection_name: str,
+                         fields: List[str] = None) -> Union[User, Object, Excursion, Track, ExcursionPoint]:
+    """
+    Get an item from the collection by id
+    :param id: id of the item you are looking for
+    :param collection_name: name of the collection to search in
+    :param fields: document fields to read, None - the whole document
+    :return: desired item
+    """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    cached = sync_db.is_cached(collection_name)
+    if cached:
+        data = sync_db.entity_cache.get((collection_name, id))
+        if data is not None:
+            return model.from_document(data)
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name, read=True)  # From the primary: the documents fill entity_cache
+    data = await collection.find_one({'_id': id}, sync_db.get_projection(fields))
+    if data:
+        if cached and fields is None:  # Only whole documents are cached
+            sync_db.entity_cache.set((collection_name, id), data)
+        data = model.from_document(data)
+    return data
+
+
+@operation
+async def get_all_items(collection_name: str, fields: List[str] = None, limit: int = None, after=None,
+                        sort: str = None, read: Union[bool, str] = True) -> Union[List[User], List[Object],
+                                                                                  List[Excursion],
+                                                                                  List[UserExcursion], List[Track],
+                                                                                  List[ExcursionPoint]]:
+    """
+    Get all objects from the collection, page by page if the limit is set
+    :param collection_name: collection name
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of items, None - without limit
+    :param after: key of the last item of the previous page (see database.db.find_page)
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the documents may come from a secondary, see read_options
+    :return: list of items
+    """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name, read=read)
+    cursor = sync_db.find_page(collection, fields=fields, limit=limit, after=after, sort=sort)
+    return [model.from_document(item_data) async for item_data in cursor]
+
+
+@operation
+async def get_items_by_list_id(collection_name: str, list_id: List[int]) -> Union[List[User], List[Object],
+                                                                                  List[Excursion],
+                                                                                  List[UserExcursion], List[Track],
+                                                                                  List[ExcursionPoint]]:
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    db = AsyncDatabase()
+    collection = db.get_collection(collection_name, read=True)  # From the primary: the documents fill entity_cache
+    if not sync_db.is_cached(collection_name):
+        return [model.from_document(item_data) async for item_data in collection.find({'_id': {'$in': list_id}})]
+    documents = {}
+    for id in list_id:
+        data = sync_db.entity_cache.get((collection_name, id))
+        if data is not None:
+            documents[id] = data
+    missing = [id for id in list_id if id not in documents]
+    if missing:
+        async for data in collection.find({'_id': {'$in': missing}}):
+            sync_db.entity_cache.set((collection_name, data['_id']), data)
+            documents[data['_id']] = data
+    return [model.from_document(documents[id]) for id in dict.fromkeys(list_id) if id in documents]
+
+
+# USERS
+
+@operation
+async def get_user_by_email(email: str, fields: List[str] = None) -> User:
+    """
+    Get a user by email
+    :param email: user's email address
+    :param fields: document fields to read, None - the whole document
+    :return: the desired user
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('users', read=True)
+    user_data = await collection.find_one({'email': email}, sync_db.get_projection(fields))
+    if user_data:
+        return get_model('users').from_document(user_data)
+    else:
+        return None
+
+
+@operation
+async def activate_user(email: str):
+    """
+    Activates the user in the service
+    :param email: user's email address
+    :return: activation result
+    """
+    db = AsyncDatabase()
+    users = db.get_collection('users', write='durable')
+    try:
+        count = (await users.update_one({'email': email}, {'$set': {'is_active': True}})).modified_count
+        if count == 1:
+            return True
+        else:
+            return None
+    except BaseException as e:  # If an exception is raised when adding to the database
+        print(f'Error: {e}')
+        await users.update_one({'email': email}, {'$set': {'is_active': False}})
+        return False
+    finally:
+        sync_db.principal_cache.pop_where(lambda id, user: user.email == email)
+
+
+@operation
+async def get_inactive(hour: int = None) -> List[User]:
+    """
+    Get a list of users who are inactive within N hours after registration
+    :return: list of inactive users
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('users', read=True)
+    if hour is None:
+        users = collection.find({'is_active': False})
+    else:
+        date = datetime.now() - timedelta(hours=24)
+        users = collection.find({'$and': [
+            {'is_active': False},
+            {'date_registration': {'$lt': date}}]})
+    return [get_model('users').from_document(user) async for user in users]
+
+
+@operation
+async def revoke_tokens(id: int, update: dict = None) -> User:
+    """
+    Increment the token version of a user, see database.db.revoke_tokens
+    :param id: user id
+    :param update: {field: new value} to set at the same time, e.g. {'is_active': False}
+    :return: updated user or None if there is no user with this id
+    """
+    change = {'$inc': {'token_version': 1}, '$set': {**(update or {}), 'token_revoked_at': datetime.utcnow()}}
+    db = AsyncDatabase()
+    collection = db.get_collection('users', write='durable')
+    try:
+        data = await collection.find_one_and_update({'_id': id}, change, return_document=ReturnDocument.AFTER)
+    finally:
+        sync_db.invalidate('users', [id])
+    if data is None:
+        return None
+    return get_model('users').from_document(data)
+
+
+# EXCURSIONS
+
+@operation
+async def get_excursions(fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                         read: Union[bool, str] = True) -> List[Excursion]:
+    db = AsyncDatabase()
+    collection = db.get_collection('excursions', read=read)
+    data = sync_db.find_page(collection, sync_db.PUBLISHED_EXCURSIONS, fields, limit, after, sort)
+    return [get_model('excursions').from_document(excursion_data) async for excursion_data in data]
+
+
+# EXCURSION POINTS
+
+@operation
+async def get_points(excursion_id: int, limit: int = None, after: int = None,
+                     read: Union[bool, str] = True) -> List[ExcursionPoint]:
+    db = AsyncDatabase()
+    collection = db.get_collection('excursion_points', read=read)
+    data = sync_db.find_page(collection, {'id_excursion': excursion_id}, limit=limit, after=after)
+    return [get_model('excursion_points').from_document(point_data) async for point_data in data]
+
+
+@operation
+async def update_url(excursion: Excursion) -> bool:
+    """
+    Updates an url the excursion in the collection
+    :param excursion: Excursion to update
+    :return: result of updating
+    """
+    db = AsyncDatabase()
+    try:
+        collection = db.get_collection('excursions')
+        modified = (await collection.update_one({'_id': excursion._id},
+                                                {'$set': {'url_map_route': excursion.url_map_route},
+                                                 '$inc': {'version': 1}})).modified_count
+    except BaseException as e:  # If an exception is raised when adding to the database
+        print(f'Error: {e}')
+        return None
+    finally:
+        sync_db.invalidate('excursions', [excursion._id])
+    return bool(modified)
+
+
+# TRACK
+
+@operation
+async def get_track_by_name(name: str) -> Track:
+    """
+    Get a track by name
+    :param name: track name
+    :return: the desired track
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('tracks', read=True)
+    track_data = await collection.find_one({'name': name})
+    if track_data:
+        return get_model('tracks').from_document(track_data)
+    else:
+        return None
+
+
+# REFRESH TOKENS
+
+@operation
+async def add_refresh_token(token_hash: str, user_id: int, family: str, expires_at: datetime) -> bool:
+    """
+    Store a refresh token, see database.db.add_refresh_token
+    :param token_hash: SHA-256 of the token
+    :param user_id: id of the user
+    :param family: id of the tokens replacing each other since a login
+    :param expires_at: expiration time (UTC)
+    :return: True if the token was stored
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('refresh_tokens')
+    try:
+        await collection.insert_one({'_id': token_hash, 'id_user': user_id, 'family': family,
+                                     'expires_at': expires_at, 'used': False})
+        return True
+    except BaseException as e:  # If an exception is raised when adding to the database
+        print(f'Error: {e}')
+        return False
+
+
+@operation
+async def use_refresh_token(token_hash: str) -> dict:
+    """
+    Atomically mark a refresh token used, see database.db.use_refresh_token
+    :param token_hash: SHA-256 of the token
+    :return: document of the token or None if the token is unknown, expired or already used
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('refresh_tokens')
+    document = await collection.find_one_and_update({'_id': token_hash, 'used': False,
+                                                     'expires_at': {'$gt': datetime.utcnow()}},
+                                                    {'$set': {'used': True}})
+    if document is None:
+        await revoke_refresh_tokens(token_hash, used=True)
+    return document
+
+
+@operation
+async def revoke_refresh_tokens(token_hash: str = None, list_id_user: List[int] = None, used: bool = None) -> int:
+    """
+    Delete the refresh tokens of the family of a token (logout) or of the users
+    :param token_hash: SHA-256 of a token
+    :param list_id_user: ids of the users
+    :param used: the family is revoked only if the token was used (True) or not (False), None - in any case
+    :return: number of deleted tokens
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('refresh_tokens')
+    if list_id_user is not None:
+        return (await collection.delete_many({'id_user': {'$in': list_id_user}})).deleted_count
+    query = {'_id': token_hash} if used is None else {'_id': token_hash, 'used': used}
+    document = await collection.find_one(query, {'family': 1})
+    if document is None:
+        return 0
+    return (await collection.delete_many({'family': document['family']})).deleted_count
+
+
+# TABLE KEYS
+
+@operation
+async def add_key(table: str, last_id: int = 1) -> TableKey:
+    """
+    Create an entry in the table about the last collection id
+    :param table: collection name
+    :param last_id: last id in the collection
+    :return: Data about the collection and its latest id
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('table_keys')
+    key_id = (await collection.insert_one({'table': table, 'last_id': last_id})).inserted_id
+    return TableKey(_id=key_id, table=table, last_id=last_id)
+
+
+@operation
+async def get_last_id(table: str) -> TableKey:
+    """
+    Get the latest id in the collection
+    :param table: collection name
+    :return: Data about the collection and its latest id
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('table_keys')
+    key = await collection.find_one({'table': table})
+    if key is None:
+        return await add_key(table)
+    return TableKey(**key)
+
+
+@operation
+async def reserve_ids(table: str, count: int = 1) -> int:
+    """
+    Atomically reserve a range of ids in the collection with a single $inc of its key
+    :param table: collection name
+    :param count: number of ids to reserve
+    :return: the first id of the reserved range
+    """
+    db = AsyncDatabase()
+    collection = db.get_collection('table_keys')
+    key = await collection.find_one_and_update({'table': table}, {'$inc': {'last_id': count}},
+                                               return_document=ReturnDocument.BEFORE)
+    if key is None:
+        await asyncio.get_running_loop().run_in_executor(None, sync_db.ensure_key_index)  # Once per process
+        try:
+            await collection.update_one({'table': table}, {'$setOnInsert': {'last_id': 1}}, upsert=True)
+        except DuplicateKeyError:  # The key was created by a concurrent process
+            pass
+        return await reserve_ids(table, count)
+    return key['last_id']
+
+
+async def next_id(table: str) -> int:
+    """
+    Get a new id for the collection, the blocks of ids reserved by the process are shared with database.db
+    :param table: collection name
+    :return: new id
+    """
+    if Config.ID_BLOCK_SIZE <= 1:
+        return await reserve_ids(table)
+    id = sync_db.pop_block_id(table)
+    if id is None:
+        id = sync_db.store_id_block(table, await reserve_ids(table, Config.ID_BLOCK_SIZE), Config.ID_BLOCK_SIZE)
+    return id
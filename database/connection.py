@@ -1,15 +1,252 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from typing import Union
+
 from pymongo import MongoClient
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+from pymongo.write_concern import WriteConcern
 
 from config import Config
+from database.memory import AsyncMemoryClient, MemoryClient
+from database.monitoring import command_metrics, current_operation
+from database.slow_queries import slow_query_log
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_async_client = None
+_async_client_pid = None
+_transactions = None  # (pid, whether the deployment supports transactions)
+
+
+def event_listeners() -> list:
+    """
+    :return: command listeners of the clients
+    """
+    listeners = [command_metrics] if Config.MONGODB_MONITORING else []
+    if Config.SLOW_QUERY_MS > 0:
+        listeners.append(slow_query_log)
+    return listeners
+
+
+def read_options(collection: str, read: Union[bool, str] = True) -> dict:
+    """
+    Get the read preference and the read concern of a read from the collection. Only the catalog reads requested
+    explicitly (read='catalog', Config.MONGODB_CATALOG_*) can go to the secondaries, the other reads go to the primary
+    :param collection: collection name
+    :param read: 'catalog' - a read of a catalog list that tolerates a slight staleness, True - any other read
+    :return: {'read_preference', 'read_concern'} for the collection
+    """
+    if read == 'catalog' and collection in Config.MONGODB_CATALOG_COLLECTIONS:
+        mode, concern = Config.MONGODB_CATALOG_READ_PREFERENCE, Config.MONGODB_CATALOG_READ_CONCERN
+        max_staleness = Config.MONGODB_CATALOG_MAX_STALENESS_SECONDS
+    else:
+        mode, concern, max_staleness = Config.MONGODB_READ_PREFERENCE, Config.MONGODB_READ_CONCERN, -1
+    return {'read_preference': make_read_preference(read_pref_mode_from_name(mode), None, max_staleness),
+            'read_concern': ReadConcern(concern)}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_write_concern(spec: str) -> WriteConcern:
+    """
+    :param spec: w, j and wtimeout separated by commas, e.g. 'w=majority,j=true,wtimeout=5000'
+    :return: write concern, the default of the server for an empty spec
+    """
+    options = {}
+    for item in filter(None, spec.split(',')):
+        name, value = item.split('=')
+        name, value = name.strip(), value.strip()
+        if name == 'j':
+            options['j'] = value.lower() == 'true'
+        elif name == 'w':
+            options['w'] = int(value) if value.isdigit() else value
+        else:
+            options[name] = int(value)
+    return WriteConcern(**options)
+
+
+def write_options(collection: str, tier: str = None) -> dict:
+    """
+    Get the write concern of a write to the collection (Config.MONGODB_WRITE_CONCERNS)
+    :param collection: collection name
+    :param tier: tier declared by the database function, by default the tier of the collection
+    :return: {'write_concern'} for the collection
+    """
+    tier = tier or Config.MONGODB_WRITE_TIERS.get(collection, 'default')
+    return {'write_concern': parse_write_concern(Config.MONGODB_WRITE_CONCERNS[tier])}
+
+
+def get_client() -> MongoClient:
+    """
+    Get the MongoClient shared by the whole process
+    The client is created lazily on first use and re-created after a fork, because a pymongo client
+    must not be shared between a parent process and its children (uvicorn and Celery workers).
+    With Config.STORAGE_BACKEND = 'memory' the client of the in-process storage is returned, see database.memory
+    :return: pooled client
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if Config.STORAGE_BACKEND == 'memory' and (_client is None or _client_pid != pid):
+            _client = MemoryClient()  # A forked process continues with a copy of the data
+            _client_pid = pid
+        elif _client is None or _client_pid != pid:
+            # The client inherited from the parent process is dropped without close(),
+            # its sockets belong to the parent
+            _client = MongoClient(Config.URL_MONGODB,
+                                  maxPoolSize=Config.MONGODB_MAX_POOL_SIZE,
+                                  minPoolSize=Config.MONGODB_MIN_POOL_SIZE,
+                                  maxIdleTimeMS=Config.MONGODB_MAX_IDLE_TIME_MS,
+                                  connectTimeoutMS=Config.MONGODB_CONNECT_TIMEOUT_MS,
+                                  socketTimeoutMS=Config.MONGODB_SOCKET_TIMEOUT_MS,
+                                  serverSelectionTimeoutMS=Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                                  waitQueueTimeoutMS=Config.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                                  event_listeners=event_listeners(),
+                                  connect=False)
+            _client_pid = pid
+    return _client
+
+
+def get_async_client():
+    """
+    Get the Motor client shared by the whole process, the asyncio twin of get_client
+    Motor is imported here so that the synchronous workers (Celery) do not load it
+    :return: pooled asyncio client
+    """
+    global _async_client, _async_client_pid
+    pid = os.getpid()
+    if _async_client is not None and _async_client_pid == pid:
+        return _async_client
+    if Config.STORAGE_BACKEND == 'memory':
+        with _client_lock:
+            _async_client = AsyncMemoryClient(MemoryClient())
+            _async_client_pid = pid
+        return _async_client
+    from motor.motor_asyncio import AsyncIOMotorClient
+    with _client_lock:
+        if _async_client is None or _async_client_pid != pid:
+            _async_client = AsyncIOMotorClient(Config.URL_MONGODB,
+                                               maxPoolSize=Config.MONGODB_MAX_POOL_SIZE,
+                                               minPoolSize=Config.MONGODB_MIN_POOL_SIZE,
+                                               maxIdleTimeMS=Config.MONGODB_MAX_IDLE_TIME_MS,
+                                               connectTimeoutMS=Config.MONGODB_CONNECT_TIMEOUT_MS,
+                                               socketTimeoutMS=Config.MONGODB_SOCKET_TIMEOUT_MS,
+                                               serverSelectionTimeoutMS=Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                                               waitQueueTimeoutMS=Config.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                                               event_listeners=event_listeners(),
+                                               connect=False)
+            _async_client_pid = pid
+    return _async_client
+
+
+def supports_transactions() -> bool:
+    """
+    Check whether the deployment supports multi-document transactions: a replica set or a sharded cluster,
+    the answer is remembered by the process
+    :return: True if the writes can be made in a transaction
+    """
+    global _transactions
+    pid = os.getpid()
+    if _transactions is not None and _transactions[0] == pid:
+        return _transactions[1]
+    try:
+        hello = get_client().admin.command('isMaster')
+    except BaseException as e:  # The deployment is asked again next time
+        print(f'Error: {e}')
+        return False
+    _transactions = (pid, 'setName' in hello or hello.get('msg') == 'isdbgrid')
+    return _transactions[1]
+
+
+def close_client():
+    """
+    Close the shared clients of the current process (shutdown hook)
+    """
+    global _client, _client_pid, _async_client, _async_client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        if _async_client is not None and _async_client_pid == os.getpid():
+            _async_client.close()
+        _client = None
+        _client_pid = None
+        _async_client = None
+        _async_client_pid = None
+
+
+def reset_client():
+    """
+    Forget the clients inherited from the parent process, the next call creates new ones (post-fork hook)
+    """
+    global _client, _client_pid, _async_client, _async_client_pid
+    with _client_lock:
+        _client = None
+        _client_pid = None
+        _async_client = None
+        _async_client_pid = None
 
 
 class Database:
     def __init__(self):
-        self.client = MongoClient(Config.URL_MONGODB)
+        self.client = get_client()
         self.db = self.client[Config.DATABASE]
 
-    def __del__(self):
-        self.client.close()
+    def get_collection(self, collection: str, read: Union[bool, str] = False, write: str = None):
+        """
+        :param collection: collection name
+        :param read: the collection is used for reading: True - from the primary, 'catalog' - a catalog read,
+                     see read_options
+        :param write: write concern tier of the writes, by default the tier of the collection, see write_options
+        :return: collection
+        """
+        if read:
+            return self.db.get_collection(collection, **read_options(collection, read))
+        return self.db.get_collection(collection, **write_options(collection, write))
+
+
+class AsyncCollection:
+    """
+    Motor collection running its commands in the executor with the context of the caller: Motor submits the
+    pymongo calls to its threads without the context variables and the listeners would see no operation
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        cursor = self._collection.find(*args, **kwargs)
+        name = current_operation()
+        return cursor if name is None else cursor.comment(name)  # getMore runs after the operation returns
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection.delegate, name)
+
+        async def call(*args, **kwargs):
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(context.run, method, *args, **kwargs))
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.client = get_async_client()
+        self.db = self.client[Config.DATABASE]
 
-    def get_collection(self, collection: str):
-        return self.db[collection]
+    def get_collection(self, collection: str, read: Union[bool, str] = False, write: str = None):
+        """
+        See Database.get_collection
+        """
+        if read:
+            collection = self.db.get_collection(collection, **read_options(collection, read))
+        else:
+            collection = self.db.get_collection(collection, **write_options(collection, write))
+        if isinstance(self.client, AsyncMemoryClient):  # The memory storage runs on the loop and sends no commands
+            return collection
+        return AsyncCollection(collection)
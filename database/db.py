@@ -1,18 +1,105 @@
+import os
+import threading
 from datetime import datetime, timedelta
-from typing import List, Union
+from typing import Dict, Iterator, List, Tuple, Union
 
-from database.connection import Database
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from config import Config
+from database.connection import Database, supports_transactions, write_options
+from database.indexes import INDEXES
+from database.monitoring import current_operation, operation
+from database.registry import get_entity_model, get_model
+from database.shared_cache import catalog_cache
 from models.excursion import Excursion
 from models.excursion_point import ExcursionPoint
 from models.object import Object
-from models.other import TableKey
+from models.other import BulkResult, TableKey
 from models.track import Track
 from models.user import User
 
 # BASE
 from models.user_excurion import UserExcursion
+from utils.cache import TTLCache
+
+# Documents read by id from Config.ENTITY_CACHE_COLLECTIONS: {(collection name, id): document}
+# The entries are invalidated by the writes of this module, the writes of other processes are seen after the ttl
+entity_cache = TTLCache('entity', Config.ENTITY_CACHE_SIZE, Config.ENTITY_CACHE_TTL)
+
+# Users authenticated by utils.auth: {user id: user with the authorization fields}, the users are not modified
+# The entries are invalidated by the writes of the users in this module
+principal_cache = TTLCache('principal', Config.PRINCIPAL_CACHE_SIZE, Config.PRINCIPAL_CACHE_TTL)
+
+
+# Excursions available to the users
+PUBLISHED_EXCURSIONS = {'url_map_route': {'$ne': None}}
+
+
+def is_cached(collection_name: str) -> bool:
+    """
+    Check whether the entities of the collection read by id are cached
+    :param collection_name: collection name
+    :return: True if the entity cache is enabled for the collection
+    """
+    return entity_cache.maxsize > 0 and collection_name in Config.ENTITY_CACHE_COLLECTIONS
+
+
+def invalidate(collection_name: str, list_id: List[int]):
+    """
+    Remove the entities from the entity cache (the users from the principal cache) and make the shared cache of
+    the collection obsolete after the entities were written
+    :param collection_name: collection name
+    :param list_id: ids of the entities
+    """
+    for id in list_id:
+        entity_cache.pop((collection_name, id))
+        if collection_name == 'users':
+            principal_cache.pop(id)
+    catalog_cache.bump(collection_name)
+
+
+def get_projection(fields: List[str]) -> dict:
+    """
+    Build a projection of the document fields, _id is always returned
+    :param fields: names of the document fields or None for the whole document
+    :return: projection for find/find_one
+    """
+    if fields is None:
+        return None
+    return {field: True for field in fields}
 
 
+def find_page(collection, query: dict = None, fields: List[str] = None, limit: int = None, after=None,
+              sort: str = None):
+    """
+    Find documents in the keyset order: by _id, or by the sort field and then by _id
+    :param collection: collection to search in
+    :param query: filter of the documents
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of documents, None - without limit
+    :param after: key of the last document of the previous page: _id, or [sort field value, _id] if sort is set
+    :param sort: name of the field to sort by, None - by _id
+    :return: cursor
+    """
+    query = query or {}
+    if after is not None:
+        if sort is None:
+            condition = {'_id': {'$gt': after}}
+        else:
+            value, id = after
+            condition = {'$or': [{sort: {'$gt': value}}, {sort: value, '_id': {'$gt': id}}]}
+        query = {'$and': [query, condition]} if query else condition
+    order = [('_id', ASCENDING)] if sort is None else [(sort, ASCENDING), ('_id', ASCENDING)]
+    cursor = collection.find(query, get_projection(fields)).sort(order)
+    if current_operation() is not None:  # Tags the commands of a cursor iterated after the call, see monitoring
+        cursor = cursor.comment(current_operation())
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+@operation
 def add(data: Union[User, Object, Excursion, UserExcursion, Track, ExcursionPoint]) -> Union[User, Object,
                                                                                              Excursion, UserExcursion,
                                                                                              Track, ExcursionPoint]:
@@ -22,39 +109,62 @@ def add(data: Union[User, Object, Excursion, UserExcursion, Track, ExcursionPoin
     :return: added object
     """
     db = Database()
-    if type(data) is User:
-        table = 'users'
-    elif type(data) is Object:
-        table = 'objects'
-    elif type(data) is Excursion:
-        table = 'excursions'
-    elif type(data) is UserExcursion:
-        table = 'user_excursions'
-    elif type(data) is Track:
-        table = 'tracks'
-    elif type(data) is ExcursionPoint:
-        table = 'excursion_points'
-    else:
+    model = get_entity_model(data)
+    if model is None:
         return False
-    collection = db.get_collection(table)
-    keys = db.get_collection('table_keys')
+    collection = db.get_collection(model.collection)
     try:
-        last_raw = get_last_id(table)
-        data._id = last_raw.last_id
-        id = collection.insert_one(data.__dict__).inserted_id
-        count = keys.update_one({'table': table}, {'$inc': {'last_id': 1}}).modified_count
-        if type(id) is int and count == 1:
-            return data
-        else:
-            collection.delete_one({'_id': id})
-            if last_raw.last_id != 1:
-                keys.update_one({'table': table}, {'$inc': {'last_id': -1}})
-            return None
+        data._id = next_id(model.collection)
+        if model.versioned and data.version is None:
+            data.version = 1
+        collection.insert_one(model.to_document(data))
+        invalidate(model.collection, [data._id])  # The id could be used by a removed entity
+        return data
     except BaseException as e:  # If an exception is raised when adding to the database
         print(f'Error: {e}')
         return None
 
 
+@operation
+def add_many(data: List[Union[User, Object, Excursion, UserExcursion, Track, ExcursionPoint]]) -> BulkResult:
+    """
+    Adds objects to their collections, ids are reserved with one request per collection
+    and the documents are inserted with one unordered insert_many
+    :param data: objects to add to the collections
+    :return: added objects and errors by the index of the object in the list
+    """
+    db = Database()
+    models = {}
+    errors = {}
+    for index, item in enumerate(data):
+        model = get_entity_model(item)
+        if model is None:
+            errors[index] = f'Unsupported type: {type(item).__name__}'
+            continue
+        models.setdefault(model, []).append(index)
+    for model, indexes in models.items():
+        try:
+            first_id = reserve_ids(model.collection, len(indexes))
+            documents = []
+            for offset, index in enumerate(indexes):
+                data[index]._id = first_id + offset
+                if model.versioned and data[index].version is None:
+                    data[index].version = 1
+                documents.append(model.to_document(data[index]))
+            db.get_collection(model.collection).insert_many(documents, ordered=False)
+        except BulkWriteError as e:  # Only the failed documents were not inserted
+            for error in e.details['writeErrors']:
+                errors[indexes[error['index']]] = error['errmsg']
+        except BaseException as e:  # If an exception is raised when adding to the database
+            print(f'Error: {e}')
+            for index in indexes:
+                errors[index] = str(e)
+        invalidate(model.collection, [data[index]._id for index in indexes])
+    inserted = [item for index, item in enumerate(data) if index not in errors]
+    return BulkResult(inserted, errors)
+
+
+@operation
 def delete(id: int, collection_name: str) -> bool:
     """
     Deletes an object from the collection by id
@@ -65,142 +175,214 @@ def delete(id: int, collection_name: str) -> bool:
     db = Database()
     collection = db.get_collection(collection_name)
     count = collection.delete_one({'_id': id}).deleted_count
+    invalidate(collection_name, [id])
     if count:
         return True
     else:
         return False
 
 
+@operation
 def delete_items_by_list_id(list_id: List[int], collection_name: str) -> bool:
     db = Database()
     collection = db.get_collection(collection_name)
     count = collection.delete_many({'_id': {'$in': list_id}}).deleted_count
+    invalidate(collection_name, list_id)
     if count == len(list_id):
         return True
     else:
         return False
 
 
-def update_item(update: Union[User, Object, Excursion, Track, ExcursionPoint]) -> bool:
+@operation
+def find_and_update(id: int, collection_name: str, update: dict, condition: dict = None,
+                    version: int = None) -> Union[User, Object, Excursion, Track, ExcursionPoint]:
     """
-    Updates an object in the collection
-    :param update: Object to update
-    :return: result of updating
+    Atomically set the fields of an item and get the updated item with one request,
+    the version of a versioned item is incremented
+    :param id: item id
+    :param collection_name: name of the collection
+    :param update: {field: new value}
+    :param condition: additional filter of the item, e.g. the expected values of the fields
+    :param version: expected version of the item, None - not checked
+    :return: updated item or None if there is no item with this id (matching the condition and the version)
     """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    query = {**(condition or {}), '_id': id}
+    change = {'$set': update}
+    if model.versioned:
+        if version is not None:
+            query['version'] = version
+        change['$inc'] = {'version': 1}
     db = Database()
-    if type(update) is User:
-        table = 'users'
-    elif type(update) is Object:
-        table = 'objects'
-    elif type(update) is Excursion:
-        table = 'excursions'
-    elif type(update) is Track:
-        table = 'tracks'
-    elif type(update) is ExcursionPoint:
-        table = 'excursion_points'
-    else:
-        return False
+    collection = db.get_collection(collection_name)
     try:
-        collection = db.get_collection(table)
-        modified = collection.update_one({'_id': update._id}, {'$set': update.__dict__}).modified_count
-    except BaseException as e:  # If an exception is raised when adding to the database
-        print(f'Error: {e}')
+        data = collection.find_one_and_update(query, change, return_document=ReturnDocument.AFTER)
+    finally:
+        invalidate(collection_name, [id])
+    if data is None:
         return None
-    if modified:
-        return True
-    else:
-        return False
+    return model.from_document(data)
+
+
+@operation
+def find_and_delete(id: int, collection_name: str) -> Union[User, Object, Excursion, UserExcursion, Track,
+                                                            ExcursionPoint]:
+    """
+    Atomically delete an item and get it with one request
+    :param id: item id
+    :param collection_name: name of the collection
+    :return: deleted item or None if there is no item with this id
+    """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    db = Database()
+    collection = db.get_collection(collection_name)
+    try:
+        data = collection.find_one_and_delete({'_id': id})
+    finally:
+        invalidate(collection_name, [id])
+    if data is None:
+        return None
+    return model.from_document(data)
 
 
-def get_data_by_id(id: int, collection_name: str) -> Union[User, Object, Excursion, Track, ExcursionPoint]:
+@operation
+def get_data_by_id(id: int, collection_name: str, fields: List[str] = None) -> Union[User, Object, Excursion, Track,
+                                                                                     ExcursionPoint]:
     """
     Get an item from the collection by id
     :param id: id of the item you are looking for
     :param collection_name: name of the collection to search in
+    :param fields: document fields to read, None - the whole document
     :return: desired item
     """
+    model = get_model(collection_name)
+    if model is None:
+        return None
+    cached = is_cached(collection_name)
+    if cached:
+        data = entity_cache.get((collection_name, id))
+        if data is not None:
+            return model.from_document(data)  # A new entity every time, the callers modify them
     db = Database()
-    collection = db.get_collection(collection_name)
-    data = collection.find_one({'_id': id})
+    collection = db.get_collection(collection_name, read=True)  # From the primary: the documents fill entity_cache
+    data = collection.find_one({'_id': id}, get_projection(fields))
     if data:
-        if collection_name == 'users':
-            data = User(**data)
-        elif collection_name == 'objects':
-            data = Object(**data)
-        elif collection_name == 'excursions':
-            data = Excursion(**data)
-        elif collection_name == 'tracks':
-            data = Track(**data)
-        elif collection_name == 'excursion_points':
-            data = ExcursionPoint(**data)
-        else:
-            return None
+        if cached and fields is None:  # Only whole documents are cached
+            entity_cache.set((collection_name, id), data)
+        data = model.from_document(data)
     return data
 
 
-def get_all_items(collection_name: str) -> Union[List[User], List[Object], List[Excursion], List[UserExcursion],
-                                                 List[Track], List[ExcursionPoint]]:
+@operation
+def get_all_items(collection_name: str, fields: List[str] = None, limit: int = None, after=None,
+                  sort: str = None) -> Union[List[User], List[Object], List[Excursion], List[UserExcursion],
+                                             List[Track], List[ExcursionPoint]]:
     """
-    Get all objects from the collection
+    Get all objects from the collection, page by page if the limit is set
     :param collection_name: collection name
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of items, None - without limit
+    :param after: key of the last item of the previous page (see find_page)
+    :param sort: name of the field to sort by, None - by id
     :return: list of items
     """
-    db = Database()
-    collection = db.get_collection(collection_name)
-    data = collection.find()
-    if collection_name == 'users':
-        list_items = [User(**user_data) for user_data in data]
-    elif collection_name == 'objects':
-        list_items = [Object(**obj_data) for obj_data in data]
-    elif collection_name == 'excursions':
-        list_items = [Excursion(**excursion_data) for excursion_data in data]
-    elif collection_name == 'tracks':
-        list_items = [Track(**track_data) for track_data in data]
-    elif collection_name == 'excursion_points':
-        list_items = [ExcursionPoint(**point_data) for point_data in data]
-    else:
+    items = iter_all_items(collection_name, fields, limit, after, sort)
+    if items is None:
+        return None
+    return list(items)
+
+
+@operation
+def iter_all_items(collection_name: str, fields: List[str] = None, limit: int = None, after=None,
+                   sort: str = None, read: Union[bool, str] = True) -> Iterator[Union[User, Object, Excursion,
+                                                                                      UserExcursion, Track,
+                                                                                      ExcursionPoint]]:
+    """
+    Iterate over the objects of the collection, the documents are read from the cursor batch by batch
+    :param collection_name: collection name
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of items, None - without limit
+    :param after: key of the last item of the previous page (see find_page)
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the documents may come from a secondary, see read_options
+    :return: iterator of items
+    """
+    model = get_model(collection_name)
+    if model is None:
         return None
-    return list_items
+    db = Database()
+    collection = db.get_collection(collection_name, read=read)
+    return map(model.from_document, find_page(collection, fields=fields, limit=limit, after=after, sort=sort))
+
+
+@operation
+def iter_raw_items(collection_name: str, query: dict = None, fields: List[str] = None, limit: int = None, after=None,
+                   sort: str = None, read: Union[bool, str] = True) -> Iterator[dict]:
+    """
+    Iterate over the documents of the collection as they are read, no entities are built
+    :param collection_name: collection name
+    :param query: filter of the documents
+    :param fields: document fields to read, None - the whole document
+    :param limit: maximum number of documents, None - without limit
+    :param after: key of the last document of the previous page (see find_page)
+    :param sort: name of the field to sort by, None - by id
+    :param read: 'catalog' - the documents may come from a secondary, see read_options
+    :return: cursor of documents
+    """
+    db = Database()
+    collection = db.get_collection(collection_name, read=read)
+    return find_page(collection, query, fields, limit, after, sort)
 
 
+@operation
 def get_items_by_list_id(collection_name: str, list_id: List[int]) -> Union[List[User], List[Object], List[Excursion],
                                                                             List[UserExcursion], List[Track],
                                                                             List[ExcursionPoint]]:
-    db = Database()
-    collection = db.get_collection(collection_name)
-    data = collection.find({'_id': {'$in': list_id}})
-    if collection_name == 'users':
-        list_items = [User(**user_data) for user_data in data]
-    elif collection_name == 'objects':
-        list_items = [Object(**obj_data) for obj_data in data]
-    elif collection_name == 'excursions':
-        list_items = [Excursion(**excursion_data) for excursion_data in data]
-    elif collection_name == 'tracks':
-        list_items = [Track(**track_data) for track_data in data]
-    elif collection_name == 'excursion_points':
-        list_items = [ExcursionPoint(**point_data) for point_data in data]
-    else:
+    model = get_model(collection_name)
+    if model is None:
         return None
-    return list_items
+    db = Database()
+    collection = db.get_collection(collection_name, read=True)  # From the primary: the documents fill entity_cache
+    if not is_cached(collection_name):
+        return list(map(model.from_document, collection.find({'_id': {'$in': list_id}})))
+    documents = {}
+    for id in list_id:
+        data = entity_cache.get((collection_name, id))
+        if data is not None:
+            documents[id] = data
+    missing = [id for id in list_id if id not in documents]
+    if missing:
+        for data in collection.find({'_id': {'$in': missing}}):
+            entity_cache.set((collection_name, data['_id']), data)
+            documents[data['_id']] = data
+    return [model.from_document(documents[id]) for id in dict.fromkeys(list_id) if id in documents]
 
 
 # USERS
 
-def get_user_by_email(email: str) -> User:
+@operation
+def get_user_by_email(email: str, fields: List[str] = None) -> User:
     """
         Get a user by email
         :param email: user's email address
+        :param fields: document fields to read, None - the whole document
         :return: the desired user
         """
     db = Database()
-    collection = db.get_collection('users')
-    user_data = collection.find_one({'email': email})
+    collection = db.get_collection('users', read=True)
+    user_data = collection.find_one({'email': email}, get_projection(fields))
     if user_data:
-        return User(**user_data)
+        return get_model('users').from_document(user_data)
     else:
         return None
 
 
+@operation
 def activate_user(email: str):
     """
        Activates the user in the service
@@ -208,7 +390,7 @@ def activate_user(email: str):
        :return: activation result
        """
     db = Database()
-    users = db.get_collection('users')
+    users = db.get_collection('users', write='durable')
     try:
         count = users.update_one({'email': email}, {'$set': {'is_active': True}}).modified_count
         if count == 1:
@@ -219,15 +401,18 @@ def activate_user(email: str):
         print(f'Error: {e}')
         users.update_one({'email': email}, {'$set': {'is_active': False}})
         return False
+    finally:
+        principal_cache.pop_where(lambda id, user: user.email == email)
 
 
+@operation
 def get_inactive(hour: int = None) -> List[User]:
     """
         Get a list of users who are inactive within N hours after registration
         :return: list of inactive users
         """
     db = Database()
-    collection = db.get_collection('users')
+    collection = db.get_collection('users', read=True)
     if hour is None:
         users = collection.find({'is_active': False})
     else:
@@ -236,31 +421,120 @@ def get_inactive(hour: int = None) -> List[User]:
             {'is_active': False},
             {'date_registration': {'$lt': date}}]})
     if users:
-        return [User(**user) for user in users]
+        return list(map(get_model('users').from_document, users))
     else:
         return None
 
 
+@operation
+def revoke_tokens(id: int, update: dict = None) -> User:
+    """
+    Increment the token version of a user, the tokens issued before are not valid any more
+    :param id: user id
+    :param update: {field: new value} to set at the same time, e.g. {'is_active': False}
+    :return: updated user or None if there is no user with this id
+    """
+    change = {'$inc': {'token_version': 1}, '$set': {**(update or {}), 'token_revoked_at': datetime.utcnow()}}
+    db = Database()
+    collection = db.get_collection('users', write='durable')
+    try:
+        data = collection.find_one_and_update({'_id': id}, change, return_document=ReturnDocument.AFTER)
+    finally:
+        invalidate('users', [id])
+    if data is None:
+        return None
+    return get_model('users').from_document(data)
+
+
+@operation
+def get_token_versions(since: datetime, initial: bool = False) -> Dict[int, Tuple[int, datetime]]:
+    """
+    Get the token versions of the users who revoked their tokens after a time
+    :param since: the revocations after this time (UTC) are read
+    :param initial: also read the users who revoked their tokens before the time of the revocation was stored,
+                    their time is None
+    :return: {user id: (token version, time of the revocation)} or None if the database is unavailable
+    """
+    query = {'token_revoked_at': {'$gt': since}}
+    if initial:
+        query = {'$or': [query, {'token_version': {'$gt': 0}, 'token_revoked_at': None}]}
+    db = Database()
+    collection = db.get_collection('users', read=True)
+    try:
+        return {document['_id']: (document['token_version'], document.get('token_revoked_at'))
+                for document in collection.find(query, {'token_version': 1, 'token_revoked_at': 1})}
+    except BaseException as e:
+        print(f'Error: {e}')
+        return None
+
+
 # EXCURSIONS
 
-def get_excursions() -> List[Excursion]:
+@operation
+def get_excursions(fields: List[str] = None, limit: int = None, after=None, sort: str = None) -> List[Excursion]:
+    return list(iter_excursions(fields, limit, after, sort))
+
+
+@operation
+def iter_excursions(fields: List[str] = None, limit: int = None, after=None, sort: str = None,
+                    read: Union[bool, str] = True) -> Iterator[Excursion]:
+    db = Database()
+    collection = db.get_collection('excursions', read=read)
+    data = find_page(collection, PUBLISHED_EXCURSIONS, fields, limit, after, sort)
+    return map(get_model('excursions').from_document, data)
+
+
+@operation
+def delete_excursion(excursion_id: int, user_excursions: bool = False) -> Excursion:
+    """
+    Delete an excursion with all its points by filter, in one transaction if the deployment supports them.
+    Without a transaction the points are deleted first, so a failed delete can be repeated.
+    The writes are made with the 'durable' write concern
+    :param excursion_id: id of the excursion to delete
+    :param user_excursions: also delete the purchases of the excursion
+    :return: deleted excursion or None if there is no excursion with this id
+    """
     db = Database()
-    collection = db.get_collection('excursions')
-    data = collection.find({'url_map_route': {'$ne': None}})
-    list_excursions = [Excursion(**excursion_data) for excursion_data in data]
-    return list_excursions
+
+    def cascade(session=None) -> dict:
+        db.get_collection('excursion_points', write='durable').delete_many({'id_excursion': excursion_id},
+                                                                          session=session)
+        if user_excursions:
+            db.get_collection('user_excursions', write='durable').delete_many({'id_excursion': excursion_id},
+                                                                             session=session)
+        return db.get_collection('excursions', write='durable').find_one_and_delete({'_id': excursion_id},
+                                                                                    session=session)
+
+    try:
+        if supports_transactions():
+            with db.client.start_session() as session:
+                data = session.with_transaction(cascade, **write_options('excursions', 'durable'))
+        else:
+            data = cascade()
+    finally:
+        entity_cache.pop_where(lambda key, document: key[0] == 'excursion_points'
+                               and document.get('id_excursion') == excursion_id)
+        invalidate('excursion_points', [])
+        if user_excursions:
+            invalidate('user_excursions', [])
+        invalidate('excursions', [excursion_id])
+    if data is None:
+        return None
+    return get_model('excursions').from_document(data)
 
 
 # EXCURSION POINTS
 
-def get_points(excursion_id: int) -> List[ExcursionPoint]:
+@operation
+def get_points(excursion_id: int, limit: int = None, after: int = None,
+               read: Union[bool, str] = True) -> List[ExcursionPoint]:
     db = Database()
-    collection = db.get_collection('excursion_points')
-    data = collection.find({'id_excursion': excursion_id})
-    list_points = [ExcursionPoint(**point_data) for point_data in data]
-    return list_points
+    collection = db.get_collection('excursion_points', read=read)
+    data = find_page(collection, {'id_excursion': excursion_id}, limit=limit, after=after)
+    return list(map(get_model('excursion_points').from_document, data))
 
 
+@operation
 def update_url(excursion: Excursion) -> bool:
     """
     Updates an url the excursion in the collection
@@ -271,10 +545,13 @@ def update_url(excursion: Excursion) -> bool:
     try:
         collection = db.get_collection('excursions')
         modified = collection.update_one({'_id': excursion._id},
-                                         {'$set': {'url_map_route': excursion.url_map_route}}).modified_count
+                                         {'$set': {'url_map_route': excursion.url_map_route},
+                                          '$inc': {'version': 1}}).modified_count
     except BaseException as e:  # If an exception is raised when adding to the database
         print(f'Error: {e}')
         return None
+    finally:
+        invalidate('excursions', [excursion._id])
     if modified:
         return True
     else:
@@ -283,6 +560,7 @@ def update_url(excursion: Excursion) -> bool:
 
 # TRACK
 
+@operation
 def get_track_by_name(name: str) -> Track:
     """
     Get a track by name
@@ -290,16 +568,77 @@ def get_track_by_name(name: str) -> Track:
     :return: the desired track
     """
     db = Database()
-    collection = db.get_collection('tracks')
+    collection = db.get_collection('tracks', read=True)
     track_data = collection.find_one({'name': name})
     if track_data:
-        return Track(**track_data)
+        return get_model('tracks').from_document(track_data)
     else:
         return None
 
 
+# REFRESH TOKENS
+
+@operation
+def add_refresh_token(token_hash: str, user_id: int, family: str, expires_at: datetime) -> bool:
+    """
+    Store a refresh token, the document is removed by the TTL index after the expiration
+    :param token_hash: SHA-256 of the token
+    :param user_id: id of the user
+    :param family: id of the tokens replacing each other since a login
+    :param expires_at: expiration time (UTC)
+    :return: True if the token was stored
+    """
+    db = Database()
+    collection = db.get_collection('refresh_tokens')
+    try:
+        collection.insert_one({'_id': token_hash, 'id_user': user_id, 'family': family, 'expires_at': expires_at,
+                               'used': False})
+        return True
+    except BaseException as e:  # If an exception is raised when adding to the database
+        print(f'Error: {e}')
+        return False
+
+
+@operation
+def use_refresh_token(token_hash: str) -> dict:
+    """
+    Atomically mark a refresh token used. A used token presented again was stolen or replayed,
+    the whole family of the token is revoked
+    :param token_hash: SHA-256 of the token
+    :return: document of the token or None if the token is unknown, expired or already used
+    """
+    db = Database()
+    collection = db.get_collection('refresh_tokens')
+    document = collection.find_one_and_update({'_id': token_hash, 'used': False,
+                                               'expires_at': {'$gt': datetime.utcnow()}}, {'$set': {'used': True}})
+    if document is None:
+        revoke_refresh_tokens(token_hash, used=True)
+    return document
+
+
+@operation
+def revoke_refresh_tokens(token_hash: str = None, list_id_user: List[int] = None, used: bool = None) -> int:
+    """
+    Delete the refresh tokens of the family of a token (logout) or of the users
+    :param token_hash: SHA-256 of a token
+    :param list_id_user: ids of the users
+    :param used: the family is revoked only if the token was used (True) or not (False), None - in any case
+    :return: number of deleted tokens
+    """
+    db = Database()
+    collection = db.get_collection('refresh_tokens')
+    if list_id_user is not None:
+        return collection.delete_many({'id_user': {'$in': list_id_user}}).deleted_count
+    query = {'_id': token_hash} if used is None else {'_id': token_hash, 'used': used}
+    document = collection.find_one(query, {'family': 1})
+    if document is None:
+        return 0
+    return collection.delete_many({'family': document['family']}).deleted_count
+
+
 # TABLE KEYS
 
+@operation
 def add_key(table: str, last_id: int = 1) -> TableKey:
     """
     Create an entry in the table about the last collection id
@@ -313,6 +652,7 @@ def add_key(table: str, last_id: int = 1) -> TableKey:
     return TableKey(_id=key_id, table=table, last_id=last_id)
 
 
+@operation
 def get_last_id(table: str) -> TableKey:
     """
     Get the latest id in the collection
@@ -325,3 +665,102 @@ def get_last_id(table: str) -> TableKey:
     if key is None:
         return add_key(table)
     return TableKey(**key)
+
+
+@operation
+def reserve_ids(table: str, count: int = 1) -> int:
+    """
+    Atomically reserve a range of ids in the collection with a single $inc of its key
+    :param table: collection name
+    :param count: number of ids to reserve
+    :return: the first id of the reserved range
+    """
+    db = Database()
+    collection = db.get_collection('table_keys')
+    key = collection.find_one_and_update({'table': table}, {'$inc': {'last_id': count}},
+                                         return_document=ReturnDocument.BEFORE)
+    if key is None:
+        ensure_key_index()
+        try:
+            collection.update_one({'table': table}, {'$setOnInsert': {'last_id': 1}}, upsert=True)
+        except DuplicateKeyError:  # The key was created by a concurrent process
+            pass
+        return reserve_ids(table, count)
+    return key['last_id']
+
+
+# Process that created the unique index of table_keys, see ensure_key_index
+_key_index_pid = None
+
+
+def ensure_key_index():
+    """
+    Create the unique index of table_keys once per process before the first key is inserted: the concurrent
+    upserts of a key are deduplicated by it, and database.indexes.ensure_indexes is run only by the API
+    """
+    global _key_index_pid
+    if _key_index_pid == os.getpid():
+        return
+    Database().get_collection('table_keys').create_indexes(INDEXES['table_keys'])
+    _key_index_pid = os.getpid()
+
+
+# Blocks of ids reserved by the current process: {table: [next id, last id of the block]}
+_id_blocks = {}
+_id_blocks_pid = None
+_id_blocks_lock = threading.Lock()
+
+
+def next_id(table: str) -> int:
+    """
+    Get a new id for the collection
+    If Config.ID_BLOCK_SIZE is greater than 1, the process reserves a block of ids at once (hi/lo)
+    and hands them out without going to the database
+    :param table: collection name
+    :return: new id
+    """
+    if Config.ID_BLOCK_SIZE <= 1:
+        return reserve_ids(table)
+    id = pop_block_id(table)
+    if id is None:  # Concurrent threads may both reserve a block, then the ids of one of them are skipped
+        id = store_id_block(table, reserve_ids(table, Config.ID_BLOCK_SIZE), Config.ID_BLOCK_SIZE)
+    return id
+
+
+def pop_block_id(table: str) -> int:
+    """
+    Take the next id from the block reserved by the current process
+    :param table: collection name
+    :return: id or None if the block is exhausted
+    """
+    global _id_blocks_pid
+    with _id_blocks_lock:
+        if _id_blocks_pid != os.getpid():  # The blocks inherited from the parent process are used by it
+            _id_blocks.clear()
+            _id_blocks_pid = os.getpid()
+        block = _id_blocks.get(table)
+        if block is None or block[0] > block[1]:
+            return None
+        block[0] += 1
+        return block[0] - 1
+
+
+def store_id_block(table: str, first_id: int, size: int) -> int:
+    """
+    Remember a block of ids reserved by the current process
+    :param table: collection name
+    :param first_id: the first id of the block
+    :param size: number of ids in the block
+    :return: the first id, which is handed out immediately
+    """
+    with _id_blocks_lock:
+        _id_blocks[table] = [first_id + 1, first_id + size - 1]
+    return first_id
+
+
+def reset_id_blocks():
+    """
+    Forget the blocks of ids reserved by the current process, the unused ids are skipped
+    """
+    with _id_blocks_lock:
+        _id_blocks.clear()
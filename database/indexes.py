@@ -0,0 +1,94 @@
+import argparse
+import sys
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+from database.connection import Database
+
+# Indexes of every collection, the name of an index identifies it in the report
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('is_active', ASCENDING), ('date_registration', ASCENDING)],
+                   name='is_active_date_registration'),
+        IndexModel([('token_version', ASCENDING)], name='token_version',
+                   partialFilterExpression={'token_version': {'$gt': 0}}),
+        IndexModel([('token_revoked_at', ASCENDING)], name='token_revoked_at', sparse=True),
+    ],
+    'excursions': [
+        IndexModel([('url_map_route', ASCENDING)], name='url_map_route'),
+    ],
+    'excursion_points': [
+        IndexModel([('id_excursion', ASCENDING), ('sequence_number', ASCENDING)],
+                   name='id_excursion_sequence_number_unique', unique=True),
+    ],
+    'tracks': [
+        IndexModel([('name', ASCENDING)], name='name'),
+    ],
+    'user_excursions': [
+        IndexModel([('id_user', ASCENDING)], name='id_user'),
+        IndexModel([('id_excursion', ASCENDING)], name='id_excursion'),  # The cascade delete of an excursion
+    ],
+    'refresh_tokens': [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+        IndexModel([('family', ASCENDING)], name='family'),
+        IndexModel([('id_user', ASCENDING)], name='id_user'),
+    ],
+    'table_keys': [
+        IndexModel([('table', ASCENDING)], name='table_unique', unique=True),
+    ],
+}
+
+
+def ensure_indexes() -> dict:
+    """
+    Create the missing indexes of every collection, the existing ones are left as they are
+    :return: errors by collection name, empty if all indexes are in place
+    """
+    db = Database()
+    errors = {}
+    for collection_name, indexes in INDEXES.items():
+        try:
+            db.get_collection(collection_name).create_indexes(indexes)
+        except PyMongoError as e:  # E.g. duplicates in the collection do not allow to create a unique index
+            print(f'Error: {collection_name}: {e}')
+            errors[collection_name] = str(e)
+    return errors
+
+
+def index_report() -> dict:
+    """
+    Compare the indexes of the database with the registry
+    :return: {collection name: {'missing': [index names], 'extra': [index names]}} for the collections that differ
+    """
+    db = Database()
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = db.get_collection(collection_name).index_information()
+        existing.pop('_id_', None)
+        declared = {index.document['name']: index.document for index in indexes}
+        missing = [name for name, index in declared.items()
+                   if name not in existing or list(existing[name]['key']) != list(index['key'].items())
+                   or existing[name].get('unique', False) != index.get('unique', False)]
+        extra = [name for name in existing if name not in declared]
+        if missing or extra:
+            report[collection_name] = {'missing': missing, 'extra': extra}
+    return report
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Create the indexes of the excursion-service collections')
+    parser.add_argument('--check', action='store_true', help='Only report missing and extra indexes')
+    options = parser.parse_args(args)
+    errors = {} if options.check else ensure_indexes()
+    report = index_report()
+    for collection_name, difference in report.items():
+        print(f"{collection_name}: missing: {', '.join(difference['missing']) or '-'} | "
+              f"extra: {', '.join(difference['extra']) or '-'}")
+    missing = any(difference['missing'] for difference in report.values())
+    return 1 if errors or missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,623 @@
+"""
+In-process storage backend (Config.STORAGE_BACKEND = 'memory'): dict-backed collections implementing the part of
+the pymongo API used by the database package, so that the tests and the benchmarks run without MongoDB.
+The data lives in the process and is lost when it exits, the MongoDB backend is the pymongo client itself
+
+Supported: filters by fields (dotted paths) with $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $and, $or,
+$nor; updates with $set, $unset, $inc, $setOnInsert and upserts; inclusion projections; sort, limit; unique indexes
+"""
+import copy
+import itertools
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+# Databases of the process by name, shared by the clients like the databases of a server
+DATABASES: Dict[str, 'MemoryDatabase'] = {}
+_databases_lock = threading.Lock()
+
+
+def normalize(document: dict) -> dict:
+    """
+    Store a copy of the document as MongoDB would: tuples become arrays, dates are rounded to milliseconds,
+    the values that can not be encoded raise bson.errors.InvalidDocument
+    """
+    return bson.decode(bson.encode(document))
+
+
+def get_path(document: dict, path: str) -> Any:
+    """
+    :return: value of a dotted field of the document or _MISSING
+    """
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def set_path(document: dict, path: str, value: Any):
+    *parents, name = path.split('.')
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[name] = value
+
+
+def unset_path(document: dict, path: str):
+    *parents, name = path.split('.')
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(name, None)
+
+
+def sort_key(value: Any) -> tuple:
+    """
+    Order of the values of different types: missing and null, numbers, strings, documents, arrays, booleans, dates
+    """
+    if value is _MISSING or value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 5, value
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    if isinstance(value, dict):
+        return 3, str(value)
+    if isinstance(value, (list, tuple)):
+        return 4, [sort_key(item) for item in value]
+    if isinstance(value, datetime):
+        return 6, value
+    return 7, str(value)
+
+
+def equals(value: Any, expected: Any) -> bool:
+    """
+    Equality of a field to a value, an array field matches if one of its elements is equal
+    """
+    if expected is None:
+        return value is _MISSING or value is None
+    if value is _MISSING:
+        return False
+    if isinstance(value, (list, tuple)) and not isinstance(expected, (list, tuple)):
+        return any(equals(item, expected) for item in value)
+    if isinstance(value, tuple) or isinstance(expected, tuple):
+        return list(value) == list(expected) if isinstance(value, (list, tuple)) else False
+    return value == expected
+
+
+def compare(value: Any, expected: Any, operator: str) -> bool:
+    """
+    Comparison of the values of the same type, the values of different types do not match
+    """
+    if value is _MISSING or value is None or expected is None:
+        return False
+    if sort_key(value)[0] != sort_key(expected)[0]:
+        return False
+    if operator == '$gt':
+        return value > expected
+    if operator == '$gte':
+        return value >= expected
+    if operator == '$lt':
+        return value < expected
+    return value <= expected
+
+
+def match_condition(value: Any, condition: Any) -> bool:
+    if not isinstance(condition, dict) or not any(key.startswith('$') for key in condition):
+        return equals(value, condition)
+    for operator, expected in condition.items():
+        if operator == '$eq':
+            matched = equals(value, expected)
+        elif operator == '$ne':
+            matched = not equals(value, expected)
+        elif operator in ('$gt', '$gte', '$lt', '$lte'):
+            matched = compare(value, expected, operator)
+        elif operator == '$in':
+            matched = any(equals(value, item) for item in expected)
+        elif operator == '$nin':
+            matched = not any(equals(value, item) for item in expected)
+        elif operator == '$exists':
+            matched = (value is not _MISSING) == bool(expected)
+        else:
+            raise OperationFailure(f'Unsupported operator of the memory storage: {operator}')
+        if not matched:
+            return False
+    return True
+
+
+def matches(document: dict, query: dict) -> bool:
+    """
+    Check whether the document matches the filter
+    :param document: stored document
+    :param query: filter, None or {} - all documents
+    :return: True if the document matches
+    """
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            matched = all(matches(document, item) for item in condition)
+        elif key == '$or':
+            matched = any(matches(document, item) for item in condition)
+        elif key == '$nor':
+            matched = not any(matches(document, item) for item in condition)
+        elif key == '$comment':
+            matched = True
+        elif key.startswith('$'):
+            raise OperationFailure(f'Unsupported operator of the memory storage: {key}')
+        else:
+            matched = match_condition(get_path(document, key), condition)
+        if not matched:
+            return False
+    return True
+
+
+def apply_update(document: dict, update: dict, insert: bool = False) -> dict:
+    """
+    Apply an update to a copy of the document
+    :param document: stored document
+    :param update: update operators or a replacement document
+    :param insert: the document is inserted by an upsert, $setOnInsert is applied
+    :return: updated document
+    """
+    if not any(key.startswith('$') for key in update):  # Replacement
+        return {'_id': document['_id'], **copy.deepcopy(update)}
+    document = copy.deepcopy(document)
+    for operator, fields in update.items():
+        if operator == '$setOnInsert' and not insert:
+            continue
+        for path, value in fields.items():
+            if operator in ('$set', '$setOnInsert'):
+                set_path(document, path, copy.deepcopy(value))
+            elif operator == '$unset':
+                unset_path(document, path)
+            elif operator == '$inc':
+                current = get_path(document, path)
+                set_path(document, path, value if current is _MISSING else current + value)
+            else:
+                raise OperationFailure(f'Unsupported update operator of the memory storage: {operator}')
+    return document
+
+
+def upsert_document(query: dict) -> dict:
+    """
+    :return: document inserted by an upsert: the equality conditions of the filter
+    """
+    document = {}
+    for key, condition in query.items():
+        if key == '$and':
+            for item in condition:
+                document.update(upsert_document(item))
+        elif not key.startswith('$') and not (isinstance(condition, dict)
+                                              and any(name.startswith('$') for name in condition)):
+            set_path(document, key, copy.deepcopy(condition))
+    return document
+
+
+def project(document: dict, projection) -> dict:
+    """
+    :param projection: {field: True} or a list of fields, _id is always included; None - the whole document
+    :return: copy of the projected document
+    """
+    if not projection:
+        return copy.deepcopy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: True for field in projection}
+    included = [field for field, value in projection.items() if value]
+    if not included:  # Exclusion
+        result = copy.deepcopy(document)
+        for field in projection:
+            unset_path(result, field)
+        return result
+    result = {'_id': document['_id']} if projection.get('_id', True) and '_id' in document else {}
+    for field in included:
+        value = get_path(document, field)
+        if value is not _MISSING:
+            set_path(result, field, copy.deepcopy(value))
+    return result
+
+
+class MemoryCursor:
+    """
+    Cursor over the documents matched when the cursor is iterated for the first time
+    """
+
+    def __init__(self, collection: 'MemoryCollection', query: dict, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._limit = 0
+        self._skip = 0
+        self._documents: Iterator = None
+
+    def sort(self, key_or_list, direction: int = 1) -> 'MemoryCursor':
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._skip = skip
+        return self
+
+    def comment(self, comment) -> 'MemoryCursor':
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._documents is None:
+            documents = self._collection.select(self._query, self._sort)
+            stop = self._skip + self._limit if self._limit else None
+            self._documents = itertools.islice(documents, self._skip, stop)
+        return self._collection.output(project(next(self._documents), self._projection))
+
+    def close(self):
+        self._documents = iter(())
+
+
+class Storage:
+    """
+    Documents and indexes of a collection, shared by the views of the collection with different options
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.documents: Dict[Any, dict] = {}  # {_id: document} in the order of insertion
+        self.indexes: Dict[str, dict] = {}  # {name: {'key': [(field, direction)], 'unique': bool}}
+
+
+class MemoryCollection:
+    def __init__(self, database: 'MemoryDatabase', name: str, storage: Storage, document_class=dict,
+                 read_preference=None, write_concern=None):
+        self.database = database
+        self.name = name
+        self.read_preference = read_preference
+        self.write_concern = write_concern  # Kept for the callers, the writes are applied at once
+        self._storage = storage
+        self._document_class = document_class
+
+    def __repr__(self):
+        return f"MemoryCollection: {self.name} | documents: {len(self._storage.documents)}"
+
+    def with_options(self, codec_options=None, read_preference=None, write_concern=None, read_concern=None):
+        document_class = codec_options.document_class if codec_options is not None else self._document_class
+        return MemoryCollection(self.database, self.name, self._storage, document_class,
+                                read_preference or self.read_preference, write_concern or self.write_concern)
+
+    def output(self, document: dict):
+        if self._document_class is RawBSONDocument:
+            return RawBSONDocument(bson.encode(document))
+        return document
+
+    def select(self, query: dict, sort: List[Tuple[str, int]] = None) -> List[dict]:
+        """
+        :return: stored documents matching the filter in the sort order, not copied
+        """
+        with self._storage.lock:
+            documents = [document for document in self._storage.documents.values() if matches(document, query)]
+        for field, direction in reversed(sort or []):
+            documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=direction < 0)
+        return documents
+
+    def check_unique(self, document: dict, replaced_id=_MISSING):
+        """
+        Raise DuplicateKeyError if the document violates a unique index
+        :param document: document to store
+        :param replaced_id: _id of the document it replaces
+        """
+        if document['_id'] in self._storage.documents and document['_id'] != replaced_id:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: _id_', 11000)
+        for name, index in self._storage.indexes.items():
+            if not index.get('unique'):
+                continue
+            key = [get_path(document, field) for field, _ in index['key']]
+            for other in self._storage.documents.values():
+                if other['_id'] != replaced_id and other['_id'] != document['_id'] \
+                        and [get_path(other, field) for field, _ in index['key']] == key:
+                    raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}',
+                                            11000)
+
+    # Reads
+
+    def find(self, filter: dict = None, projection=None, session=None) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection)
+
+    def find_one(self, filter=None, projection=None, session=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        for document in self.find(filter, projection).limit(1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict, session=None) -> int:
+        return len(self.select(filter))
+
+    # Writes
+
+    def insert_one(self, document: dict, session=None) -> InsertOneResult:
+        with self._storage.lock:
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+            stored = normalize(document)
+            self.check_unique(stored)
+            self._storage.documents[stored['_id']] = stored
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents: List[dict], ordered: bool = True, session=None) -> InsertManyResult:
+        errors = []
+        ids = []
+        for index, document in enumerate(documents):
+            try:
+                ids.append(self.insert_one(document).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(ids),
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult(ids, True)
+
+    def update(self, filter: dict, update: dict, upsert: bool = False, many: bool = False) -> Tuple[dict, list]:
+        """
+        :return: raw result and (document before, document after) of the updated documents
+        """
+        with self._storage.lock:
+            targets = self.select(filter)
+            if not many:
+                targets = targets[:1]
+            changes = []
+            for document in targets:
+                updated = normalize(apply_update(document, update))
+                if updated != document:
+                    self.check_unique(updated, document['_id'])
+                    self._storage.documents[document['_id']] = updated
+                changes.append((document, updated))
+            result = {'n': len(targets), 'nModified': sum(before != after for before, after in changes)}
+            if not targets and upsert:
+                document = upsert_document(filter)
+                document.setdefault('_id', ObjectId())
+                document = normalize(apply_update(document, update, insert=True))
+                self.check_unique(document)
+                self._storage.documents[document['_id']] = document
+                changes.append((None, document))
+                result['upserted'] = document['_id']
+                result['n'] = 1
+        return result, changes
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, session=None) -> UpdateResult:
+        return UpdateResult(self.update(filter, update, upsert)[0], True)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, session=None) -> UpdateResult:
+        return UpdateResult(self.update(filter, update, upsert, many=True)[0], True)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE, session=None):
+        _, changes = self.update(filter, update, upsert)
+        if not changes:
+            return None
+        before, after = changes[0]
+        document = after if return_document == ReturnDocument.AFTER else before
+        return None if document is None else self.output(project(document, projection))
+
+    def delete(self, filter: dict, many: bool) -> List[dict]:
+        with self._storage.lock:
+            targets = self.select(filter)
+            if not many:
+                targets = targets[:1]
+            for document in targets:
+                del self._storage.documents[document['_id']]
+        return targets
+
+    def delete_one(self, filter: dict, session=None) -> DeleteResult:
+        return DeleteResult({'n': len(self.delete(filter, many=False))}, True)
+
+    def delete_many(self, filter: dict, session=None) -> DeleteResult:
+        return DeleteResult({'n': len(self.delete(filter, many=True))}, True)
+
+    def find_one_and_delete(self, filter: dict, projection=None, sort=None, session=None):
+        deleted = self.delete(filter, many=False)
+        return self.output(project(deleted[0], projection)) if deleted else None
+
+    def drop(self):
+        with self._storage.lock:
+            self._storage.documents.clear()
+            self._storage.indexes.clear()
+
+    # Indexes
+
+    def create_index(self, keys, name: str = None, unique: bool = False, **kwargs) -> str:
+        key = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in key)
+        with self._storage.lock:
+            index = {'key': key, 'unique': unique}
+            if unique:
+                seen = set()
+                for document in self._storage.documents.values():
+                    value = repr([get_path(document, field) for field, _ in key])
+                    if value in seen:
+                        raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}',
+                                                11000)
+                    seen.add(value)
+            self._storage.indexes[name] = index
+        return name
+
+    def create_indexes(self, indexes: list, session=None) -> List[str]:
+        names = []
+        for index in indexes:
+            document = index.document
+            names.append(self.create_index(list(document['key'].items()), name=document['name'],
+                                           unique=document.get('unique', False)))
+        return names
+
+    def index_information(self) -> dict:
+        information = {'_id_': {'key': [('_id', 1)]}}
+        for name, index in self._storage.indexes.items():
+            information[name] = {'key': list(index['key'])}
+            if index['unique']:
+                information[name]['unique'] = True
+        return information
+
+    def drop_index(self, name: str):
+        with self._storage.lock:
+            if self._storage.indexes.pop(name, None) is None:
+                raise OperationFailure(f'index not found with name [{name}]')
+
+    def drop_indexes(self):
+        with self._storage.lock:
+            self._storage.indexes.clear()
+
+
+class MemoryDatabase:
+    def __init__(self, client: 'MemoryClient', name: str):
+        self.client = client
+        self.name = name
+        self._storages: Dict[str, Storage] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, codec_options=None, read_preference=None, write_concern=None,
+                       read_concern=None) -> MemoryCollection:
+        with self._lock:
+            storage = self._storages.get(name)
+            if storage is None:
+                storage = self._storages[name] = Storage()
+        collection = MemoryCollection(self, name, storage, read_preference=read_preference,
+                                      write_concern=write_concern)
+        return collection.with_options(codec_options) if codec_options is not None else collection
+
+    def list_collection_names(self) -> List[str]:
+        return list(self._storages)
+
+    def drop_collection(self, name: str):
+        with self._lock:
+            self._storages.pop(name, None)
+
+    def command(self, command, *args, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ('ping', 'isMaster', 'ismaster'):
+            return {'ismaster': True, 'ok': 1.0}  # A standalone server without transactions
+        raise OperationFailure(f'Unsupported command of the memory storage: {name}')
+
+
+class MemoryClient:
+    """
+    Client of the in-process storage, it has the interface of pymongo.MongoClient used by database.connection
+    """
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        with _databases_lock:
+            database = DATABASES.get(name)
+            if database is None:
+                database = DATABASES[name] = MemoryDatabase(self, name)
+        return database
+
+    @property
+    def admin(self) -> MemoryDatabase:
+        return self.get_database('admin')
+
+    def drop_database(self, name: str):
+        with _databases_lock:
+            DATABASES.pop(name, None)
+
+    def close(self):
+        pass
+
+
+class AsyncMemoryCursor:
+    """
+    Motor-like cursor over a MemoryCursor
+    """
+
+    def __init__(self, cursor: MemoryCursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs) -> 'AsyncMemoryCursor':
+        self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit: int) -> 'AsyncMemoryCursor':
+        self._cursor.limit(limit)
+        return self
+
+    def comment(self, comment) -> 'AsyncMemoryCursor':
+        self._cursor.comment(comment)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: int = None) -> list:
+        return list(itertools.islice(self._cursor, length))
+
+
+class AsyncMemoryCollection:
+    """
+    Motor-like collection over a MemoryCollection, the coroutines complete without waiting
+    """
+
+    def __init__(self, collection: MemoryCollection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database: MemoryDatabase):
+        self._database = database
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database[name])
+
+    def get_collection(self, name: str, **options) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database.get_collection(name, **options))
+
+
+class AsyncMemoryClient:
+    """
+    Motor-like client sharing the storage of a MemoryClient
+    """
+
+    def __init__(self, client: MemoryClient):
+        self._client = client
+
+    def __getitem__(self, name: str) -> AsyncMemoryDatabase:
+        return AsyncMemoryDatabase(self._client[name])
+
+    def close(self):
+        pass
@@ -0,0 +1,174 @@
+import contextvars
+import functools
+import inspect
+import threading
+from typing import Callable, Dict, Tuple
+
+from pymongo import monitoring
+
+# Name of the database function sending the commands of the current call, see operation
+_operation = contextvars.ContextVar('db_operation', default=None)
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+def operation(function: Callable) -> Callable:
+    """
+    Decorator tagging the commands sent by a database function with its name
+    :param function: function of database.db or database.async_db
+    :return: wrapped function
+    """
+    name = function.__name__
+    if inspect.iscoroutinefunction(function):
+        async def wrapper(*args, **kwargs):
+            token = _operation.set(name)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _operation.reset(token)
+    else:
+        def wrapper(*args, **kwargs):
+            token = _operation.set(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _operation.reset(token)
+    return functools.wraps(function)(wrapper)
+
+
+def current_operation() -> str:
+    """
+    :return: name of the database function being called or None
+    """
+    return _operation.get()
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets: list = [0] * len(BUCKETS)  # not cumulative
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Listener of the commands sent to MongoDB collecting, by command, collection and calling database function:
+    the latency histogram, the number of returned or written documents and the failures
+    The commands of a cursor iterated outside of a database function are tagged with the comment of the cursor
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[int, Tuple[str, str, int]] = {}  # {request id: (collection, operation, cursor id)}
+        self._cursors: Dict[int, str] = {}  # {cursor id: operation} of the open cursors for getMore
+        self.latency: Dict[Tuple[str, str, str], Histogram] = {}  # {(command, collection, operation): histogram}
+        self.documents: Dict[Tuple[str, str, str], int] = {}
+        self.failures: Dict[Tuple[str, str, str, str], int] = {}  # {(command, collection, operation, code): count}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        command = event.command
+        cursor_id = None
+        if event.command_name == 'getMore':
+            collection = command.get('collection')
+            cursor_id = command.get('getMore')
+            name = self._cursors.get(cursor_id)
+        else:
+            collection = command.get(event.command_name)  # e.g. {'find': 'users', ...}
+            name = _operation.get() or command.get('comment')
+        if event.command_name == 'killCursors':
+            for id in command.get('cursors', ()):
+                self._cursors.pop(id, None)
+        if not isinstance(collection, str):  # Commands of the database, e.g. {'ping': 1}
+            collection = ''
+        self._started[event.request_id] = (collection, str(name or 'unknown'), cursor_id)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection, name, cursor_id = self._started.pop(event.request_id, ('', 'unknown', None))
+        key = (event.command_name, collection, name)
+        reply = event.reply
+        cursor = reply.get('cursor')
+        if cursor is not None:
+            documents = len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+            if cursor.get('id'):
+                self._cursors[cursor['id']] = name
+            elif cursor_id is not None:  # The cursor is exhausted
+                self._cursors.pop(cursor_id, None)
+        elif event.command_name == 'findAndModify':
+            documents = int(reply.get('value') is not None)
+        else:
+            documents = reply.get('n', 0)  # insert, update, delete
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(event.duration_micros / 1e6)
+            self.documents[key] = self.documents.get(key, 0) + documents
+            for error in reply.get('writeErrors', ()):  # E.g. duplicate keys of an unordered insert_many
+                failure_key = key + (str(error.get('code', '')),)
+                self.failures[failure_key] = self.failures.get(failure_key, 0) + 1
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection, name, cursor_id = self._started.pop(event.request_id, ('', 'unknown', None))
+        if cursor_id is not None:
+            self._cursors.pop(cursor_id, None)
+        key = (event.command_name, collection, name)
+        failure_key = key + (str(event.failure.get('code', '')),)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(event.duration_micros / 1e6)
+            self.failures[failure_key] = self.failures.get(failure_key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._started.clear()
+            self._cursors.clear()
+            self.latency.clear()
+            self.documents.clear()
+            self.failures.clear()
+
+    def render(self) -> str:
+        """
+        Get the metrics in the Prometheus text format
+        :return: text of the metrics
+        """
+        lines = ['# HELP mongodb_command_duration_seconds Latency of the MongoDB commands',
+                 '# TYPE mongodb_command_duration_seconds histogram']
+        with self._lock:
+            for key, histogram in sorted(self.latency.items()):
+                labels = command_labels(*key)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'mongodb_command_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'mongodb_command_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'mongodb_command_duration_seconds_count{{{labels}}} {histogram.count}')
+            lines += ['# HELP mongodb_command_documents_total Documents returned or written by the MongoDB commands',
+                      '# TYPE mongodb_command_documents_total counter']
+            lines += [f'mongodb_command_documents_total{{{command_labels(*key)}}} {count}'
+                      for key, count in sorted(self.documents.items())]
+            lines += ['# HELP mongodb_command_failures_total Failed MongoDB commands',
+                      '# TYPE mongodb_command_failures_total counter']
+            lines += [f'mongodb_command_failures_total{{{command_labels(*key[:3])},code="{key[3]}"}} {count}'
+                      for key, count in sorted(self.failures.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def command_labels(command: str, collection: str, name: str) -> str:
+    values = (value.replace('\\', '\\\\').replace('"', '\\"') for value in (command, collection, name))
+    return 'command="{}",collection="{}",operation="{}"'.format(*values)
+
+
+# Registered on the clients of database.connection if Config.MONGODB_MONITORING is set
+command_metrics = CommandMetrics()
@@ -0,0 +1,85 @@
+from typing import Callable, Dict, Tuple, Type
+
+from models.excursion import Excursion
+from models.excursion_point import ExcursionPoint
+from models.object import Object
+from models.track import Track
+from models.user import User
+from models.user_excurion import UserExcursion
+
+
+class Model:
+    """
+    Entity class of a collection with the converters between its documents and entities
+    """
+    __slots__ = ('collection', 'entity', 'fields', 'versioned', 'from_document', 'to_document')
+
+    def __init__(self, collection: str, entity: Type):
+        self.collection: str = collection
+        self.entity: Type = entity
+        self.fields: Tuple[str, ...] = entity.__slots__
+        self.versioned: bool = 'version' in self.fields  # the updates check and increment the version
+        self.from_document: Callable[[dict], object] = compile_from_document(entity)
+        self.to_document: Callable[[object], dict] = compile_to_document(entity)
+
+    def __repr__(self):
+        return f"Model: {self.collection} | entity: {self.entity.__name__} | fields: {', '.join(self.fields)}"
+
+
+def compile_from_document(entity: Type) -> Callable[[dict], object]:
+    """
+    Build the function creating an entity from a document without calling its constructor
+    The fields missing in the document (e.g. left out by a projection) are None, the unknown fields are ignored
+    :param entity: entity class with __slots__
+    :return: function(document) -> entity
+    """
+    lines = ['def from_document(data, _new=object.__new__, _entity=entity):', '    item = _new(_entity)',
+             '    get = data.get']
+    lines += [f'    item.{field} = get({field!r})' for field in entity.__slots__]
+    lines.append('    return item')
+    namespace = {'entity': entity}
+    exec(compile('\n'.join(lines), f'<from_document {entity.__name__}>', 'exec'), namespace)
+    return namespace['from_document']
+
+
+def compile_to_document(entity: Type) -> Callable[[object], dict]:
+    """
+    Build the function creating a document from an entity
+    :param entity: entity class with __slots__
+    :return: function(entity) -> document
+    """
+    items = ', '.join(f'{field!r}: item.{field}' for field in entity.__slots__)
+    namespace = {}
+    exec(compile(f'def to_document(item):\n    return {{{items}}}', f'<to_document {entity.__name__}>', 'exec'),
+         namespace)
+    return namespace['to_document']
+
+
+# Collection <-> entity class, one model per collection
+MODELS: Dict[str, Model] = {model.collection: model for model in (
+    Model('users', User),
+    Model('objects', Object),
+    Model('excursions', Excursion),
+    Model('user_excursions', UserExcursion),
+    Model('tracks', Track),
+    Model('excursion_points', ExcursionPoint),
+)}
+ENTITY_MODELS: Dict[Type, Model] = {model.entity: model for model in MODELS.values()}
+
+
+def get_model(collection_name: str) -> Model:
+    """
+    Get the model of a collection
+    :param collection_name: collection name
+    :return: model or None if the collection does not store entities
+    """
+    return MODELS.get(collection_name)
+
+
+def get_entity_model(item) -> Model:
+    """
+    Get the model of an entity
+    :param item: entity
+    :return: model or None if the type of the entity is not registered
+    """
+    return ENTITY_MODELS.get(type(item))
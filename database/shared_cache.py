@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, List, Tuple
+
+import redis
+
+from config import Config
+from database.registry import get_model
+from utils.cache import CACHES
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for Redis with the subset of its commands used by SharedCache
+    """
+
+    def __init__(self):
+        self._data: dict = {}  # {key: (value, expiration time or None)}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: str, value, ex: int = None) -> bool:
+        with self._lock:
+            self._data[key] = (value if isinstance(value, bytes) else str(value).encode(),
+                               time.monotonic() + ex if ex else None)
+            return True
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._data[key] = (str(value).encode(), None)
+            return value
+
+    def flushdb(self) -> bool:
+        with self._lock:
+            self._data.clear()
+            return True
+
+
+class SharedCache:
+    """
+    Cache of the query results shared by the workers of all nodes through Redis (Config.CACHE_BACKEND)
+    The keys of a collection contain its version, a write bumps the version, so the results cached
+    before the write are not read any more and expire after Config.CACHE_TTL
+    """
+
+    def __init__(self, name: str, collections: List[str]):
+        self.name: str = name
+        self.collections: List[str] = collections
+        self.hits: int = 0
+        self.misses: int = 0
+        self.errors: int = 0
+        self._backend = None
+        self._backend_lock = threading.Lock()
+        CACHES[name] = self
+
+    def __repr__(self):
+        return f"SharedCache: {self.name} | collections: {', '.join(self.collections)} | hits: {self.hits} | " \
+               f"misses: {self.misses} | errors: {self.errors}"
+
+    def get_backend(self):
+        """
+        Get the backend chosen by Config.CACHE_BACKEND: 'redis', 'memory' or 'none'
+        :return: redis.Redis, MemoryBackend or None if the cache is disabled
+        """
+        if self._backend is None and Config.CACHE_BACKEND != 'none':
+            with self._backend_lock:
+                if self._backend is None:
+                    if Config.CACHE_BACKEND == 'redis':
+                        # The connection pool of redis-py is re-created after a fork
+                        self._backend = redis.Redis.from_url(Config.CACHE_REDIS_URL,
+                                                             socket_timeout=Config.CACHE_REDIS_TIMEOUT,
+                                                             socket_connect_timeout=Config.CACHE_REDIS_TIMEOUT)
+                    else:
+                        self._backend = MemoryBackend()
+        return self._backend
+
+    def set_backend(self, backend):
+        """
+        Replace the backend, e.g. with MemoryBackend in the tests
+        :param backend: redis.Redis, MemoryBackend or None to use Config.CACHE_BACKEND
+        """
+        with self._backend_lock:
+            self._backend = backend
+
+    def version_key(self, collection_name: str) -> str:
+        return f'{Config.CACHE_PREFIX}:{collection_name}:version'
+
+    def get_or_load(self, collection_name: str, key: str, load: Callable[[], Any]) -> Any:
+        """
+        Get the result of a query of the collection from the cache or load it and cache it
+        :param collection_name: collection the entities of the result belong to
+        :param key: key of the query, unique within the collection
+        :param load: function querying the database, returns an entity, a list of entities or None
+        :return: result of the query
+        """
+        cache_key, result = self.lookup(collection_name, key)
+        if result is not None:
+            return result
+        result = load()
+        self.store(collection_name, cache_key, result)
+        return result
+
+    async def get_or_load_async(self, collection_name: str, key: str, load: Callable[[], Awaitable]) -> Any:
+        """
+        get_or_load with a coroutine function querying the database, e.g. of database.async_db
+        """
+        cache_key, result = self.lookup(collection_name, key)
+        if result is not None:
+            return result
+        result = await load()
+        self.store(collection_name, cache_key, result)
+        return result
+
+    def lookup(self, collection_name: str, key: str) -> Tuple[str, Any]:
+        """
+        Find the result of a query of the collection in the cache
+        :param collection_name: collection the entities of the result belong to
+        :param key: key of the query, unique within the collection
+        :return: (key of the result in the backend or None if the result is not cached, cached result or None)
+        """
+        backend = self.get_backend()
+        if backend is None or collection_name not in self.collections:
+            return None, None
+        try:
+            version = int(backend.get(self.version_key(collection_name)) or 0)
+            cache_key = f'{Config.CACHE_PREFIX}:{collection_name}:{version}:{key}'
+            value = backend.get(cache_key)
+        except redis.RedisError as e:  # The database is queried while Redis is unavailable
+            print(f'Error: {e}')
+            self.errors += 1
+            return None, None
+        if value is None:
+            self.misses += 1
+            return cache_key, None
+        self.hits += 1
+        model = get_model(collection_name)
+        data = json.loads(value)
+        if isinstance(data, list):
+            return cache_key, list(map(model.from_document, data))
+        return cache_key, model.from_document(data)
+
+    def store(self, collection_name: str, cache_key: str, result):
+        """
+        Cache the loaded result of a query
+        :param collection_name: collection the entities of the result belong to
+        :param cache_key: key of the result from lookup, None - the result is not cached
+        :param result: entity, list of entities or None, which is not cached
+        """
+        if cache_key is None or result is None:
+            return
+        model = get_model(collection_name)
+        if isinstance(result, list):
+            value = json.dumps(list(map(model.to_document, result)))
+        else:
+            value = json.dumps(model.to_document(result))
+        try:
+            self.get_backend().set(cache_key, value, ex=Config.CACHE_TTL)
+        except redis.RedisError as e:
+            print(f'Error: {e}')
+            self.errors += 1
+
+    def bump(self, collection_name: str):
+        """
+        Make the cached results of the collection obsolete after a write
+        :param collection_name: collection name
+        """
+        backend = self.get_backend()
+        if backend is None or collection_name not in self.collections:
+            return
+        try:
+            backend.incr(self.version_key(collection_name))
+        except redis.RedisError as e:  # The results cached before the write are read until they expire
+            print(f'Error: {e}')
+            self.errors += 1
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache
+        :return: {'backend', 'hits', 'misses', 'errors', 'hit_ratio'}
+        """
+        requests = self.hits + self.misses
+        return {'backend': Config.CACHE_BACKEND if self._backend is None else type(self._backend).__name__,
+                'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                'hit_ratio': self.hits / requests if requests else 0.0}
+
+
+# The excursion catalog, the objects and the track metadata
+catalog_cache = SharedCache('catalog', Config.CACHE_COLLECTIONS)
+
+
+def query_key(*args) -> str:
+    """
+    Build the key of a query from its parameters
+    :param args: parameters of the query, must be serializable to JSON
+    :return: key
+    """
+    return json.dumps(args, separators=(',', ':'))
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from pymongo import monitoring
+
+from config import Config
+from database.monitoring import current_operation
+
+# Commands that can be explained and the field of their filter
+FILTERS = {'find': 'filter', 'count': 'query', 'distinct': 'query', 'findAndModify': 'query',
+           'aggregate': 'pipeline', 'update': 'updates', 'delete': 'deletes'}
+
+# Fields of a sent command that are not part of the query
+SESSION_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern', 'writeConcern'}
+
+
+def query_shape(value):
+    """
+    Replace the values of a filter with '?', the field names and the operators are kept
+    :param value: filter or a part of it
+    :return: shape of the filter
+    """
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if any(isinstance(item, dict) for item in value):  # $and, $or
+            return [query_shape(item) for item in value]
+        return '?'
+    return '?'
+
+
+def command_filter(name: str, command: dict) -> dict:
+    """
+    Get the filter of a command
+    :param name: command name
+    :param command: sent command
+    :return: filter, the $match of the first pipeline stage or the filter of the first update or delete statement
+    """
+    value = command.get(FILTERS[name])
+    if name == 'aggregate':
+        return value[0].get('$match', {}) if value else {}
+    if name in ('update', 'delete'):
+        return value[0].get('q', {}) if value else {}
+    return value or {}
+
+
+def explain_command(name: str, command: dict) -> dict:
+    """
+    Build the command to explain: without the session fields, with the first statement of an update or a delete
+    :param name: command name
+    :param command: sent command
+    :return: command for the explain command
+    """
+    explained = {key: value for key, value in command.items()
+                 if not key.startswith('$') and key not in SESSION_FIELDS}
+    if name in ('update', 'delete'):
+        explained[FILTERS[name]] = explained[FILTERS[name]][:1]
+    return explained
+
+
+def plan_summary(plan: dict) -> str:
+    """
+    Get the stages of a query plan from the first to the last, e.g. 'IXSCAN {email: 1} -> FETCH'
+    :param plan: winning plan of the explain command
+    :return: stages of the plan
+    """
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if 'keyPattern' in plan:
+            stage += ' ' + '{' + ', '.join(f'{key}: {value}' for key, value in plan['keyPattern'].items()) + '}'
+        stages.append(stage)
+        inputs = plan.get('inputStages')
+        plan = plan.get('inputStage') or (inputs[0] if inputs else None)
+    return ' -> '.join(reversed(stages))
+
+
+def explain(database: str, command: dict) -> dict:
+    """
+    Explain a command on the shared client without running it
+    :param database: database name
+    :param command: command to explain
+    :return: reply of the explain command
+    """
+    from database.connection import get_client  # The connection module registers this listener
+    return get_client()[database].command('explain', command, verbosity='queryPlanner')
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """
+    Listener printing the queries slower than Config.SLOW_QUERY_MS with their collection, filter shape, duration and
+    calling database function. The winning plan of a slow query is explained in a background thread, at most
+    Config.SLOW_QUERY_EXPLAINS_PER_MINUTE times a minute and once per Config.SLOW_QUERY_EXPLAIN_INTERVAL seconds
+    for the same collection and filter shape
+    """
+
+    def __init__(self, explain: Callable[[str, dict], dict] = explain):
+        self.explain = explain
+        self.recent: deque = deque(maxlen=100)  # the last slow queries, the plan is added when it is explained
+        self._lock = threading.Lock()
+        self._started: Dict[int, Tuple[str, dict, str]] = {}  # {request id: (database, command, operation)}
+        self._explained: Dict[Tuple[str, str], float] = {}  # {(collection, shape): time of the last explain}
+        self._explains: deque = deque()  # times of the explains in the last minute
+        self._executor = None
+        self._executor_pid = None
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in FILTERS:
+            self._started[event.request_id] = (event.database_name, event.command,
+                                               current_operation() or event.command.get('comment'))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        started = self._started.pop(event.request_id, None)
+        if started is not None and event.duration_micros >= Config.SLOW_QUERY_MS * 1000:
+            self.record(event.command_name, *started, event.duration_micros / 1000)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._started.pop(event.request_id, None)
+
+    def record(self, name: str, database: str, command: dict, operation: str, duration: float) -> Future:
+        """
+        Print a slow query and explain it if the rate limit allows
+        :param name: command name
+        :param database: database name
+        :param command: sent command
+        :param operation: calling database function
+        :param duration: duration in ms
+        :return: future of the explain or None if the query is not explained
+        """
+        collection = command.get(name)
+        shape = str(query_shape(command_filter(name, command)))
+        query = {'command': name, 'collection': collection, 'shape': shape, 'operation': operation or 'unknown',
+                 'duration_ms': round(duration, 3), 'plan': None}
+        self.recent.append(query)
+        print(f"Slow query: {query['command']} {collection} {shape} {query['duration_ms']} ms "
+              f"({query['operation']})")
+        if Config.SLOW_QUERY_EXPLAIN and self.allow_explain(collection, shape):
+            return self.submit(self.explain_query, query, database, explain_command(name, command))
+        return None
+
+    def allow_explain(self, collection: str, shape: str) -> bool:
+        """
+        Check the rate limit of the explains and count the explain
+        :return: True if the query can be explained
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._explains and now - self._explains[0] >= 60:
+                self._explains.popleft()
+            last = self._explained.get((collection, shape))
+            if last is not None and now - last < Config.SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            if len(self._explains) >= Config.SLOW_QUERY_EXPLAINS_PER_MINUTE:
+                return False
+            if len(self._explained) >= 1000:  # Forget the shapes explained long ago
+                self._explained = {key: last for key, last in self._explained.items()
+                                   if now - last < Config.SLOW_QUERY_EXPLAIN_INTERVAL}
+            self._explained[(collection, shape)] = now
+            self._explains.append(now)
+            return True
+
+    def submit(self, function: Callable, *args) -> Future:
+        """
+        Run a function in the background thread of the process, the thread is not inherited by a forked process
+        """
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+                    self._executor_pid = pid
+        return self._executor.submit(function, *args)
+
+    def explain_query(self, query: dict, database: str, command: dict):
+        try:
+            reply = self.explain(database, command)
+        except BaseException as e:  # E.g. the command is not supported by explain
+            print(f'Error: {e}')
+            return
+        query['plan'] = plan_summary(reply.get('queryPlanner', {}).get('winningPlan', {}))
+        print(f"Slow query plan: {query['command']} {query['collection']} {query['shape']}: {query['plan']}")
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self._started.clear()
+            self._explained.clear()
+            self._explains.clear()
+
+
+# Registered on the clients of database.connection if Config.SLOW_QUERY_MS is set
+slow_query_log = SlowQueryLog()
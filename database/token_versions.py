@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import redis
+
+from config import Config
+from database import db
+from database.shared_cache import catalog_cache
+from utils.cache import CACHES
+
+
+class TokenVersions:
+    """
+    Token versions of the users who revoked their tokens: {user id: version}, the users with the version 0 are not kept.
+    A token is valid if its version is not less than the version of its user. A revocation bumps the counter
+    of the changes in the backend of the shared cache (Config.CACHE_BACKEND), every process checks the counter at most
+    once per Config.TOKEN_VERSIONS_INTERVAL seconds and reads the revocations made since the last read when it changed.
+    Without the shared cache the revocations are read every interval. A revocation older than the access tokens
+    (Config.ACCESS_TOKEN_EXPIRE_MINUTES) is forgotten: the tokens issued before it are expired
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.versions: Dict[int, int] = {}
+        self.reloads: int = 0
+        self.errors: int = 0
+        self._revoked: Dict[int, datetime] = {}  # {user id: time of the revocation (UTC)}
+        self._loaded = None  # time (UTC) the revocations were read at
+        self._counter = None  # the counter of the changes the versions were loaded at
+        self._checked = None  # time of the last check of the counter
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def __repr__(self):
+        return f"TokenVersions: users: {len(self.versions)} | reloads: {self.reloads} | errors: {self.errors}"
+
+    def counter_key(self) -> str:
+        return f'{Config.CACHE_PREFIX}:token_versions:counter'
+
+    def get(self, user_id: int) -> int:
+        """
+        :param user_id: user id
+        :return: the least token version accepted for the user
+        """
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= Config.TOKEN_VERSIONS_INTERVAL:
+            self.refresh(now)
+        return self.versions.get(user_id, 0)
+
+    async def get_async(self, user_id: int) -> int:
+        """
+        get refreshing the versions in the executor without blocking the event loop, during a refresh the other
+        requests use the versions loaded before
+        """
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= Config.TOKEN_VERSIONS_INTERVAL:
+            if self._loaded is None or not self._lock.locked():
+                await asyncio.get_running_loop().run_in_executor(None, self.refresh, now)
+        return self.versions.get(user_id, 0)
+
+    def refresh(self, now: float = None, force: bool = False):
+        """
+        Read the revocations made since the last read if the counter of the changes differs from the loaded one
+        :param now: current time.monotonic()
+        :param force: read all the revocations of the lifetime of the access tokens in any case
+        """
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            if not force and self._checked is not None and now - self._checked < Config.TOKEN_VERSIONS_INTERVAL:
+                return  # Checked by a concurrent request
+            self._checked = now
+            counter = self.read_counter()
+            if not force and counter is not None and counter == self._counter:
+                return
+            started = datetime.utcnow()
+            overlap = timedelta(seconds=Config.TOKEN_VERSIONS_OVERLAP)
+            expired = started - timedelta(minutes=float(Config.ACCESS_TOKEN_EXPIRE_MINUTES)) - overlap
+            initial = force or self._loaded is None
+            since = expired if initial else max(self._loaded - overlap, expired)
+            changes = db.get_token_versions(since, initial)
+            if changes is None:  # The versions loaded before are used until the next check
+                self.errors += 1
+                return
+            revoked = {} if initial else {id: at for id, at in self._revoked.items() if at > expired}
+            versions = {id: self.versions[id] for id in revoked if id in self.versions}
+            for id, (version, at) in changes.items():
+                revoked[id] = at or started  # Revoked before the time was stored
+                versions[id] = max(version, versions.get(id, 0))
+            self.versions = versions
+            self._revoked = revoked
+            self._loaded = started
+            self._counter = counter
+            self.reloads += 1
+
+    def read_counter(self) -> int:
+        """
+        :return: counter of the changes or None if there is no shared cache or it is unavailable
+        """
+        backend = catalog_cache.get_backend()
+        if backend is None:
+            return None
+        try:
+            return int(backend.get(self.counter_key()) or 0)
+        except redis.RedisError as e:
+            print(f'Error: {e}')
+            self.errors += 1
+            return None
+
+    def set(self, user_id: int, version: int):
+        """
+        Remember the new version of a user in this process and notify the other processes
+        :param user_id: user id
+        :param version: new token version
+        """
+        with self._lock:
+            self.versions = {**self.versions, user_id: version}  # The readers are not locked
+            self._revoked[user_id] = datetime.utcnow()
+        backend = catalog_cache.get_backend()
+        if backend is None:
+            return
+        try:
+            backend.incr(self.counter_key())
+        except redis.RedisError as e:  # The other processes see the version after the reload of the interval
+            print(f'Error: {e}')
+            self.errors += 1
+
+    def stats(self) -> dict:
+        """
+        :return: {'users', 'reloads', 'errors'}
+        """
+        return {'users': len(self.versions), 'reloads': self.reloads, 'errors': self.errors}
+
+    def reset(self):
+        with self._lock:
+            self.versions = {}
+            self._revoked = {}
+            self._loaded = None
+            self._counter = None
+            self._checked = None
+
+
+# Checked by utils.auth for the tokens with the uid claim
+token_versions = TokenVersions('token_versions')
@@ -0,0 +1,5 @@
+class Entity:
+    """
+    Base class of the entities stored in the collections, see database.registry
+    """
+    __slots__ = ()
@@ -3,8 +3,7 @@ import re
 from pydantic import BaseModel, Field
 
 from config import Config
-from controllers import excursion_point as point_service
-from controllers import object as object_service
+from models.entity import Entity
 
 
 class ExcursionIn(BaseModel):
@@ -24,13 +23,17 @@ class ExcursionUpdate(BaseModel):
     price: float = Field(None, description='The cost of the tour')
 
 
-class Excursion:
-    def __init__(self, name: str, description: str, price: float, _id: int = None, url_map_route: str = None):
+class Excursion(Entity):
+    __slots__ = ('_id', 'name', 'description', 'price', 'url_map_route', 'version')
+
+    def __init__(self, name: str, description: str, price: float, _id: int = None, url_map_route: str = None,
+                 version: int = None):
         self._id: int = _id
         self.name: str = name
         self.description: str = description
         self.price: float = price
         self.url_map_route: str = url_map_route
+        self.version: int = version  # incremented by every update, None - not checked
 
     def __repr__(self):
         return f"Excursion: {self._id} | {self.name} | {self.description} | {self.price} | {self.url_map_route}"
@@ -40,6 +43,8 @@ class Excursion:
                             url_map_route=self.url_map_route)
 
     def create_url_map_route(self):
+        from controllers import excursion_point as point_service  # Imported here to avoid a circular import
+        from controllers import object as object_service
         points = point_service.get_excursion_points_by_excursion(self._id)
         if not points:
             self.url_map_route = None
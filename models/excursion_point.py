@@ -2,11 +2,10 @@ from typing import List
 
 from pydantic import BaseModel, Field
 
+from .entity import Entity
 from .object import ObjectOut, Object
 from .track import TrackOut
 
-from controllers import object as object_service
-
 
 class ExcursionPointIn(BaseModel):
     id_excursion: int = Field(..., description='Excursion id')
@@ -32,13 +31,17 @@ class ExcursionPointDetails(BaseModel):
     sequence_number: int = Field(..., description='Sequence of point in the route')
 
 
-class ExcursionPoint:
-    def __init__(self, id_excursion: int, id_object: int, id_track: int, sequence_number: int, _id: int = None):
+class ExcursionPoint(Entity):
+    __slots__ = ('_id', 'id_excursion', 'id_object', 'id_track', 'sequence_number', 'version')
+
+    def __init__(self, id_excursion: int, id_object: int, id_track: int, sequence_number: int, _id: int = None,
+                 version: int = None):
         self._id: int = _id
         self.id_excursion: int = id_excursion
         self.id_object: int = id_object
         self.id_track: int = id_track
         self.sequence_number: int = sequence_number
+        self.version: int = version  # incremented by every update, None - not checked
 
     def __repr__(self):
         return f"Excursion Point: {self._id} | excursion id: {self.id_excursion} | object id: {self.id_object} | " \
@@ -49,4 +52,5 @@ class ExcursionPoint:
                                  id_track=self.id_track, sequence_number=self.sequence_number)
 
     def get_object(self) -> Object:
+        from controllers import object as object_service  # Imported here to avoid a circular import
         return object_service.get_object_by_id(self.id_object)
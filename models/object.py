@@ -2,6 +2,8 @@ from collections import namedtuple
 
 from pydantic import BaseModel, Field
 
+from models.entity import Entity
+
 Coordinates = namedtuple('Coordinates', ['lat', 'lon'])
 
 
@@ -21,12 +23,15 @@ class ObjectOut(ObjectIn):
     id: int = Field(..., description='Object id')
 
 
-class Object:
-    def __init__(self, name: str, description: str, location: Coordinates, _id: int = None):
+class Object(Entity):
+    __slots__ = ('_id', 'name', 'description', 'location', 'version')
+
+    def __init__(self, name: str, description: str, location: Coordinates, _id: int = None, version: int = None):
         self._id: int = _id
         self.name: str = name
         self.description: str = description
         self.location: Coordinates = location
+        self.version: int = version  # incremented by every update, None - not checked
 
     def __repr__(self):
         return f"Object: {self._id} | name: {self.name} | description: {self.description} | " \
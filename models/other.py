@@ -8,6 +8,15 @@ class TableKey:
         self.last_id: int = last_id
 
 
+class BulkResult:
+    def __init__(self, inserted: list, errors: dict):
+        self.inserted: list = inserted  # added objects in the order of the input list
+        self.errors: dict = errors  # {index in the input list: error message}
+
+    def __repr__(self):
+        return f"BulkResult: inserted: {len(self.inserted)} | errors: {len(self.errors)}"
+
+
 class Auth(BaseModel):
     email: EmailStr = Field(..., description='The email a user')
     password: str = Field(..., description='The password a user', min_length=4)
@@ -16,6 +25,11 @@ class Auth(BaseModel):
 class Token(BaseModel):
     access_token: str = Field(..., description='Access token')
     token_type: str = Field(..., description='Token type')
+    refresh_token: str = Field(None, description='Refresh token, it can be used once')
+
+
+class RefreshToken(BaseModel):
+    refresh_token: str = Field(..., description='Refresh token')
 
 
 class Statistics(BaseModel):
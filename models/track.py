@@ -1,5 +1,7 @@
 from pydantic import BaseModel, Field
 
+from models.entity import Entity
+
 
 class TrackIn(BaseModel):
     name: str = Field(..., description='The name of the track')
@@ -10,11 +12,14 @@ class TrackOut(TrackIn):
     url: str = Field(..., description='Url of the file in S3 storage')
 
 
-class Track:
-    def __init__(self, name: str, url: str = None, _id: int = None):
+class Track(Entity):
+    __slots__ = ('_id', 'name', 'url', 'version')
+
+    def __init__(self, name: str, url: str = None, _id: int = None, version: int = None):
         self._id: int = _id
         self.name: str = name
         self.url: str = url
+        self.version: int = version  # incremented by every update, None - not checked
 
     def __repr__(self):
         return f"Track: {self._id} | name: {self.name} | url: {self.url}"
@@ -3,6 +3,8 @@ from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
 from pydantic.networks import EmailStr
 
+from models.entity import Entity
+
 
 class UserAuth(BaseModel):
     email: EmailStr = Field(..., description='The email a user')
@@ -21,9 +23,11 @@ class UserOut(BaseModel):
     date_registration: datetime = Field(..., description='Date of user registration in the system')
 
 
-class User:
+class User(Entity):
+    __slots__ = ('_id', 'email', 'hash_password', 'name', 'role', 'is_active', 'date_registration', 'token_version')
+
     def __init__(self, email: str, hash_password: str, name: str, _id: int = None, role: str = 'user',
-                 is_active: bool = False, date_registration: datetime = datetime.now()):
+                 is_active: bool = False, date_registration: datetime = datetime.now(), token_version: int = 0):
         self._id: int = _id
         self.email: str = email
         self.hash_password: str = hash_password
@@ -31,6 +35,7 @@ class User:
         self.role: str = role
         self.is_active: bool = is_active
         self.date_registration = date_registration
+        self.token_version: int = token_version  # the tokens with a lower version are revoked
 
     def __repr__(self):
         return f"User: {self._id} | email: {self.email} | hash_password: {self.hash_password} | " \
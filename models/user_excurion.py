@@ -2,6 +2,7 @@ from datetime import datetime
 
 from pydantic import BaseModel, Field
 
+from .entity import Entity
 from .excursion import ExcursionOut
 from .excursion_point import ExcursionPointOut
 from .user import UserOut
@@ -25,7 +26,9 @@ class UserExcursionDetail(BaseModel):
     date_added: datetime = Field(..., description='Date added')
 
 
-class UserExcursion:
+class UserExcursion(Entity):
+    __slots__ = ('_id', 'id_user', 'id_excursion', 'id_last_point', 'is_active', 'date_added')
+
     def __init__(self, id_user: int, id_excursion: int, is_active: bool, date_added: datetime = datetime.now(),
                  id_last_point: int = 0, _id: int = None):
         self._id: int = _id
@@ -1,12 +1,12 @@
 from datetime import timedelta
 
 import jwt
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, Header, HTTPException
 from jwt import PyJWTError
 from starlette import status
 
 from config import Config
-from models.other import Error, Token
+from models.other import Error, RefreshToken, Token
 from models.user import UserOut, UserIn, User, UserAuth
 from controllers import user as user_service
 from utils import auth
@@ -25,12 +25,13 @@ async def registration(user_data: UserIn = Body(..., example={"email": "name@ema
                                                                             'must contain uppercase and lowercase '
                                                                             'letters, as well as numbers and special '
                                                                             'characters')
-    hash_password = auth.get_hash_password(user_data.password)
+    hash_password = await auth.get_hash_password_async(user_data.password)
     new_user = User(email=user_data.email, hash_password=hash_password, name=user_data.name)
     new_user = user_service.create_user(new_user)
     if new_user:
         access_token_expires = timedelta(hours=Config.REGISTRATION_EXPIRE_HOURS)
-        access_token = auth.create_access_token(data={"sub": user_data.email}, expires_delta=access_token_expires)
+        access_token = auth.create_access_token(data={"sub": user_data.email, "purpose": auth.ACTIVATION_PURPOSE},
+                                                expires_delta=access_token_expires)
         url = f'{Config.URL_SERVICE}/registration/{access_token}'
         send_email(user_data.email, title='Activate your account',
                    description=f'Click the link: {url} to activate your account. The link is valid for 24 hours')
@@ -47,7 +48,7 @@ async def confirmation_registration(token: str):
     try:
         payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("purpose") != auth.ACTIVATION_PURPOSE:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid token')
     except PyJWTError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Invalid url')
@@ -67,8 +68,31 @@ async def confirmation_registration(token: str):
 @router.post("/login", status_code=status.HTTP_200_OK, response_model=Token)
 async def login(user_data: UserAuth = Body(..., example={"email": "name@email.ru",
                                                          "password": "password"})):
-    token = user_service.login(user_data)
+    token = await user_service.login_async(user_data)
     if token is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials',
                             headers={"WWW-Authenticate": "Bearer"}, )
     return token
+
+
+@router.post("/refresh", status_code=status.HTTP_200_OK, response_model=Token, responses={401: {'model': Error}})
+async def refresh(refresh_token: RefreshToken = Body(..., example={"refresh_token": "token"})):
+    token = await user_service.refresh_async(refresh_token.refresh_token)
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials',
+                            headers={"WWW-Authenticate": "Bearer"}, )
+    return token
+
+
+@router.post("/logout", status_code=status.HTTP_200_OK, responses={404: {'model': Error}})
+async def logout(refresh_token: RefreshToken = Body(..., example={"refresh_token": "token"})):
+    if not await user_service.logout_async(refresh_token.refresh_token):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The refresh token was not found')
+    raise HTTPException(status_code=status.HTTP_200_OK, detail='The refresh tokens revoked')
+
+
+@router.post("/logout/all", status_code=status.HTTP_200_OK, responses={401: {'model': Error}})
+async def logout_everywhere(jwt: str = Header(..., example='key')):
+    user = await auth.authentication_async(jwt)
+    user_service.revoke_tokens(user._id)
+    raise HTTPException(status_code=status.HTTP_200_OK, detail='The tokens revoked')
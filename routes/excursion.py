@@ -1,7 +1,10 @@
 from typing import List
 
-from fastapi import status, Body, HTTPException, APIRouter, Header
+from fastapi import status, Body, HTTPException, APIRouter, Header, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
 
+from config import Config
 from models.excursion import ExcursionOut, ExcursionIn, Excursion, ExcursionUpdate
 from models.excursion_point import ExcursionPointOut, ExcursionPointIn, ExcursionPoint, ExcursionPointUpdate
 from models.other import Error
@@ -9,6 +12,11 @@ from models.user_excurion import UserExcursionOut
 from controllers import excursion as excursion_service
 from controllers import excursion_point as point_service
 from utils import auth
+from utils.fields import parse_fields, document_fields, sparse_out
+from utils.pagination import page_limit, parse_sort, decode_cursor, set_next_cursor
+from utils.raw import raw_response, raw_serializer
+from utils.streaming import wants_ndjson, ndjson_response, row_serializer
+from utils.versioning import parse_if_match, set_etag
 
 router = APIRouter()
 
@@ -18,23 +26,49 @@ async def create_excursion(excursion_data: ExcursionIn = Body(..., example={"nam
                                                                             "description": "Excursion description",
                                                                             "price": 100.00}),
                            jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     new_excursion = Excursion(**excursion_data.dict())
     excursion = excursion_service.create_excursion(new_excursion)
     return excursion.excursion_out()
 
 
 @router.get("", status_code=status.HTTP_200_OK, response_model=List[ExcursionOut], responses={401: {'model': Error}})
-async def get_excursions(jwt: str = Header(..., example='key')):
-    user = auth.authentication(jwt)
-    excursions = excursion_service.get_excursions(user.role)
+async def get_excursions(response: Response, jwt: str = Header(..., example='key'),
+                         fields: str = Query(None, description='Comma-separated fields of the response',
+                                             example='id,name,price'),
+                         limit: int = Query(None, ge=1, description='Number of excursions on a page'),
+                         cursor: str = Query(None, description='Cursor of the page from the X-Next-Cursor header'),
+                         sort: str = Query(None, description='Field to sort by: name or price'),
+                         accept: str = Header(None, description='application/x-ndjson to stream all excursions')):
+    user = await auth.authentication_async(jwt)
+    fields = parse_fields(fields, ExcursionOut)
+    sort = parse_sort(sort, ['name', 'price'])
+    if Config.RAW_LISTS:  # The rows are encoded from the documents, see utils.raw
+        fields = fields or list(ExcursionOut.__fields__)
+        limit = limit if wants_ndjson(accept) else page_limit(limit, cursor)
+        documents = excursion_service.iter_raw_excursions(user.role, document_fields(fields, sort), limit,
+                                                          decode_cursor(cursor, sort), sort, read='catalog')
+        if wants_ndjson(accept):
+            return ndjson_response(documents, raw_serializer(fields))
+        return await run_in_threadpool(raw_response, documents, fields, limit, sort)  # The cursor is read there
+    if wants_ndjson(accept):  # Export: without the default limit
+        excursions = excursion_service.iter_excursions(user.role, document_fields(fields, sort), limit,
+                                                       decode_cursor(cursor, sort), sort, read='catalog')
+        return ndjson_response(excursions, row_serializer(fields, Excursion.excursion_out))
+    limit = page_limit(limit, cursor)
+    excursions = await excursion_service.get_excursions_async(user.role, document_fields(fields, sort), limit,
+                                                              decode_cursor(cursor, sort), sort)
+    if fields is not None:
+        response = JSONResponse([sparse_out(excursion, fields) for excursion in excursions])
+        return set_next_cursor(response, excursions, limit, sort)
+    set_next_cursor(response, excursions, limit, sort)
     return [excursion.excursion_out() for excursion in excursions]
 
 
 @router.post("/{excursion_id}", status_code=status.HTTP_200_OK, response_model=UserExcursionOut,
              responses={401: {'model': Error}, 404: {'model': Error}})
 async def buy_excursion(excursion_id: int, jwt: str = Header(..., example='key')):
-    user = auth.authentication(jwt)
+    user = await auth.authentication_async(jwt)
     bought_excursion = excursion_service.buy_excursion(excursion_id, user._id)
     if not bought_excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
@@ -43,26 +77,34 @@ async def buy_excursion(excursion_id: int, jwt: str = Header(..., example='key')
 
 @router.get("/{excursion_id}", status_code=status.HTTP_200_OK, response_model=ExcursionOut,
             responses={401: {'model': Error}, 404: {'model': Error}})
-async def get_excursion_by_id(excursion_id: int, jwt: str = Header(..., example='key')):
-    user = auth.authentication(jwt)
-    excursion = excursion_service.get_excursion_by_id(excursion_id)
+async def get_excursion_by_id(excursion_id: int, response: Response, jwt: str = Header(..., example='key'),
+                              fields: str = Query(None, description='Comma-separated fields of the response',
+                                                  example='id,name,price')):
+    user = await auth.authentication_async(jwt)
+    fields = parse_fields(fields, ExcursionOut)
+    excursion = excursion_service.get_excursion_by_id(excursion_id, document_fields(fields, 'url_map_route'))
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
     if excursion.url_map_route is None and user.role == 'user':
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
+    if fields is not None:
+        return JSONResponse(sparse_out(excursion, fields))
+    set_etag(response, excursion)
     return excursion.excursion_out()
 
 
 @router.put("/{excursion_id}", status_code=status.HTTP_200_OK, response_model=ExcursionOut,
-            responses={400: {'model': Error}, 401: {'model': Error}})
-async def edit_excursion(excursion_id: int, excursion_update: ExcursionUpdate = Body(..., example={"id_route": 1,
+            responses={400: {'model': Error}, 401: {'model': Error}, 412: {'model': Error}})
+async def edit_excursion(excursion_id: int, response: Response, excursion_update: ExcursionUpdate = Body(..., example={"id_route": 1,
                                                                                                    "name": "New name",
                                                                                                    "description": "New description",
                                                                                                    "price": 120.00}),
-                         jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    update_excursion = excursion_service.update_excursion(excursion_id, excursion_update)
+                         jwt: str = Header(..., example='key'),
+                         if_match: str = Header(None, description='ETag of the excursion the update was made from')):
+    await auth.authentication_async(jwt, 'admin')
+    update_excursion = excursion_service.update_excursion(excursion_id, excursion_update, parse_if_match(if_match))
     if update_excursion:
+        set_etag(response, update_excursion)
         return update_excursion.excursion_out()
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
@@ -70,9 +112,11 @@ async def edit_excursion(excursion_id: int, excursion_update: ExcursionUpdate =
 
 @router.delete("/{excursion_id}", status_code=status.HTTP_200_OK, response_model=ExcursionOut,
                responses={401: {'model': Error}, 404: {'model': Error}})
-async def delete_excursion_by_id(excursion_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    excursion = excursion_service.delete_excursion(excursion_id)
+async def delete_excursion_by_id(excursion_id: int, jwt: str = Header(..., example='key'),
+                                purchases: bool = Query(False, description='Also delete the purchases of the '
+                                                                           'excursion')):
+    await auth.authentication_async(jwt, 'admin')
+    excursion = excursion_service.delete_excursion(excursion_id, purchases)
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
     return excursion.excursion_out()
@@ -89,7 +133,7 @@ async def create_excursion_point(excursion_id: int, point_data: ExcursionPointIn
                                                                                                  "id_track": 1,
                                                                                                  "sequence_number": 1}),
                                  jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     excursion = excursion_service.get_excursion_by_id(excursion_id)
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
@@ -105,13 +149,19 @@ async def create_excursion_point(excursion_id: int, point_data: ExcursionPointIn
 
 @router.get("/{excursion_id}/point", status_code=status.HTTP_200_OK, response_model=List[ExcursionPointOut],
             responses={401: {'model': Error}})
-async def get_excursion_points(excursion_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt)
-    excursion = excursion_service.get_excursion_by_id(excursion_id)
+async def get_excursion_points(excursion_id: int, response: Response, jwt: str = Header(..., example='key'),
+                               limit: int = Query(None, ge=1, description='Number of points on a page'),
+                               cursor: str = Query(None, description='Cursor of the page from the X-Next-Cursor '
+                                                                     'header')):
+    await auth.authentication_async(jwt)
+    excursion = await excursion_service.get_excursion_by_id_async(excursion_id)
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
-    points = point_service.get_excursion_points_by_excursion(excursion_id)
-    if len(points) == 0:
+    limit = page_limit(limit, cursor)
+    points = await point_service.get_excursion_points_by_excursion_async(excursion_id, limit, decode_cursor(cursor),
+                                                                         read='catalog')
+    set_next_cursor(response, points, limit)
+    if len(points) == 0 and cursor is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id has no excursion '
                                                                           'point')
 
@@ -120,8 +170,9 @@ async def get_excursion_points(excursion_id: int, jwt: str = Header(..., example
 
 @router.get("/{excursion_id}/point/{point_id}", status_code=status.HTTP_200_OK, response_model=ExcursionPointOut,
             responses={401: {'model': Error}, 404: {'model': Error}})
-async def get_excursion_point_by_id(excursion_id: int, point_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+async def get_excursion_point_by_id(excursion_id: int, point_id: int, response: Response,
+                                    jwt: str = Header(..., example='key')):
+    await auth.authentication_async(jwt, 'admin')
     excursion = excursion_service.get_excursion_by_id(excursion_id)
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
@@ -129,29 +180,34 @@ async def get_excursion_point_by_id(excursion_id: int, point_id: int, jwt: str =
     if not point:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion point with this id was not '
                                                                           'found')
+    set_etag(response, point)
     return point.excursion_point_out()
 
 
 @router.put("/{excursion_id}/point/{point_id}", status_code=status.HTTP_200_OK, response_model=ExcursionPointOut,
-            responses={400: {'model': Error}, 401: {'model': Error}})
-async def edit_excursion_point(excursion_id: int, point_id: int,
+            responses={400: {'model': Error}, 401: {'model': Error}, 412: {'model': Error}})
+async def edit_excursion_point(excursion_id: int, point_id: int, response: Response,
                                point_update: ExcursionPointUpdate = Body(..., example={"id_object": 1,
                                                                                        "id_track": 1}),
-                               jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    update_point = point_service.update_excursion_point(point_id, point_update.id_object, point_update.id_track)
+                               jwt: str = Header(..., example='key'),
+                               if_match: str = Header(None, description='ETag of the excursion point the update was '
+                                                                        'made from')):
+    await auth.authentication_async(jwt, 'admin')
+    update_point = point_service.update_excursion_point(point_id, point_update.id_object, point_update.id_track,
+                                                        parse_if_match(if_match))
     if not update_point:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
     excursion = excursion_service.get_excursion_by_id(excursion_id)
     if point_update.id_object:
         excursion_service.update_url_map_route(excursion_id)
+    set_etag(response, update_point)
     return update_point.excursion_point_out()
 
 
 @router.delete("/{excursion_id}/point/{point_id}", status_code=status.HTTP_200_OK, response_model=ExcursionPointOut,
                responses={401: {'model': Error}, 404: {'model': Error}})
 async def delete_excursion_point_by_id(excursion_id: int, point_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     excursion = excursion_service.get_excursion_by_id(excursion_id)
     if not excursion:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An excursion with this id was not found')
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Header
+from starlette import status
+from starlette.responses import Response
+
+from database.monitoring import command_metrics
+from utils import auth
+from utils.cache import cache_stats
+
+router = APIRouter()
+
+PROMETHEUS = 'text/plain; version=0.0.4'
+
+
+def render_cache_metrics() -> str:
+    """
+    Get the counters of the caches in the Prometheus text format
+    :return: text of the metrics
+    """
+    lines = []
+    for counter, metric_type in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                                 ('errors', 'counter'), ('size', 'gauge')):
+        values = [(name, stats[counter]) for name, stats in sorted(cache_stats().items()) if counter in stats]
+        if not values:
+            continue
+        suffix = '_total' if metric_type == 'counter' else ''
+        lines += [f'# HELP cache_{counter}{suffix} Cache {counter}', f'# TYPE cache_{counter}{suffix} {metric_type}']
+        lines += [f'cache_{counter}{suffix}{{cache="{name}"}} {value}' for name, value in values]
+    return '\n'.join(lines) + '\n'
+
+
+@router.get('/metrics', status_code=status.HTTP_200_OK, include_in_schema=False)
+async def get_metrics(jwt: str = Header(..., example='key')):
+    await auth.authentication_async(jwt, 'admin')  # The metrics name the collections and the database functions
+    return Response(command_metrics.render() + render_cache_metrics(), media_type=PROMETHEUS)
@@ -1,11 +1,19 @@
 from typing import List
 
-from fastapi import status, Body, HTTPException, APIRouter, Header
+from fastapi import status, Body, HTTPException, APIRouter, Header, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
 
+from config import Config
 from models.object import ObjectOut, ObjectIn, Object, ObjectUpdate
 from models.other import Error
 from controllers import object as object_service
 from utils import auth
+from utils.fields import parse_fields, document_fields, sparse_out
+from utils.pagination import page_limit, parse_sort, decode_cursor, set_next_cursor
+from utils.raw import raw_response, raw_serializer
+from utils.streaming import wants_ndjson, ndjson_response, row_serializer
+from utils.versioning import parse_if_match, set_etag
 
 router = APIRouter()
 
@@ -18,7 +26,7 @@ async def create_object(obj_data: ObjectIn = Body(..., example={"name": "Name of
                                                                 "location": {'lat': 59.93904113769531,
                                                                              'lon': 30.3157901763916}}),
                         jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     new_obj = Object(**obj_data.dict())
     new_obj = object_service.create_object(new_obj)
     if new_obj:
@@ -28,33 +36,67 @@ async def create_object(obj_data: ObjectIn = Body(..., example={"name": "Name of
 
 
 @router.get("", status_code=status.HTTP_200_OK, response_model=List[ObjectOut], responses={401: {'model': Error}})
-async def get_objects(jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    objects = object_service.get_objects()
+async def get_objects(response: Response, jwt: str = Header(..., example='key'),
+                      fields: str = Query(None, description='Comma-separated fields of the response',
+                                          example='id,name'),
+                      limit: int = Query(None, ge=1, description='Number of objects on a page'),
+                      cursor: str = Query(None, description='Cursor of the page from the X-Next-Cursor header'),
+                      sort: str = Query(None, description='Field to sort by: name'),
+                      accept: str = Header(None, description='application/x-ndjson to stream all objects')):
+    await auth.authentication_async(jwt, 'admin')
+    fields = parse_fields(fields, ObjectOut)
+    sort = parse_sort(sort, ['name'])
+    if Config.RAW_LISTS:  # The rows are encoded from the documents, see utils.raw
+        fields = fields or list(ObjectOut.__fields__)
+        limit = limit if wants_ndjson(accept) else page_limit(limit, cursor)
+        documents = object_service.iter_raw_objects(document_fields(fields, sort), limit, decode_cursor(cursor, sort),
+                                                    sort, read='catalog')
+        if wants_ndjson(accept):
+            return ndjson_response(documents, raw_serializer(fields))
+        return await run_in_threadpool(raw_response, documents, fields, limit, sort)  # The cursor is read there
+    if wants_ndjson(accept):  # Export: without the default limit
+        objects = object_service.iter_objects(document_fields(fields, sort), limit, decode_cursor(cursor, sort), sort,
+                                              read='catalog')
+        return ndjson_response(objects, row_serializer(fields, Object.object_out))
+    limit = page_limit(limit, cursor)
+    objects = await object_service.get_objects_async(document_fields(fields, sort), limit, decode_cursor(cursor, sort),
+                                                     sort)
+    if fields is not None:
+        response = JSONResponse([sparse_out(object_, fields) for object_ in objects])
+        return set_next_cursor(response, objects, limit, sort)
+    set_next_cursor(response, objects, limit, sort)
     return [object_.object_out() for object_ in objects]
 
 
 @router.get("/{object_id}", status_code=status.HTTP_200_OK, response_model=ObjectOut,
             responses={401: {'model': Error}, 404: {'model': Error}})
-async def get_object_by_id(object_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    object_ = object_service.get_object_by_id(object_id)
+async def get_object_by_id(object_id: int, response: Response, jwt: str = Header(..., example='key'),
+                           fields: str = Query(None, description='Comma-separated fields of the response',
+                                               example='id,name')):
+    await auth.authentication_async(jwt, 'admin')
+    fields = parse_fields(fields, ObjectOut)
+    object_ = object_service.get_object_by_id(object_id, document_fields(fields))
     if not object_:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An object with this id was not found')
+    if fields is not None:
+        return JSONResponse(sparse_out(object_, fields))
+    set_etag(response, object_)
     return object_.object_out()
 
 
 @router.put("/{object_id}", status_code=status.HTTP_200_OK, response_model=ObjectOut,
-            responses={401: {'model': Error}, 404: {'model': Error}})
-async def edit_object(object_id: int, obj_update: ObjectUpdate = Body(..., example={"name": "New name of the point",
+            responses={401: {'model': Error}, 404: {'model': Error}, 412: {'model': Error}})
+async def edit_object(object_id: int, response: Response, obj_update: ObjectUpdate = Body(..., example={"name": "New name of the point",
                                                                                     "description": "New description",
                                                                                     "location": {
                                                                                         'lat': 59.93904113769531,
                                                                                         'lon': 30.3157901763916}}),
-                      jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
-    update_object = object_service.update_object(object_id, obj_update)
+                      jwt: str = Header(..., example='key'),
+                      if_match: str = Header(None, description='ETag of the object the update was made from')):
+    await auth.authentication_async(jwt, 'admin')
+    update_object = object_service.update_object(object_id, obj_update, parse_if_match(if_match))
     if update_object:
+        set_etag(response, update_object)
         return update_object.object_out()
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An object with this id was not found')
@@ -63,7 +105,7 @@ async def edit_object(object_id: int, obj_update: ObjectUpdate = Body(..., examp
 @router.delete("/{object_id}", status_code=status.HTTP_200_OK, response_model=ObjectOut,
                responses={401: {'model': Error}, 404: {'model': Error}})
 async def delete_object_by_id(object_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     object_ = object_service.delete_object(object_id)
     if not object_:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='An object with this id was not found')
@@ -4,6 +4,8 @@ from fastapi import APIRouter, Header
 from starlette import status
 
 from models.other import Statistics
+from utils import auth
+from utils.cache import cache_stats
 
 router = APIRouter()
 
@@ -27,3 +29,9 @@ async def get_statistics_listening(jwt: str = Header(..., example='key'), start:
 @router.get('/sales', status_code=status.HTTP_200_OK, response_model=Statistics)
 async def get_statistics_sales(jwt: str = Header(..., example='key'), start: datetime = None, end: datetime = None):
     pass
+
+
+@router.get('/cache', status_code=status.HTTP_200_OK, response_model=Statistics)
+async def get_statistics_cache(jwt: str = Header(..., example='key')):
+    await auth.authentication_async(jwt, 'admin')
+    return Statistics(type='cache', data=cache_stats())
@@ -1,12 +1,18 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Header, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Header, Form, Query
 from starlette import status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
 
+from config import Config
 from models.other import Error
 from models.track import TrackOut
 from controllers import track as track_service
 from utils import auth
+from utils.fields import parse_fields, document_fields, sparse_out
+from utils.pagination import page_limit, parse_sort, decode_cursor, set_next_cursor
+from utils.raw import raw_response
 
 router = APIRouter()
 
@@ -15,7 +21,7 @@ router = APIRouter()
                                                                                           500: {'model': Error}})
 async def add_track_storage(track_data: UploadFile = File(...), name: str = Form(...),
                             jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     file_extension = track_data.filename.split('.')[1]
     if file_extension not in ['mp3']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid file extension')
@@ -30,20 +36,43 @@ async def add_track_storage(track_data: UploadFile = File(...), name: str = Form
 
 @router.get("", status_code=status.HTTP_200_OK, response_model=List[TrackOut], responses={401: {'model': Error},
                                                                                           500: {'model': Error}})
-async def get_tracks(jwt: str = Header(..., example='key')):
-    auth.authentication(jwt)
-    tracks = track_service.get_tracks()
+async def get_tracks(response: Response, jwt: str = Header(..., example='key'),
+                     fields: str = Query(None, description='Comma-separated fields of the response',
+                                         example='id,url'),
+                     limit: int = Query(None, ge=1, description='Number of tracks on a page'),
+                     cursor: str = Query(None, description='Cursor of the page from the X-Next-Cursor header'),
+                     sort: str = Query(None, description='Field to sort by: name')):
+    await auth.authentication_async(jwt)
+    fields = parse_fields(fields, TrackOut)
+    sort = parse_sort(sort, ['name'])
+    limit = page_limit(limit, cursor)
+    if Config.RAW_LISTS:  # The rows are encoded from the documents, see utils.raw
+        fields = fields or list(TrackOut.__fields__)
+        documents = track_service.iter_raw_tracks(document_fields(fields, sort), limit, decode_cursor(cursor, sort),
+                                                  sort, read='catalog')
+        return await run_in_threadpool(raw_response, documents, fields, limit, sort)  # The cursor is read there
+    tracks = await track_service.get_tracks_async(document_fields(fields, sort), limit, decode_cursor(cursor, sort),
+                                                  sort)
+    if fields is not None:
+        response = JSONResponse([sparse_out(track, fields) for track in tracks])
+        return set_next_cursor(response, tracks, limit, sort)
+    set_next_cursor(response, tracks, limit, sort)
     return [track.track_out() for track in tracks]
 
 
 @router.get("/{track_id}", status_code=status.HTTP_200_OK, response_model=TrackOut, responses={401: {'model': Error},
                                                                                                404: {'model': Error},
                                                                                                500: {'model': Error}})
-async def get_track_by_id(track_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt)
-    track = track_service.get_track_by_id(track_id)
+async def get_track_by_id(track_id: int, jwt: str = Header(..., example='key'),
+                          fields: str = Query(None, description='Comma-separated fields of the response',
+                                              example='id,url')):
+    await auth.authentication_async(jwt)
+    fields = parse_fields(fields, TrackOut)
+    track = track_service.get_track_by_id(track_id, document_fields(fields))
     if not track:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='A track with this id was not found')
+    if fields is not None:
+        return JSONResponse(sparse_out(track, fields))
     return track.track_out()
 
 
@@ -51,7 +80,7 @@ async def get_track_by_id(track_id: int, jwt: str = Header(..., example='key')):
             responses={400: {'model': Error}, 401: {'model': Error}, 404: {'model': Error}, 500: {'model': Error}})
 async def edit_track(track_id: int, track_data: UploadFile = File(None), name: str = Form(None),
                       jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
 
     if track_data is None and name is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad request: no data was received for '
@@ -80,7 +109,7 @@ async def edit_track(track_id: int, track_data: UploadFile = File(None), name: s
 @router.delete("/{track_id}", status_code=status.HTTP_200_OK, response_model=TrackOut,
                responses={401: {'model': Error}, 404: {'model': Error}})
 async def delete_object_by_id(track_id: int, jwt: str = Header(..., example='key')):
-    auth.authentication(jwt, 'admin')
+    await auth.authentication_async(jwt, 'admin')
     track = track_service.delete_track(track_id)
     if not track:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='A track with this id was not found')
@@ -1,9 +1,13 @@
 from typing import List
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Header, HTTPException
 from starlette import status
 
+from controllers import user as user_service
+from models.other import Error
+from models.user import UserOut
 from models.user_excurion import UserExcursionOut, UserExcursionDetail
+from utils import auth
 
 router = APIRouter()
 
@@ -16,3 +20,13 @@ async def get_users_excursions(jwt: str = Header(..., example='key')):
 @router.get('/excursion/{user_excursion_id}', status_code=status.HTTP_200_OK, response_model=UserExcursionDetail)
 async def get_users_excursion_by_id(user_excursion_id: int, jwt: str = Header(..., example='key')):
     pass
+
+
+@router.post('/{user_id}/deactivate', status_code=status.HTTP_200_OK, response_model=UserOut,
+             responses={401: {'model': Error}, 403: {'model': Error}, 404: {'model': Error}})
+async def deactivate_user(user_id: int, jwt: str = Header(..., example='key')):
+    await auth.authentication_async(jwt, 'admin')
+    user = user_service.deactivate_user(user_id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='A user with this id was not found')
+    return user.user_out()
@@ -1,11 +1,17 @@
+import asyncio
 import copy
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from fastapi import HTTPException
 from pytest import raises
 
+from config import Config
+from database import db
+
 from database.connection import Database
+from database.shared_cache import MemoryBackend, catalog_cache
 from models.excursion_point import ExcursionPoint, ExcursionPointUpdate
 from models.track import Track
 from models.user import User, UserAuth
@@ -13,6 +19,7 @@ from models.object import Object, Coordinates, ObjectUpdate
 from models.excursion import Excursion, ExcursionUpdate
 from models.other import Token
 
+from utils import auth
 from utils.auth import get_hash_password
 from controllers import user as user_service
 from controllers import object as object_service
@@ -33,6 +40,7 @@ class TestUser:
         keys = db.get_collection('table_keys')
         users.delete_many({})
         keys.delete_many({})
+        db.get_collection('refresh_tokens').delete_many({})
 
     def test_create_user(self):
         result = user_service.create_user(self.user)
@@ -57,6 +65,38 @@ class TestUser:
         jwt = user_service.login(UserAuth(email=self.user.email, password='ErrorPass'))
         assert jwt is None
 
+    def test_login_async(self):
+        jwt = asyncio.run(user_service.login_async(UserAuth(email=self.user.email, password='Password_1')))
+        assert type(jwt) is Token
+        assert asyncio.run(user_service.login_async(UserAuth(email=self.user.email, password='ErrorPass'))) is None
+
+    def test_refresh(self):
+        jwt = user_service.login(UserAuth(email=self.user.email, password='Password_1'))
+        token = user_service.refresh(jwt.refresh_token)
+        assert type(token) is Token
+        assert token.refresh_token not in (None, jwt.refresh_token)
+        assert auth.authentication(token.access_token).email == self.user.email
+        assert user_service.refresh(jwt.refresh_token) is None  # Used twice, the family is revoked
+        assert user_service.refresh(token.refresh_token) is None
+        assert user_service.refresh('error') is None
+
+    def test_logout(self):
+        jwt = user_service.login(UserAuth(email=self.user.email, password='Password_1'))
+        token = user_service.refresh(jwt.refresh_token)
+        assert user_service.logout(jwt.refresh_token) is True
+        assert user_service.refresh(token.refresh_token) is None
+        assert user_service.logout(jwt.refresh_token) is False
+
+    def test_rehash_on_login(self):
+        hash_password = auth.pwd_context.hash('Password_1', rounds=Config.BCRYPT_ROUNDS - 1)
+        user = db.get_user_by_email(self.user.email)
+        db.find_and_update(user._id, 'users', {'hash_password': hash_password})
+        assert type(user_service.login(UserAuth(email=self.user.email, password='Password_1'))) is Token
+        hash_password = db.get_data_by_id(user._id, 'users').hash_password
+        assert auth.pwd_context.identify(hash_password) == 'bcrypt'
+        assert f'${Config.BCRYPT_ROUNDS:02d}$' in hash_password
+        assert auth.verify_and_update_password('Password_1', hash_password) == (True, None)
+
     def test_get_users_inactive(self):
         user_1 = User('user_1@email.ru', get_hash_password('Password_1'), 'User')
         user_1.date_registration = datetime.now() - timedelta(hours=25)
@@ -120,7 +160,7 @@ class TestObject:
         assert type(result) is Object
         assert result.name == update.name
         assert result.description == update.description
-        assert result.location == update.location
+        assert tuple(result.location) == update.location  # The updated document stores the tuple as an array
         result = object_service.update_object(10, update)
         assert result is None
 
@@ -390,5 +430,105 @@ class TestExcursionPoints:
         assert point is None
 
 
+class TestIdSequence:
+
+    def setup_class(cls):
+        cls.hash_password = get_hash_password('Password_1')
+        cls.obj = Object(name='Object', description='Object`s description', location=Coordinates(lat=59.9390,
+                                                                                                 lon=30.3157))
+
+    def teardown_class(cls):
+        db.reset_id_blocks()
+        db_ = Database()
+        users = db_.get_collection('users')
+        objects = db_.get_collection('objects')
+        keys = db_.get_collection('table_keys')
+        users.delete_many({})
+        objects.delete_many({})
+        keys.delete_many({})
+
+    def test_concurrent_create_user(self):
+        users = [User(f'user_{i}@email.ru', self.hash_password, 'User') for i in range(100)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            created = list(executor.map(user_service.create_user, users))
+        assert sorted(user._id for user in created) == list(range(1, 101))
+        assert db.get_last_id('users').last_id == 101
+
+    def test_concurrent_create_object(self):
+        objects = [copy.deepcopy(self.obj) for _ in range(100)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            created = list(executor.map(object_service.create_object, objects))
+        assert sorted(obj._id for obj in created) == list(range(1, 101))
+        assert db.get_last_id('objects').last_id == 101
+
+    def test_create_users(self):
+        users = [User(f'bulk_user_{i}@email.ru', self.hash_password, 'User') for i in range(10)]
+        result = user_service.create_users(users)
+        assert result.errors == {}
+        assert [user._id for user in result.inserted] == list(range(101, 111))
+
+    def test_create_objects(self):
+        objects = [copy.deepcopy(self.obj) for _ in range(10)]
+        result = object_service.create_objects(objects)
+        assert result.errors == {}
+        assert [obj._id for obj in result.inserted] == list(range(101, 111))
+
+    def test_create_excursion_points(self):
+        points = [ExcursionPoint(1, 1, 1, 1), ExcursionPoint(1, 2, 2, 2), ExcursionPoint(1, 3, 3, 2),
+                  ExcursionPoint(1, 4, 4, 5), ExcursionPoint(2, 1, 1, 2), ExcursionPoint(1, 5, 5, 3)]
+        result = point_service.create_excursion_points(points)
+        assert list(result.errors.keys()) == [2, 3, 4]
+        assert [point.sequence_number for point in result.inserted] == [1, 2, 3]
+        assert len(point_service.get_excursion_points_by_excursion(1)) == 3
+        db_ = Database()
+        db_.get_collection('excursion_points').delete_many({})
+
+    def test_id_blocks(self):
+        block_size = Config.ID_BLOCK_SIZE
+        Config.ID_BLOCK_SIZE = 10
+        try:
+            objects = [copy.deepcopy(self.obj) for _ in range(25)]
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                created = list(executor.map(object_service.create_object, objects))
+        finally:
+            Config.ID_BLOCK_SIZE = block_size
+        ids = [obj._id for obj in created]
+        assert len(set(ids)) == 25
+        assert min(ids) == 111
+        assert db.get_last_id('objects').last_id > max(ids)
+
+
+
+class TestCatalogCache:
+
+    def setup_class(cls):
+        catalog_cache.set_backend(MemoryBackend())
+        cls.excursion = excursion_service.create_excursion(Excursion('Excursion', 'Description', 100.0))
+
+    def teardown_class(cls):
+        catalog_cache.set_backend(None)
+        db_ = Database()
+        db_.get_collection('excursions').delete_many({})
+        db_.get_collection('table_keys').delete_many({})
+
+    def test_get_excursions(self):
+        hits = catalog_cache.hits
+        assert [excursion.name for excursion in excursion_service.get_excursions('admin')] == ['Excursion']
+        excursions = excursion_service.get_excursions('admin')
+        assert catalog_cache.hits == hits + 1
+        assert type(excursions[0]) is Excursion
+        assert excursions[0].price == 100.0
+        assert excursion_service.get_excursions('user') == []
+
+    def test_get_excursion_by_id(self):
+        assert excursion_service.get_excursion_by_id(self.excursion._id).name == 'Excursion'
+        assert excursion_service.get_excursion_by_id(self.excursion._id, ['name']).price is None
+
+    def test_version_bumped_on_write(self):
+        excursion_service.update_excursion(self.excursion._id, ExcursionUpdate(name='Excursion 2'))
+        assert excursion_service.get_excursion_by_id(self.excursion._id).name == 'Excursion 2'
+        assert [excursion.name for excursion in excursion_service.get_excursions('admin')] == ['Excursion 2']
+
+
 if __name__ == '__main__':
     unittest.main()
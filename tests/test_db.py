@@ -1,16 +1,42 @@
+import asyncio
 import copy
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-from database.connection import Database
+import pytest
+from pymongo import ReadPreference, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from config import Config
+from database.connection import Database, get_client, close_client, read_options, write_options
 from models.excursion import Excursion
 from models.excursion_point import ExcursionPoint
 from models.object import Object, Coordinates
-from models.other import TableKey
+from models.other import BulkResult, TableKey
 from models.track import Track
 from utils.auth import get_hash_password
-from database import db
+from database import db, async_db
+from database.indexes import ensure_indexes, index_report
+from database.memory import MemoryClient
+from database.monitoring import command_metrics
+from database import connection
+from database.registry import get_entity_model, get_model
+from database.slow_queries import SlowQueryLog, query_shape, slow_query_log
 from models.user import User
+from models.user_excurion import UserExcursion
+
+
+class TestConnection:
+
+    def test_shared_client(self):
+        assert Database().client is Database().client
+        assert get_client() is Database().client
+
+    def test_close_client(self):
+        client = get_client()
+        close_client()
+        assert get_client() is not client
 
 
 class TestBase:
@@ -37,19 +63,34 @@ class TestBase:
         db.add(user_2)
         assert db.delete(2, 'users') is True
 
-    def test_update_item(self):
-        update = copy.deepcopy(self.user)
-        update._id = 1
-        update.name = 'Updated name'
-        update.email = 'update@email.ru'
-        result = db.update_item(update)
-        assert result is True
+    def test_find_and_update(self):
+        user = db.find_and_update(1, 'users', {'name': 'Found and updated'})
+        assert type(user) is User
+        assert user.name == 'Found and updated'
+        assert user.email == db.get_data_by_id(1, 'users').email
+        assert db.find_and_update(1, 'users', {'name': 'Name'}, {'name': 'Other name'}) is None
+        assert db.find_and_update(10, 'users', {'name': 'Name'}) is None
+
+    def test_find_and_delete(self):
+        user = db.add(User('user_3@email.ru', get_hash_password('Password_1'), 'User'))
+        deleted_user = db.find_and_delete(user._id, 'users')
+        assert deleted_user.email == user.email
+        assert db.get_data_by_id(user._id, 'users') is None
+        assert db.find_and_delete(user._id, 'users') is None
 
     def test_get_data_by_id(self):
         user = db.get_data_by_id(1, 'users')
         assert type(user) is User
         assert user._id == self.user._id
 
+    def test_get_data_by_id_fields(self):
+        user = db.get_data_by_id(1, 'users', ['email', 'role'])
+        assert type(user) is User
+        assert user._id == 1
+        assert user.email == db.get_data_by_id(1, 'users').email
+        assert user.hash_password is None
+        assert user.name is None
+
     def test_get_all_items(self):
         users = db.get_all_items('users')
         assert type(users) is list
@@ -66,6 +107,15 @@ class TestBase:
         assert objects_in_db[0].name == objects[0].name
         assert objects_in_db[1].name == objects[1].name
 
+    def test_get_all_items_pages(self):
+        objects = db.get_all_items('objects', limit=1)
+        assert [obj._id for obj in objects] == [1]
+        objects = db.get_all_items('objects', limit=1, after=1)
+        assert [obj._id for obj in objects] == [2]
+        assert db.get_all_items('objects', after=2) == []
+        objects = db.get_all_items('objects', sort='name', after=['Object 1', 1])
+        assert [obj.name for obj in objects] == ['Object 2']
+
     def test_delete_items_by_list_id(self):
         assert db.delete_items_by_list_id([1, 2], 'objects') is True
 
@@ -198,6 +248,426 @@ class TestTableKey:
         assert key.table == 'users'
         assert key.last_id == 1
 
+    def test_reserve_ids_concurrent(self, monkeypatch):
+        keys = Database().get_collection('table_keys')
+        keys.drop_indexes()  # Without database.indexes.ensure_indexes, as in Celery
+        monkeypatch.setattr(db, '_key_index_pid', None)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            ids = list(executor.map(lambda _: db.reserve_ids('concurrent_keys'), range(32)))
+        assert sorted(ids) == list(range(1, 33))
+        assert keys.count_documents({'table': 'concurrent_keys'}) == 1
+        assert keys.index_information()['table_unique']['unique'] is True
+
+
+class TestBulk:
+    def teardown_class(cls):
+        db = Database()
+        objects = db.get_collection('objects')
+        tracks = db.get_collection('tracks')
+        keys = db.get_collection('table_keys')
+        objects.delete_many({})
+        tracks.delete_many({})
+        keys.delete_many({})
+
+    def test_add_many(self):
+        items = [Object(f'Object {i}', 'Description', Coordinates(lat=38.12, lon=55.43)) for i in range(5)]
+        items.insert(2, Track('Track'))
+        items.insert(4, 'Not an entity')
+        result = db.add_many(items)
+        assert type(result) is BulkResult
+        assert list(result.errors.keys()) == [4]
+        assert len(result.inserted) == 6
+        assert [item._id for item in result.inserted if type(item) is Object] == [1, 2, 3, 4, 5]
+        assert result.inserted[2]._id == 1
+        assert db.get_last_id('objects').last_id == 6
+        assert len(db.get_all_items('objects')) == 5
+
+
+class TestRegistry:
+    def test_models(self):
+        assert get_model('tracks').entity is Track
+        assert get_entity_model(Track('Track')) is get_model('tracks')
+        assert get_model('table_keys') is None
+        assert get_entity_model('Not an entity') is None
+
+    def test_converters(self):
+        model = get_model('excursions')
+        excursion = Excursion('Excursion', 'Description', 100.0, 1)
+        document = model.to_document(excursion)
+        assert document == {'_id': 1, 'name': 'Excursion', 'description': 'Description', 'price': 100.0,
+                            'url_map_route': None, 'version': None}
+        excursion = model.from_document({'_id': 2, 'name': 'Excursion', 'unknown': True})
+        assert type(excursion) is Excursion
+        assert (excursion._id, excursion.name, excursion.price) == (2, 'Excursion', None)
+        assert not hasattr(excursion, '__dict__')
+
+
+class TestVersion:
+    def teardown_class(cls):
+        Database().get_collection('excursions').delete_many({})
+        Database().get_collection('table_keys').delete_many({})
+
+    def test_find_and_update(self):
+        excursion = db.add(Excursion('Excursion', 'Description', 100.0))
+        assert excursion.version == 1
+        assert db.find_and_update(excursion._id, 'excursions', {'price': 120.0}, version=2) is None
+        updated = db.find_and_update(excursion._id, 'excursions', {'price': 120.0}, version=1)
+        assert (updated.price, updated.version) == (120.0, 2)
+        assert db.find_and_update(excursion._id, 'excursions', {'price': 130.0}).version == 3
+
+
+class TestReadOptions:
+    def test_read_options(self):
+        catalog = read_options('excursions', 'catalog')
+        assert catalog['read_preference'] == ReadPreference.SECONDARY_PREFERRED
+        assert catalog['read_concern'].level == 'local'
+        assert read_options('users', 'catalog')['read_preference'] == ReadPreference.PRIMARY
+        assert read_options('excursions')['read_preference'] == ReadPreference.PRIMARY  # Not requested explicitly
+        collection = Database().get_collection('excursions', read=True)
+        assert collection.read_preference == ReadPreference.PRIMARY
+        collection = Database().get_collection('excursions', read='catalog')
+        assert collection.read_preference == ReadPreference.SECONDARY_PREFERRED
+
+    def test_catalog_reads(self):
+        reads = []
+        get_collection = Database.get_collection
+
+        def record(self, collection, read=False, write=None):
+            if read:
+                reads.append((collection, read))
+            return get_collection(self, collection, read, write)
+
+        Database.get_collection = record
+        try:
+            db.get_points(1)
+            db.get_all_items('objects')
+            db.get_items_by_list_id('objects', [1])
+            assert all(read is True for collection, read in reads)  # Before a write or into a cache
+            reads.clear()
+            db.get_points(1, read='catalog')
+            list(db.iter_all_items('objects', read='catalog'))
+            assert reads == [('excursion_points', 'catalog'), ('objects', 'catalog')]
+        finally:
+            Database.get_collection = get_collection
+
+
+class TestWriteConcern:
+    def test_write_options(self):
+        assert write_options('users')['write_concern'].document == {'w': 'majority', 'j': True, 'wtimeout': 5000}
+        assert write_options('excursions')['write_concern'].document == {}
+        assert write_options('excursions', 'telemetry')['write_concern'].document == {'w': 1, 'j': False}
+        assert Database().get_collection('user_excursions').write_concern.document['w'] == 'majority'
+        assert Database().get_collection('objects', write='telemetry').write_concern.document == {'w': 1, 'j': False}
+
+    def test_durable_writes(self):
+        user = db.add(User('write_concern@email.ru', get_hash_password('Password_1'), 'User'))
+        assert db.activate_user(user.email) is True
+        assert db.get_user_by_email(user.email).is_active is True
+        Database().get_collection('users').delete_many({'email': user.email})
+
+
+class TestCascadeDelete:
+    def teardown_class(cls):
+        for collection in ('excursions', 'excursion_points', 'user_excursions', 'table_keys'):
+            Database().get_collection(collection).delete_many({})
+
+    def test_delete_excursion(self):
+        excursion = db.add(Excursion('Excursion', 'Description', 100.0))
+        other = db.add(Excursion('Other excursion', 'Description', 100.0))
+        db.add_many([ExcursionPoint(excursion._id, 1, 1, 1), ExcursionPoint(excursion._id, 2, 2, 2),
+                     ExcursionPoint(other._id, 1, 1, 1)])
+        db.add_many([UserExcursion(1, excursion._id, True), UserExcursion(1, other._id, True)])
+        deleted = db.delete_excursion(excursion._id)
+        assert deleted.name == excursion.name
+        assert db.get_data_by_id(excursion._id, 'excursions') is None
+        assert db.get_points(excursion._id) == []
+        assert len(db.get_points(other._id)) == 1
+        assert Database().get_collection('user_excursions').count_documents({'id_excursion': excursion._id}) == 1
+        assert db.delete_excursion(excursion._id) is None
+        db.delete_excursion(other._id, user_excursions=True)
+        assert Database().get_collection('user_excursions').count_documents({'id_excursion': other._id}) == 0
+
+
+class TestEntityCache:
+    def setup_class(cls):
+        db.entity_cache.maxsize = 10
+        cls.track = db.add(Track('Track', 'url'))
+
+    def teardown_class(cls):
+        db.entity_cache.maxsize = Config.ENTITY_CACHE_SIZE
+        db.entity_cache.clear()
+        Database().get_collection('tracks').delete_many({})
+        Database().get_collection('table_keys').delete_many({})
+
+    def test_get_data_by_id(self):
+        db.entity_cache.clear()
+        assert db.get_data_by_id(self.track._id, 'tracks').url == 'url'
+        track = db.get_data_by_id(self.track._id, 'tracks')
+        assert (db.entity_cache.hits, db.entity_cache.misses) == (1, 1)
+        track.url = 'changed'  # The cached document is not changed with the entity
+        assert db.get_data_by_id(self.track._id, 'tracks').url == 'url'
+
+    def test_invalidation(self):
+        assert db.find_and_update(self.track._id, 'tracks', {'url': 'new url'}).url == 'new url'
+        assert db.get_data_by_id(self.track._id, 'tracks').url == 'new url'
+        assert [track.url for track in db.get_items_by_list_id('tracks', [self.track._id])] == ['new url']
+        assert db.delete(self.track._id, 'tracks') is True
+        assert db.get_data_by_id(self.track._id, 'tracks') is None
+        assert db.get_items_by_list_id('tracks', [self.track._id]) == []
+
+
+class ListenedCollection:
+    """
+    Collection of a Motor client answering with one document and notifying the listeners like pymongo does
+    in the thread running the command
+    """
+
+    def __init__(self, document: dict):
+        self.document = document
+        self.request_id = 0
+
+    def command(self, name: str, command: dict, reply: dict):
+        self.request_id += 1
+        duration = timedelta(milliseconds=Config.SLOW_QUERY_MS + 1)
+        for listener in (command_metrics, slow_query_log):
+            listener.started(monitoring.CommandStartedEvent(command, 'db', self.request_id, ('localhost', 27017), 1))
+            listener.succeeded(monitoring.CommandSucceededEvent(duration, reply, name, self.request_id,
+                                                                ('localhost', 27017), 1))
+
+    def find_one(self, filter: dict, projection=None) -> dict:
+        self.command('find', {'find': 'tracks', 'filter': filter},
+                     {'cursor': {'id': 0, 'firstBatch': [self.document]}, 'ok': 1})
+        return dict(self.document)
+
+    def find_one_and_update(self, filter: dict, update: dict, **kwargs) -> dict:
+        self.command('findAndModify', {'findAndModify': 'tracks', 'query': filter, 'update': update},
+                     {'value': self.document, 'ok': 1})
+        return dict(self.document)
+
+
+class ListenedClient:
+    def __init__(self, collection: ListenedCollection):
+        self.collection = collection
+
+    def __getitem__(self, name: str) -> 'ListenedClient':
+        return self
+
+    def get_collection(self, name: str, **options):
+        return type('MotorCollection', (), {'delegate': self.collection})()
+
+
+class TestMonitoring:
+    def teardown_class(cls):
+        Database().get_collection('tracks').delete_many({})
+        Database().get_collection('table_keys').delete_many({})
+
+    @pytest.mark.skipif(Config.STORAGE_BACKEND == 'memory', reason='The memory storage sends no commands')
+    def test_commands_tagged(self):
+        command_metrics.reset()
+        track = db.add(Track('Track', 'url'))
+        db.get_data_by_id(track._id, 'tracks')
+        assert command_metrics.latency[('find', 'tracks', 'get_data_by_id')].count == 1
+        assert command_metrics.documents[('find', 'tracks', 'get_data_by_id')] == 1
+        assert command_metrics.documents[('insert', 'tracks', 'add')] == 1
+        assert ('findAndModify', 'table_keys', 'reserve_ids') in command_metrics.latency
+
+    def test_async_commands_tagged(self, monkeypatch):
+        document = {'_id': 1000, 'name': 'Track', 'url': 'url', 'version': 1}
+        monkeypatch.setattr(connection, 'get_async_client', lambda: ListenedClient(ListenedCollection(document)))
+        monkeypatch.setattr(Config, 'SLOW_QUERY_EXPLAIN', False)
+        command_metrics.reset()
+        slow_query_log.reset()
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(async_db.get_data_by_id(1000, 'tracks'))._id == 1000
+            assert loop.run_until_complete(async_db.find_and_update(1000, 'tracks', {'url': 'url'}))._id == 1000
+        finally:
+            loop.close()
+        assert command_metrics.documents == {('find', 'tracks', 'get_data_by_id'): 1,
+                                             ('findAndModify', 'tracks', 'find_and_update'): 1}
+        assert [query['operation'] for query in slow_query_log.recent] == ['get_data_by_id', 'find_and_update']
+        command_metrics.reset()
+        slow_query_log.reset()
+
+    def test_listener(self):
+        command_metrics.reset()
+        command_metrics.started(monitoring.CommandStartedEvent({'find': 'users'}, 'db', 1, ('localhost', 27017), 1))
+        command_metrics.succeeded(monitoring.CommandSucceededEvent(
+            timedelta(milliseconds=3), {'cursor': {'id': 7, 'firstBatch': [{}, {}]}, 'ok': 1}, 'find', 1,
+            ('localhost', 27017), 1))
+        command_metrics.started(monitoring.CommandStartedEvent({'getMore': 7, 'collection': 'users'}, 'db', 2,
+                                                               ('localhost', 27017), 2))
+        command_metrics.failed(monitoring.CommandFailedEvent(timedelta(milliseconds=1), {'code': 43}, 'getMore', 2,
+                                                             ('localhost', 27017), 2))
+        assert command_metrics.documents == {('find', 'users', 'unknown'): 2}
+        assert command_metrics.failures == {('getMore', 'users', 'unknown', '43'): 1}
+        metrics = command_metrics.render()
+        assert 'mongodb_command_duration_seconds_bucket{command="find",collection="users",operation="unknown",' \
+               'le="0.005"} 1' in metrics
+        assert 'mongodb_command_duration_seconds_count{command="getMore",collection="users",operation="unknown"} 1' \
+               in metrics
+
+
+class TestSlowQueries:
+    def setup_class(cls):
+        cls.explained = []
+        cls.log = SlowQueryLog(lambda database, command: cls.explained.append(command) or {'queryPlanner': {
+            'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'keyPattern': {'email': 1}}}}})
+
+    def test_query_shape(self):
+        assert query_shape({'email': 'user@email.ru', 'date': {'$gt': 1}}) == {'email': '?', 'date': {'$gt': '?'}}
+        assert query_shape({'$or': [{'a': 1}, {'b': {'$in': [1, 2]}}]}) == {'$or': [{'a': '?'}, {'b': {'$in': '?'}}]}
+
+    def test_listener(self):
+        command = {'find': 'users', 'filter': {'email': 'user@email.ru'}, 'lsid': {'id': 1}, '$db': 'db'}
+        self.log.started(monitoring.CommandStartedEvent(command, 'db', 1, ('localhost', 27017), 1))
+        self.log.succeeded(monitoring.CommandSucceededEvent(timedelta(milliseconds=1), {'ok': 1}, 'find', 1,
+                                                            ('localhost', 27017), 1))
+        assert len(self.log.recent) == 0  # Faster than the threshold
+        for request_id in (2, 3):
+            self.log.started(monitoring.CommandStartedEvent(command, 'db', request_id, ('localhost', 27017), 1))
+            self.log.succeeded(monitoring.CommandSucceededEvent(
+                timedelta(milliseconds=Config.SLOW_QUERY_MS + 1), {'ok': 1}, 'find', request_id,
+                ('localhost', 27017), 1))
+        self.log.submit(lambda: None).result()  # Waits for the explains
+        assert [query['shape'] for query in self.log.recent] == ["{'email': '?'}"] * 2
+        assert self.explained == [{'find': 'users', 'filter': {'email': 'user@email.ru'}}]  # Once per shape
+        assert self.log.recent[0]['plan'] == 'IXSCAN {email: 1} -> FETCH'
+
+
+class TestMemory:
+    def setup_class(cls):
+        cls.collection = MemoryClient()['test-memory']['items']
+        cls.collection.insert_many([{'_id': id, 'name': f'Item {id}', 'price': 10 * id, 'tags': ['a', str(id)],
+                                     'location': {'lat': id}, 'parent': None if id == 1 else 1}
+                                    for id in range(1, 5)])
+
+    def teardown_class(cls):
+        MemoryClient().drop_database('test-memory')
+
+    def find_ids(self, query: dict) -> list:
+        return [item['_id'] for item in self.collection.find(query)]
+
+    def test_filters(self):
+        assert self.find_ids({'_id': {'$in': [2, 3, 7]}}) == [2, 3]
+        assert self.find_ids({'parent': {'$ne': None}}) == [2, 3, 4]
+        assert self.find_ids({'parent': None}) == [1]
+        assert self.find_ids({'$and': [{'price': {'$gt': 10}}, {'price': {'$lt': 40}}]}) == [2, 3]
+        assert self.find_ids({'$or': [{'name': 'Item 1'}, {'location.lat': 4}]}) == [1, 4]
+        assert self.find_ids({'tags': '3'}) == [3]
+        assert self.find_ids({'price': {'$lt': 'a'}}) == []  # Values of different types do not match
+
+    def test_find(self):
+        items = list(self.collection.find({}, {'name': True}).sort([('price', -1)]).limit(2))
+        assert items == [{'_id': 4, 'name': 'Item 4'}, {'_id': 3, 'name': 'Item 3'}]
+        items[0]['name'] = 'Changed'  # The stored documents are not changed
+        assert self.collection.find_one({'_id': 4})['name'] == 'Item 4'
+
+    def test_updates(self):
+        result = self.collection.update_one({'_id': 1}, {'$set': {'name': 'Item'}, '$inc': {'price': 5}})
+        assert (result.matched_count, result.modified_count) == (1, 1)
+        item = self.collection.find_one_and_update({'_id': 1}, {'$inc': {'version': 1}},
+                                                   return_document=ReturnDocument.AFTER)
+        assert (item['name'], item['price'], item['version']) == ('Item', 15, 1)
+        self.collection.update_one({'name': 'New'}, {'$setOnInsert': {'price': 0}}, upsert=True)
+        assert self.collection.find_one({'name': 'New'})['price'] == 0
+        assert self.collection.find_one_and_delete({'name': 'New'})['price'] == 0
+        assert self.collection.delete_many({'_id': {'$in': [10, 11]}}).deleted_count == 0
+
+    def test_unique(self):
+        with pytest.raises(DuplicateKeyError):
+            self.collection.insert_one({'_id': 1})
+        self.collection.create_index([('name', 1)], name='name_unique', unique=True)
+        with pytest.raises(BulkWriteError) as error:
+            self.collection.insert_many([{'_id': 5, 'name': 'Item 2'}, {'_id': 6, 'name': 'Item 6'}], ordered=False)
+        assert [item['index'] for item in error.value.details['writeErrors']] == [0]
+        assert self.collection.index_information()['name_unique']['unique'] is True
+        self.collection.drop_index('name_unique')
+
+
+class TestIndexes:
+    def teardown_class(cls):
+        db = Database()
+        for collection_name in ['users', 'excursions', 'excursion_points', 'tracks', 'user_excursions',
+                                'refresh_tokens', 'table_keys']:
+            db.get_collection(collection_name).drop_indexes()
+
+    def test_ensure_indexes(self):
+        assert ensure_indexes() == {}
+        assert ensure_indexes() == {}
+        assert index_report() == {}
+
+    def test_index_report(self):
+        tracks = Database().get_collection('tracks')
+        tracks.create_index('url', name='url')
+        tracks.drop_index('name')
+        assert index_report() == {'tracks': {'missing': ['name'], 'extra': ['url']}}
+
+    def test_unique_email(self):
+        ensure_indexes()
+        assert db.add(User('unique@email.ru', get_hash_password('Password_1'), 'User')) is not None
+        assert db.add(User('unique@email.ru', get_hash_password('Password_1'), 'User')) is None
+        Database().get_collection('users').delete_many({})
+        Database().get_collection('table_keys').delete_many({})
+
+
+class TestAsync:
+    def setup_class(cls):
+        cls.loop = asyncio.new_event_loop()
+        cls.user = User('async_user@email.ru', get_hash_password('Password_1'), 'User')
+
+    def teardown_class(cls):
+        db = Database()
+        users = db.get_collection('users')
+        keys = db.get_collection('table_keys')
+        users.delete_many({})
+        keys.delete_many({})
+        db.get_collection('refresh_tokens').delete_many({})
+        cls.loop.close()
+
+    def test_add(self):
+        result = self.loop.run_until_complete(async_db.add(self.user))
+        assert type(result) is User
+        assert result._id == 1
+
+    def test_get_data_by_id(self):
+        user = self.loop.run_until_complete(async_db.get_data_by_id(1, 'users'))
+        assert type(user) is User
+        assert user.email == self.user.email
+
+    def test_get_user_by_email(self):
+        user = self.loop.run_until_complete(async_db.get_user_by_email(self.user.email))
+        assert user._id == 1
+        assert self.loop.run_until_complete(async_db.get_user_by_email('error@email.ru')) is None
+
+    def test_get_all_items(self):
+        users = self.loop.run_until_complete(async_db.get_all_items('users'))
+        assert len(users) == 1
+        assert type(users[0]) is User
+        users = self.loop.run_until_complete(async_db.get_all_items('users', ['email'], limit=1, after=0))
+        assert [user.email for user in users] == [self.user.email]
+
+    def test_find_and_update(self):
+        user = self.loop.run_until_complete(async_db.find_and_update(1, 'users', {'name': 'Async'}))
+        assert user.name == 'Async'
+        assert self.loop.run_until_complete(async_db.find_and_update(2, 'users', {'name': 'Async'})) is None
+
+    def test_activate_user(self):
+        db.principal_cache.set(1, self.loop.run_until_complete(async_db.get_data_by_id(1, 'users', ['_id', 'email'])))
+        assert self.loop.run_until_complete(async_db.activate_user(self.user.email)) is True
+        assert db.principal_cache.get(1) is None
+
+    def test_refresh_tokens(self):
+        expires_at = datetime.utcnow() + timedelta(days=1)
+        assert self.loop.run_until_complete(async_db.add_refresh_token('hash', 1, 'family', expires_at)) is True
+        assert self.loop.run_until_complete(async_db.use_refresh_token('hash'))['family'] == 'family'
+        assert self.loop.run_until_complete(async_db.use_refresh_token('hash')) is None  # The family is revoked
+        assert self.loop.run_until_complete(async_db.revoke_refresh_tokens('hash')) == 0
+
+    def test_delete(self):
+        assert self.loop.run_until_complete(async_db.delete(1, 'users')) is True
+        assert self.loop.run_until_complete(async_db.delete(1, 'users')) is False
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 import copy
 from datetime import timedelta
+from json import loads
 from time import sleep
 
 from starlette.testclient import TestClient
@@ -7,6 +8,7 @@ from starlette.testclient import TestClient
 from app import app
 from config import Config
 from database.connection import Database
+from database.token_versions import token_versions
 
 from models.excursion import Excursion
 from models.excursion_point import ExcursionPoint
@@ -16,6 +18,7 @@ from models.user import User, UserAuth
 
 from utils import auth
 from utils.auth import get_hash_password
+from utils.pagination import encode_key
 
 from controllers.user import login, create_user
 from controllers import excursion as excursion_service
@@ -36,6 +39,8 @@ class TestAuth:
         keys = db.get_collection('table_keys')
         users.delete_many({})
         keys.delete_many({})
+        db.get_collection('refresh_tokens').delete_many({})
+        token_versions.reset()  # The ids of the users are used again
 
     def test_registration(self):
         json = {'email': self.user.email, 'password': 'Password_1', 'name': self.user.name}
@@ -55,8 +60,8 @@ class TestAuth:
                                              'lowercase letters, as well as numbers and special characters'}
 
     def test_confirmation_registration(self):
-        expired_token = auth.create_access_token(data={"sub": self.user.email},
-                                                 expires_delta=timedelta(microseconds=1)).decode()
+        activation = {"sub": self.user.email, "purpose": auth.ACTIVATION_PURPOSE}
+        expired_token = auth.create_access_token(data=activation, expires_delta=timedelta(microseconds=1)).decode()
         access_token = auth.create_access_token(data={"sab": self.user.email},
                                                 expires_delta=timedelta(
                                                     hours=Config.REGISTRATION_EXPIRE_HOURS)).decode()
@@ -72,6 +77,12 @@ class TestAuth:
 
         access_token = auth.create_access_token(data={"sub": self.user.email}, expires_delta=timedelta(
             hours=Config.REGISTRATION_EXPIRE_HOURS)).decode()
+        response = client.post(f'/registration/{access_token}')  # Not an activation token
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Invalid token'}
+
+        access_token = auth.create_access_token(data=activation, expires_delta=timedelta(
+            hours=Config.REGISTRATION_EXPIRE_HOURS)).decode()
         response = client.post(f'/registration/{access_token}')
         assert response.status_code == 200
         assert response.json() == {'detail': 'The user activated'}
@@ -80,7 +91,7 @@ class TestAuth:
         assert response.status_code == 400
         assert response.json() == {'detail': 'Invalid token'}
 
-        access_token = auth.create_access_token(data={"sub": self.user.email},
+        access_token = auth.create_access_token(data=activation,
                                                 expires_delta=timedelta(
                                                     hours=Config.REGISTRATION_EXPIRE_HOURS)).decode()
         response = client.post(f'/registration/{access_token}')
@@ -91,12 +102,34 @@ class TestAuth:
         json = {'email': self.user.email, 'password': 'Password_1'}
         response = client.post('/login', json=json)
         assert response.status_code == 200
-        assert list(response.json().keys()) == ['access_token', 'token_type']
+        assert list(response.json().keys()) == ['access_token', 'token_type', 'refresh_token']
+        TestAuth.headers = response.json()
         json['email'] = 'error@email.ru'
         response = client.post('/login', json=json)
         assert response.status_code == 401
         assert response.json() == {'detail': 'Could not validate credentials'}
 
+    def test_refresh(self):
+        json = {'refresh_token': self.headers['refresh_token']}
+        response = client.post('/refresh', json=json)
+        assert response.status_code == 200
+        refresh_token = response.json()['refresh_token']
+        assert refresh_token != json['refresh_token']
+        response = client.post('/refresh', json=json)
+        assert response.status_code == 401
+        response = client.post('/logout', json={'refresh_token': refresh_token})
+        assert response.status_code == 404  # Revoked with the reused token
+        assert response.json() == {'detail': 'The refresh token was not found'}
+
+    def test_logout_everywhere(self):
+        response = client.post('/login', json={'email': self.user.email, 'password': 'Password_1'})
+        headers = {'jwt': response.json()['access_token']}
+        response = client.post('/logout/all', headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {'detail': 'The tokens revoked'}
+        response = client.post('/logout/all', headers=headers)
+        assert response.status_code == 401
+
 
 class TestObject:
 
@@ -151,6 +184,91 @@ class TestObject:
         assert response.status_code == 404
         assert response.json() == {'detail': 'An object with this id was not found'}
 
+    def test_get_objects_fields(self):
+        response = client.get('/object?fields=id,name', headers=self.headers)
+        assert response.status_code == 200
+        assert response.json() == [{"id": 1, "name": self.obj.name}]
+        response = client.get('/object/1?fields=location', headers=self.headers)
+        assert response.status_code == 200
+        assert response.json() == {"location": {'lat': self.obj.location.lat, 'lon': self.obj.location.lon}}
+        response = client.get('/object?fields=id,hash_password', headers=self.headers)
+        assert response.status_code == 400
+
+    def test_get_objects_pages(self):
+        objects = [object_service.create_object(Object(name=name, description='Description',
+                                                       location={'lat': 0.0, 'lon': 0.0}))
+                   for name in ['C object', 'A object']]
+        response = client.get('/object?limit=2', headers=self.headers)
+        assert response.status_code == 200
+        assert [obj['id'] for obj in response.json()] == [1, 2]
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'/object?limit=2&cursor={cursor}', headers=self.headers)
+        assert [obj['id'] for obj in response.json()] == [3]
+        assert 'X-Next-Cursor' not in response.headers
+        response = client.get('/object?limit=2&sort=name&fields=name', headers=self.headers)
+        assert response.json() == [{'name': 'A object'}, {'name': 'C object'}]
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'/object?limit=2&sort=name&fields=name&cursor={cursor}', headers=self.headers)
+        assert response.json() == [{'name': self.obj.name}]
+        response = client.get(f'/object?limit=2&cursor={cursor}', headers=self.headers)
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Invalid cursor'}
+        for cursor, sort in ((encode_key(5, 'name'), 'name'), (encode_key(['A object', 2]), None)):
+            response = client.get(f'/object?limit=2&cursor={cursor}' + (f'&sort={sort}' if sort else ''),
+                                  headers=self.headers)
+            assert response.status_code == 400  # The key does not match the sort
+            assert response.json() == {'detail': 'Invalid cursor'}
+        for obj in objects:
+            object_service.delete_object(obj._id)
+
+    def test_get_objects_default_limit(self, monkeypatch):
+        objects = [object_service.create_object(Object(name=name, description='Description',
+                                                       location={'lat': 0.0, 'lon': 0.0}))
+                   for name in ['C object', 'A object']]
+        monkeypatch.setattr(Config, 'PAGE_LIMIT', 1)
+        response = client.get('/object', headers=self.headers)  # A client that does not read the pages
+        assert len(response.json()) == 3
+        assert 'X-Next-Cursor' not in response.headers
+        response = client.get(f'/object?cursor={encode_key(1)}', headers=self.headers)
+        assert [obj['id'] for obj in response.json()] == [objects[0]._id]
+        assert 'X-Next-Cursor' in response.headers
+        for obj in objects:
+            object_service.delete_object(obj._id)
+
+    def test_get_objects_ndjson(self):
+        headers = {**self.headers, 'accept': 'application/x-ndjson'}
+        response = client.get('/object', headers=headers)
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        rows = [loads(line) for line in response.text.splitlines()]
+        assert rows == client.get('/object', headers=self.headers).json()
+        response = client.get('/object?fields=id,name', headers=headers)
+        assert [loads(line) for line in response.text.splitlines()] == [{'id': 1, 'name': self.obj.name}]
+
+    def test_get_objects_raw(self):
+        expected = client.get('/object', headers=self.headers).json()
+        Config.RAW_LISTS = True
+        try:
+            response = client.get('/object', headers=self.headers)
+            assert response.status_code == 200
+            assert response.json() == expected
+            response = client.get('/object?fields=id,name&limit=1', headers=self.headers)
+            assert response.json() == [{'id': 1, 'name': self.obj.name}]
+            assert 'X-Next-Cursor' in response.headers
+            headers = {**self.headers, 'accept': 'application/x-ndjson'}
+            response = client.get('/object', headers=headers)
+            assert [loads(line) for line in response.text.splitlines()] == expected
+        finally:
+            Config.RAW_LISTS = False
+
+    def test_metrics(self):
+        assert client.get('/metrics', headers={'jwt': 'key'}).status_code == 401
+        response = client.get('/metrics', headers=self.headers)
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+        assert '# TYPE mongodb_command_duration_seconds histogram' in response.text
+        assert 'cache_hits_total{cache="entity"}' in response.text
+
     def test_edit_object(self):
         json = {'name': 'Name update'}
         self.obj.name = json['name']
@@ -314,6 +432,19 @@ class TestExcursion:
         assert response.status_code == 404
         assert response.json() == {'detail': 'An excursion with this id was not found'}
 
+    def test_edit_excursion_if_match(self):
+        headers = {'jwt': self.jwt['admin']}
+        etag = client.get(f"/excursion/{self.excursions[1]._id}", headers=headers).headers['ETag']
+        response = client.put(f"/excursion/{self.excursions[1]._id}", headers={**headers, 'If-Match': etag},
+                              json={'price': 500.0})
+        assert response.status_code == 200
+        assert response.headers['ETag'] == f'"{int(etag.strip(chr(34))) + 1}"'
+        self.excursions[1].price = 500.0
+        response = client.put(f"/excursion/{self.excursions[1]._id}", headers={**headers, 'If-Match': etag},
+                              json={'price': 600.0})
+        assert response.status_code == 412
+        assert client.get(f"/excursion/{self.excursions[1]._id}", headers=headers).json()['price'] == 500.0
+
     def test_buy_excursion(self):
         headers = {'jwt': self.jwt['user']}
         response = client.post(f"/excursion/{self.excursions[1]._id}", headers=headers)
@@ -1,24 +1,35 @@
+import asyncio
 import unittest
-from datetime import timedelta
-from time import sleep
+from datetime import datetime, timedelta
+from json import loads
+from time import monotonic, sleep
 
 from fastapi import HTTPException
+from jwt import PyJWTError
 from pytest import raises
 
+from config import Config
+from database import db
 from database.connection import Database
-from models.user import User
+from models.user import User, UserAuth
 from utils import auth
 from controllers import user as user_service
+from database.token_versions import TokenVersions, token_versions
 from utils.auth import get_hash_password
+from utils.cache import TTLCache, cache_stats
+from utils.pagination import decode_cursor
+from utils.raw import raw_response
 
 
 class TestUtils:
 
     def setup_class(cls):
         cls.user = {'email': 'user@email.ru', 'password': 'Password_1'}
-        user_service.create_user(User(email=cls.user['email'], hash_password=get_hash_password(cls.user['password']),
-                                      name='User'))
+        cls.user['id'] = user_service.create_user(User(email=cls.user['email'],
+                                                       hash_password=get_hash_password(cls.user['password']),
+                                                       name='User'))._id
         user_service.activate_user(cls.user['email'])
+        cls.claims = {'sub': cls.user['email'], 'uid': cls.user['id']}
         cls.jwt = None
 
     def teardown_class(cls):
@@ -35,19 +46,175 @@ class TestUtils:
         assert auth.checking_password_complexity('NewPassword_3') == 'Hard'
 
     def test_create_access_token(self):
-        TestUtils.jwt = auth.create_access_token(data={"sub": self.user['email']}, expires_delta=timedelta(minutes=15))
+        TestUtils.jwt = auth.create_access_token(data=self.claims, expires_delta=timedelta(minutes=15))
         assert self.jwt is not None
 
     def test_authentication(self):
-        jwt = auth.create_access_token(data={"sub": self.user['email']}, expires_delta=timedelta(microseconds=1))
+        jwt = auth.create_access_token(data=self.claims, expires_delta=timedelta(microseconds=1))
         sleep(1)
         user = auth.authentication(self.jwt)
         assert user.email == self.user['email']
         assert user.is_active is True
         with raises(HTTPException):
             assert auth.authentication(jwt)
+        for claims in ({'sub': self.user['email']}, {**self.claims, 'purpose': auth.ACTIVATION_PURPOSE}):
+            with raises(HTTPException):  # Not an access token
+                auth.authentication(auth.create_access_token(data=claims, expires_delta=timedelta(minutes=15)))
 
+    def test_jwt_cache(self):
+        auth.jwt_cache.clear()
+        token = auth.create_access_token(data=self.claims, expires_delta=timedelta(seconds=1))
+        payload = auth.decode_token(token)
+        assert auth.decode_token(token.decode()) is payload
+        assert auth.get_user_data(token).email == self.user['email']
+        assert auth.jwt_cache.stats()['hits'] == 2
+        assert auth.jwt_cache.stats()['hit_ratio'] == 2 / 3
+        sleep(2)
+        with raises(PyJWTError):  # The entry expired with the token
+            auth.decode_token(token)
+        assert auth.get_user_data(token) is None
+        assert len(auth.jwt_cache) == 0
 
+    def test_authentication_async(self):
+        loop = asyncio.new_event_loop()
+        db.principal_cache.clear()
+        try:
+            user = loop.run_until_complete(auth.authentication_async(self.jwt))
+            assert user.email == self.user['email']
+            assert db.principal_cache.get(user._id) is user
+            with raises(HTTPException) as e:
+                loop.run_until_complete(auth.authentication_async(self.jwt, 'admin'))
+            assert e.value.status_code == 403
+            user_auth = UserAuth(email=self.user['email'], password=self.user['password'])
+            token = loop.run_until_complete(user_service.login_async(user_auth))
+            assert loop.run_until_complete(auth.authentication_async(token.access_token))._id == self.user['id']
+            assert loop.run_until_complete(user_service.refresh_async(token.refresh_token)) is not None
+            assert loop.run_until_complete(user_service.refresh_async(token.refresh_token)) is None  # Used
+        finally:
+            loop.close()
+
+    def test_principal_cache(self):
+        token = user_service.login(UserAuth(email=self.user['email'], password=self.user['password'])).access_token
+        user = auth.authentication(token)
+        assert db.principal_cache.get(user._id) is user
+        assert auth.authentication(token) is user  # Without reading the user
+        with raises(HTTPException) as e:
+            auth.authentication(token, 'admin')
+        assert e.value.status_code == 403
+        user_service.change_role(user._id, 'admin')
+        assert db.principal_cache.get(user._id) is None
+        assert auth.authentication(token, 'admin').role == 'admin'
+        user_service.delete_user(user._id)
+        assert auth.get_user_data(token) is None
+        with raises(HTTPException):
+            auth.authentication(token)
+
+
+class TestTokenVersions:
+
+    def setup_class(cls):
+        cls.user = user_service.create_user(User(email='versions@email.ru', hash_password=get_hash_password('Password_1'),
+                                                 name='User'))
+        user_service.activate_user(cls.user.email)
+
+    def teardown_class(cls):
+        db = Database()
+        db.get_collection('users').delete_many({})
+        db.get_collection('table_keys').delete_many({})
+        db.get_collection('refresh_tokens').delete_many({})
+        token_versions.reset()  # The ids of the users are used again
+
+    def test_revoke_tokens(self):
+        token = user_service.login(UserAuth(email=self.user.email, password='Password_1'))
+        assert auth.authentication(token.access_token).email == self.user.email
+        assert user_service.revoke_tokens(self.user._id).token_version == 1
+        with raises(HTTPException):
+            auth.authentication(token.access_token)
+        assert user_service.refresh(token.refresh_token) is None
+        token = user_service.login(UserAuth(email=self.user.email, password='Password_1'))
+        assert auth.authentication(token.access_token).token_version == 1
+
+    def test_reload(self):
+        versions = TokenVersions('test_token_versions')  # Of another process
+        assert versions.get(self.user._id) == 1
+        assert versions.reloads == 1
+        token = user_service.login(UserAuth(email=self.user.email, password='Password_1')).access_token
+        activation = auth.create_access_token(data={'sub': self.user.email, 'purpose': auth.ACTIVATION_PURPOSE},
+                                              expires_delta=timedelta(hours=1))
+        user_service.deactivate_user(self.user._id)
+        assert auth.get_user_data(token) is None
+        assert auth.get_user_data(activation) is None
+        versions.refresh(force=True)
+        assert versions.get(self.user._id) == 2
+        assert versions.stats() == {'users': 1, 'reloads': 2, 'errors': 0}
+
+    def test_incremental(self):
+        versions = TokenVersions('test_token_versions')
+        loop = asyncio.new_event_loop()
+        try:
+            version = loop.run_until_complete(versions.get_async(self.user._id))
+            since = datetime.utcnow() - timedelta(seconds=1)  # The stored times are rounded to milliseconds
+            user_service.revoke_tokens(self.user._id)
+            changes = db.get_token_versions(since)  # Only the users who revoked their tokens since
+            assert list(changes) == [self.user._id]
+            assert changes[self.user._id][0] == version + 1
+            versions.refresh(monotonic() + Config.TOKEN_VERSIONS_INTERVAL)
+            assert loop.run_until_complete(versions.get_async(self.user._id)) == version + 1
+        finally:
+            loop.close()
+
+    def test_expired(self, monkeypatch):
+        monkeypatch.setattr(Config, 'ACCESS_TOKEN_EXPIRE_MINUTES', 0)
+        monkeypatch.setattr(Config, 'TOKEN_VERSIONS_OVERLAP', 0)
+        versions = TokenVersions('test_token_versions')
+        versions.refresh(force=True)
+        assert versions.get(self.user._id) == 0  # The tokens issued before the revocation are expired
+
+
+class TestCache:
+
+    def test_lru(self):
+        cache = TTLCache('test_lru', 2, 0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+        cache.pop('a')
+        assert cache.get('a', 'default') == 'default'
+        assert (cache.hits, cache.misses) == (3, 2)
+        assert 'test_lru' in cache_stats()
+
+    def test_ttl(self):
+        cache = TTLCache('test_ttl', 10, 0.1)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=0)
+        assert cache.get('a') == 1
+        sleep(0.2)
+        assert cache.get('a') is None
+        assert cache.get('b') == 2
+        assert len(cache) == 1
+
+    def test_disabled(self):
+        cache = TTLCache('test_disabled', 0, 0)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        assert cache.stats()['misses'] == 0
+
+
+class TestRaw:
+    def test_raw_response(self):
+        documents = [{'_id': id, 'name': f'Track {id}', 'url': 'url', 'version': 1} for id in (1, 2)]
+        response = raw_response(documents, ['id', 'name', 'url'], limit=2, sort='name')
+        assert loads(response.body) == [{'id': 1, 'name': 'Track 1', 'url': 'url'},
+                                        {'id': 2, 'name': 'Track 2', 'url': 'url'}]
+        assert decode_cursor(response.headers['X-Next-Cursor'], 'name') == ['Track 2', 2]
+        response = raw_response(documents[:1], ['id', 'description'], limit=2)
+        assert loads(response.body) == [{'id': 1, 'description': None}]
+        assert 'X-Next-Cursor' not in response.headers
 
 
 if __name__ == '__main__':
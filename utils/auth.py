@@ -1,5 +1,12 @@
+import asyncio
+import hashlib
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
+from typing import Tuple
 
 import jwt
 from fastapi import Depends, HTTPException
@@ -9,11 +16,26 @@ from passlib.context import CryptContext
 from starlette import status
 
 from config import Config
-from database import db
+from database import async_db, db
+from database.token_versions import token_versions
 from models.user import User
+from utils.cache import TTLCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=Config.BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=Config.BCRYPT_ROUNDS, bcrypt__max_rounds=Config.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+# Purpose claim of the token of the registration link, such a token is accepted only by the confirmation of the
+# registration and not as an access token
+ACTIVATION_PURPOSE = 'activation'
+# Document fields of the user needed to authorize a request
+AUTH_FIELDS = ['_id', 'email', 'role', 'is_active', 'token_version']
+
+# Claims of the verified tokens: {SHA-256 of a token: payload}, the payloads are not modified
+jwt_cache = TTLCache('jwt', Config.JWT_CACHE_SIZE, Config.JWT_CACHE_TTL)
+
+_password_executor = None
+_password_executor_pid = None
+_password_executor_lock = threading.Lock()
 
 
 def get_strength_point(match) -> int:
@@ -44,6 +66,45 @@ def get_hash_password(password):
     return pwd_context.hash(password)
 
 
+def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, str]:
+    """
+    Verify a password and rehash it if its hash was made with another cost than Config.BCRYPT_ROUNDS
+    :return: (the password is valid, new hash or None)
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def password_executor() -> ThreadPoolExecutor:
+    """
+    Get the pool of the process running bcrypt (Config.PASSWORD_HASH_WORKERS threads), the pool is not inherited by
+    a forked process
+    """
+    global _password_executor, _password_executor_pid
+    pid = os.getpid()
+    if _password_executor_pid != pid:
+        with _password_executor_lock:
+            if _password_executor_pid != pid:
+                _password_executor = ThreadPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS,
+                                                        thread_name_prefix='password-hash')
+                _password_executor_pid = pid
+    return _password_executor
+
+
+async def get_hash_password_async(password) -> str:
+    """
+    Hash a password in the password pool without blocking the event loop
+    """
+    return await asyncio.get_event_loop().run_in_executor(password_executor(), get_hash_password, password)
+
+
+async def verify_and_update_password_async(plain_password, hashed_password) -> Tuple[bool, str]:
+    """
+    verify_and_update_password in the password pool without blocking the event loop
+    """
+    return await asyncio.get_event_loop().run_in_executor(password_executor(), verify_and_update_password,
+                                                          plain_password, hashed_password)
+
+
 def create_access_token(*, data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -55,39 +116,157 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-def authentication(token: str = Depends(oauth2_scheme), role: str = 'user') -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    access_exception = HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No access rights")
+def hash_token(token: str) -> str:
+    """
+    :return: SHA-256 of a random token to store instead of the token, e.g. a refresh token
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
 
-    try:
-        payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    user = db.get_user_by_email(email)
+
+def get_cached_user(uid: int) -> User:
+    """
+    Get a user by id from the principal cache or the database
+    :param uid: user id
+    :return: user with the fields AUTH_FIELDS or None if the user does not exist
+    """
+    user = db.principal_cache.get(uid)
+    if user is None:
+        user = db.get_data_by_id(uid, 'users', AUTH_FIELDS)
+        if user is None:
+            return None
+        db.principal_cache.set(uid, user)
+    return user
+
+
+async def get_cached_user_async(uid: int) -> User:
+    """
+    get_cached_user reading the database without blocking the event loop
+    """
+    user = db.principal_cache.get(uid)
+    if user is None:
+        user = await async_db.get_data_by_id(uid, 'users', AUTH_FIELDS)
+        if user is None:
+            return None
+        db.principal_cache.set(uid, user)
+    return user
+
+
+def decode_token(token) -> dict:
+    """
+    Verify a token and get its claims, a verified token is not verified again until it expires
+    :param token: Json Web Token
+    :return: claims of the token
+    :raise PyJWTError: the token is not valid or expired
+    """
+    key = hashlib.sha256(token if isinstance(token, bytes) else token.encode()).digest()
+    payload = jwt_cache.get(key)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
+    expires = payload.get('exp')
+    ttl = None if expires is None else expires - time.time()
+    if ttl is None or ttl > 0:
+        jwt_cache.set(key, payload, ttl)
+    return payload
+
+
+def is_access_token(payload: dict) -> bool:
+    """
+    Check the claims of a decoded token: the tokens without the uid claim (e.g. of the registration links) and with
+    a purpose are not access tokens. A token with a version (ver claim) lower than the version of its user
+    in token_versions is revoked
+    :param payload: claims of the token
+    :return: True if the token can authorize a request
+    """
+    email, uid = payload.get('sub'), payload.get('uid')
+    if email is None or uid is None or payload.get('purpose') is not None:
+        return False
+    return payload.get('ver', 0) >= token_versions.get(uid)
+
+
+async def is_access_token_async(payload: dict) -> bool:
+    """
+    is_access_token reading the token versions without blocking the event loop
+    """
+    email, uid = payload.get('sub'), payload.get('uid')
+    if email is None or uid is None or payload.get('purpose') is not None:
+        return False
+    return payload.get('ver', 0) >= await token_versions.get_async(uid)
+
+
+def check_principal(user: User, payload: dict) -> User:
+    """
+    :param user: user of the uid claim of an access token or None
+    :param payload: claims of the token
+    :return: the user or None if the user does not exist, is not active or has another email
+    """
+    if user is None or user.email != payload['sub']:  # The token of a deleted user
+        return None
+    if user.is_active is not True:
+        return None
+    return user
+
+
+def get_principal(payload: dict) -> User:
+    """
+    Get the user of a decoded access token by the uid claim from the principal cache or the database
+    :param payload: claims of the token
+    :return: user with the fields AUTH_FIELDS or None if the user does not exist, is not active or the token is
+    not valid
+    """
+    if not is_access_token(payload):
+        return None
+    return check_principal(get_cached_user(payload['uid']), payload)
+
+
+async def get_principal_async(payload: dict) -> User:
+    """
+    get_principal reading the database without blocking the event loop
+    """
+    if not await is_access_token_async(payload):
+        return None
+    return check_principal(await get_cached_user_async(payload['uid']), payload)
+
+
+def check_role(user: User, role: str) -> User:
+    """
+    :param user: user of the access token or None if the token is not valid
+    :param role: role required by the request
+    :return: the user
+    :raise HTTPException: 401 if the token is not valid, 403 if the user has no access rights
+    """
     if user is None:
-        raise credentials_exception
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
     elif user.role == 'user' != role:
-        raise access_exception
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No access rights")
     return user
 
 
+def authentication(token: str = Depends(oauth2_scheme), role: str = 'user') -> User:
+    try:
+        payload = decode_token(token)
+    except PyJWTError:
+        return check_role(None, role)
+    return check_role(get_principal(payload), role)
+
+
+async def authentication_async(token: str, role: str = 'user') -> User:
+    """
+    authentication of the async routes, a user missing in the principal cache is read without blocking
+    the event loop
+    """
+    try:
+        payload = decode_token(token)
+    except PyJWTError:
+        return check_role(None, role)
+    return check_role(await get_principal_async(payload), role)
+
+
 def get_user_data(token: str = Depends(oauth2_scheme)) -> User:
     try:
-        payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
+        payload = decode_token(token)
     except PyJWTError as e:
         print(f"Error: {e}")
         return None
-    db_user = db.get_user_by_email(email)
-    if db_user is None:
-        return None
-    return db_user
+    return get_principal(payload)
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+# Caches of the process by name (objects with the stats method), their counters are reported by GET /statistics/cache
+CACHES: Dict[str, Any] = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with LRU eviction and a time to live of the entries
+    The cache with maxsize 0 is disabled: nothing is stored and the counters are not updated
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name: str = name
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl  # seconds, 0 - the entries do not expire
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._data: OrderedDict = OrderedDict()  # {key: (expiration time, value)}, the least recently used first
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def __repr__(self):
+        return f"TTLCache: {self.name} | size: {len(self._data)}/{self.maxsize} | ttl: {self.ttl} | " \
+               f"hits: {self.hits} | misses: {self.misses}"
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value from the cache
+        :param key: key of the entry
+        :param default: value returned if the entry is missing or expired
+        :return: cached value or default
+        """
+        if self.maxsize <= 0:
+            return default
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and (entry[0] is None or entry[0] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:  # Expired
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """
+        Put a value into the cache, the least recently used entry is evicted if the cache is full
+        :param key: key of the entry
+        :param value: value to cache
+        :param ttl: time to live of the entry in seconds, None - the ttl of the cache
+        """
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        """
+        Remove an entry from the cache
+        :param key: key of the entry
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Hashable, Any], bool]):
+        """
+        Remove the entries matching a condition
+        :param predicate: function(key, value) -> True to remove the entry
+        """
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache
+        :return: {'size', 'maxsize', 'hits', 'misses', 'evictions', 'hit_ratio'}
+        """
+        requests = self.hits + self.misses
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_ratio': self.hits / requests if requests else 0.0}
+
+
+def cache_stats() -> dict:
+    """
+    Get the counters of all caches of the process
+    :return: {cache name: counters}
+    """
+    return {name: cache.stats() for name, cache in CACHES.items()}
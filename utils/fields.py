@@ -0,0 +1,46 @@
+from typing import List, Type
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette import status
+
+
+def parse_fields(fields: str, model: Type[BaseModel]) -> List[str]:
+    """
+    Parse the fields query parameter of a list or detail endpoint
+    :param fields: comma-separated names of the response fields, e.g. "id,name,price"
+    :param model: response model
+    :return: names of the requested fields or None if the whole response is requested
+    """
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in model.__fields__]
+    if not names or unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Unknown fields: {", ".join(unknown)}. '
+                                                                            'Available fields: '
+                                                                            f'{", ".join(model.__fields__)}')
+    return names
+
+
+def document_fields(fields: List[str], *required: str) -> List[str]:
+    """
+    Get the document fields to read for the requested response fields
+    :param fields: names of the response fields or None
+    :param required: document fields needed to handle the request, None values are skipped
+    :return: names of the document fields or None if the whole document is needed
+    """
+    if fields is None:
+        return None
+    return list({'_id' if name == 'id' else name: None for name in (*fields, *required) if name is not None})
+
+
+def sparse_out(entity, fields: List[str]) -> dict:
+    """
+    Get the requested fields of the response from an entity
+    :param entity: entity read with the projection of document_fields
+    :param fields: names of the response fields
+    :return: trimmed response
+    """
+    return jsonable_encoder({name: getattr(entity, '_id' if name == 'id' else name) for name in fields})
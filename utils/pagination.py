@@ -0,0 +1,100 @@
+import base64
+import binascii
+import json
+from typing import List
+
+from fastapi import HTTPException
+from starlette import status
+from starlette.responses import Response
+
+from config import Config
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def page_limit(limit: int, cursor: str = None) -> int:
+    """
+    Get the number of items on a page
+    :param limit: limit requested by the client or None
+    :param cursor: cursor requested by the client or None
+    :return: limit not greater than Config.PAGE_LIMIT_MAX, Config.PAGE_LIMIT for a cursor without a limit,
+             None - the whole list for the clients that do not read the pages (neither limit nor cursor)
+    """
+    if limit is None:
+        return None if cursor is None else Config.PAGE_LIMIT
+    return min(limit, Config.PAGE_LIMIT_MAX)
+
+
+def parse_sort(sort: str, allowed: List[str]) -> str:
+    """
+    Check the field to sort a list by
+    :param sort: name of the field or None to sort by id
+    :param allowed: names of the fields that can be used for sorting
+    :return: name of the field
+    """
+    if sort is not None and sort not in allowed:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Unable to sort by {sort}. Available '
+                                                                            f'fields: {", ".join(allowed)}')
+    return sort
+
+
+def encode_cursor(entity, sort: str = None) -> str:
+    """
+    Create an opaque cursor pointing after the entity
+    :param entity: the last entity of the page
+    :param sort: name of the field the list is sorted by
+    :return: cursor
+    """
+    key = entity._id if sort is None else [getattr(entity, sort), entity._id]
+    return encode_key(key, sort)
+
+
+def encode_key(key, sort: str = None) -> str:
+    """
+    Create an opaque cursor from the key of the last entity of a page
+    :param key: _id, or [sort field value, _id] if sort is set
+    :param sort: name of the field the list is sorted by
+    :return: cursor
+    """
+    data = json.dumps({'key': key, 'sort': sort}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str = None):
+    """
+    Get the key of the last entity of the previous page from the cursor
+    :param cursor: cursor from the previous response or None
+    :param sort: name of the field the list is sorted by, must be the same as for the previous page
+    :return: key of the entity (see db.find_page) or None for the first page
+    """
+    if cursor is None:
+        return None
+    invalid_cursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key = data['key']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise invalid_cursor
+    if data.get('sort') != sort:
+        raise invalid_cursor
+    if sort is None:
+        valid = type(key) is int
+    else:  # [value, _id], the value is a JSON scalar
+        valid = type(key) is list and len(key) == 2 and type(key[1]) is int and not isinstance(key[0], (list, dict))
+    if not valid:
+        raise invalid_cursor
+    return key
+
+
+def set_next_cursor(response: Response, items: list, limit: int, sort: str = None) -> Response:
+    """
+    Add the cursor of the next page to the response headers if the page is full
+    :param response: response of the endpoint
+    :param items: entities of the page
+    :param limit: number of items on a page, None - the whole list
+    :param sort: name of the field the list is sorted by
+    :return: response
+    """
+    if limit is not None and items and len(items) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1], sort)
+    return response
@@ -0,0 +1,47 @@
+import json
+from typing import Iterable, List
+
+from starlette.responses import Response
+
+from utils.pagination import NEXT_CURSOR_HEADER, encode_key
+
+
+def raw_row(document: dict, fields: List[str]) -> str:
+    """
+    Encode a document as the JSON row of a response
+    :param document: document read from the database
+    :param fields: names of the response fields, id is the _id of the document
+    :return: JSON object with the fields in the given order, the missing fields are null
+    """
+    return json.dumps({field: document.get('_id' if field == 'id' else field) for field in fields})
+
+
+def raw_serializer(fields: List[str]):
+    """
+    Get the serializer of the documents of a stream, see utils.streaming
+    :param fields: names of the response fields
+    :return: function returning the JSON row of a document
+    """
+    return lambda document: raw_row(document, fields)
+
+
+def raw_response(documents: Iterable[dict], fields: List[str], limit: int, sort: str = None) -> Response:
+    """
+    Build the JSON response of a page from the documents as they are read, without the entities and the response
+    models
+    :param documents: documents of the page, e.g. db.iter_raw_items
+    :param fields: names of the response fields
+    :param limit: number of items on a page, the cursor of the next page is set if the page is full, None - the whole
+                  list
+    :param sort: name of the field the list is sorted by
+    :return: response
+    """
+    rows = []
+    document = None
+    for document in documents:
+        rows.append(raw_row(document, fields))
+    response = Response('[' + ','.join(rows) + ']', media_type='application/json')
+    if limit is not None and rows and len(rows) >= limit:
+        key = document['_id'] if sort is None else [document.get(sort), document['_id']]
+        response.headers[NEXT_CURSOR_HEADER] = encode_key(key, sort)
+    return response
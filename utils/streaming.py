@@ -0,0 +1,57 @@
+import json
+from typing import Callable, Iterable, Iterator, List
+
+from starlette.responses import StreamingResponse
+
+from utils.fields import sparse_out
+
+NDJSON = 'application/x-ndjson'
+NDJSON_CHUNK_SIZE = 100  # Number of rows written to the socket at once
+
+
+def wants_ndjson(accept: str) -> bool:
+    """
+    Check whether the client asked for a stream of JSON rows
+    :param accept: Accept header of the request
+    :return: True for application/x-ndjson
+    """
+    return accept is not None and NDJSON in accept
+
+
+def ndjson_rows(items: Iterable, serialize: Callable[..., str]) -> Iterator[str]:
+    """
+    Serialize the items to JSON lines lazily, the lines are grouped into chunks to limit the number of writes
+    :param items: iterator of entities, e.g. over a database cursor
+    :param serialize: function returning the JSON representation of an entity
+    :return: iterator of chunks
+    """
+    chunk = []
+    for item in items:
+        chunk.append(serialize(item))
+        if len(chunk) >= NDJSON_CHUNK_SIZE:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def ndjson_response(items: Iterable, serialize: Callable[..., str]) -> StreamingResponse:
+    """
+    Stream the items as newline-delimited JSON, the memory does not depend on the number of items
+    :param items: iterator of entities
+    :param serialize: function returning the JSON representation of an entity
+    :return: streaming response, the iterator is consumed in the thread pool
+    """
+    return StreamingResponse(ndjson_rows(items, serialize), media_type=NDJSON)
+
+
+def row_serializer(fields: List[str], out: Callable) -> Callable[..., str]:
+    """
+    Get the serializer of the rows of a stream
+    :param fields: requested fields of the response or None for the whole response model
+    :param out: method of the entity building its response model, e.g. Excursion.excursion_out
+    :return: function returning the JSON representation of an entity
+    """
+    if fields is None:
+        return lambda entity: out(entity).json()
+    return lambda entity: json.dumps(sparse_out(entity, fields))
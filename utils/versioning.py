@@ -0,0 +1,31 @@
+from fastapi import HTTPException
+from starlette import status
+from starlette.responses import Response
+
+
+def parse_if_match(if_match: str) -> int:
+    """
+    Get the version an update expects from the If-Match header
+    :param if_match: value of the header, the ETag of the entity: "3" or W/"3"
+    :return: version or None if the header is not set
+    """
+    if if_match is None:
+        return None
+    value = if_match.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='If-Match must be the ETag of the entity')
+
+
+def set_etag(response: Response, entity):
+    """
+    Set the ETag header to the version of the entity, the entities without a version have no ETag
+    :param response: response of the request
+    :param entity: entity with the version field
+    """
+    version = getattr(entity, 'version', None)
+    if version is not None:
+        response.headers['ETag'] = f'"{version}"'